@@ -3,7 +3,8 @@
 # 데이터 필터링, 최신 데이터 조회, CSV 내보내기 등의 기능을 제공합니다.
 
 from flask import Flask, render_template, request
-from pymongo import MongoClient, DESCENDING
+from pymongo import DESCENDING
+import mongo
 from flask_caching import Cache
 import csv
 import io
@@ -25,21 +26,10 @@ cache = Cache(app)
 # 로그 설정
 logging.basicConfig(level=logging.INFO)
 
-# MongoDB 연결 함수
-def get_db():
-    uri = os.getenv('MONGO_URI', '').strip().lstrip('=')
-    if uri:
-        client = MongoClient(uri)
-        logging.info('원격 MongoDB 연결 성공')
-    else:
-        client = MongoClient('mongodb://localhost:27017/')
-        logging.info('로컬 MongoDB 연결 성공')
-    return client['Data']
-
-db = get_db()
-radiation_collection = db['NPP_radiation']
-weather_collection = db['NPP_weather']
-stats_collection = db['radiation_stats']
+# MongoDB 연결 (공유 커넥션 풀, 첫 사용 시 연결)
+radiation_collection = mongo.collection('NPP_radiation')
+weather_collection = mongo.collection('NPP_weather')
+stats_collection = mongo.collection('radiation_stats')
 
 # 유틸리티 함수: datetime 문자열 파싱
 def parse_datetime(dt_str):
@@ -118,14 +108,6 @@ def filter_data():
         return render_template('filter.html', data=data)
     return render_template('filter.html', data=[])
 
-# Graceful shutdown
-def shutdown_db():
-    db.client.close()
-    logging.info("MongoDB 연결 종료")
-
-# 스크립트 종료 시 연결 종료 등록
-atexit.register(shutdown_db)
-
 # 앱 실행
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=False)
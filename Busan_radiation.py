@@ -1,16 +1,24 @@
 # busan_radiation.py
 # 이 스크립트는 부산의 환경 방사선 데이터를 공공 API에서 가져와 MongoDB에 저장합니다.
-# 데이터 백업 및 오류 로깅 기능이 포함되어 있으며, 60분마다 실행됩니다.
+# 측정소·일자별 이력 저장 및 오류 로깅 기능이 포함되어 있으며, 60분마다 실행됩니다.
 
 import requests
-from pymongo import MongoClient
+from requests.adapters import HTTPAdapter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import logging
 import schedule
 import time
-import atexit
 import sys
 import os
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from xml.etree import ElementTree as ET
+from xml_stream import parse_busan, to_float
+import fingerprint
+import metrics
+import mongo
+import rollups
 from datetime import datetime, timedelta
 
 # 로그 설정
@@ -21,53 +29,151 @@ logging.basicConfig(
 )
 
 # 공공 API 설정
-BASE_URL = "http://apis.data.go.kr/6260000/EnvironmentalRadiationInfoService"
+# BUSAN_BASE_URL로 API 주소를 바꿀 수 있음 (예: mock_api_server.py로 로컬 벤치마크)
+BASE_URL = os.getenv("BUSAN_BASE_URL", "http://apis.data.go.kr/6260000/EnvironmentalRadiationInfoService").rstrip("/")
 SERVICE_KEY = os.getenv("Service_key") or ""
+NUM_OF_ROWS = 100  # 페이지당 측정소 수
+MAX_PAGE_WORKERS = 4  # 동시에 요청할 최대 페이지 수
+REQUEST_TIMEOUT = (5, 20)  # (연결, 읽기) 타임아웃(초)
 
-# MongoDB 연결 함수
-def get_mongo_connection():
-    """
-    MongoDB에 연결하고 클라이언트를 반환합니다.
-    연결에 실패하면 스크립트를 종료합니다.
-    """
+# MongoDB 초기화 (공유 커넥션 풀, 첫 사용 시 연결)
+# 이력 컬렉션의 (locNm, day) unique 인덱스는 db_indexes.ensure_indexes()에서 생성
+db = mongo.database()
+radiation_collection = mongo.collection('Busan_radiation')
+history_collection = mongo.collection('Busan_radiation_history')  # 측정소·일자별 이력 버킷
+
+# 측정값을 측정소·일자별 버킷 문서로 이력 컬렉션에 기록
+# 버킷 구조: {locNm, day, readings: {"HHMM": {...}}, first_time, last_time}
+# 측정 시각(HHMM)을 키로 $set 하므로 같은 측정값을 여러 번 기록해도 중복되지 않습니다.
+def store_history(records):
+    buckets = {}
+    for record in records:
+        check_time = record['checkTime']
+        day = datetime.combine(check_time.date(), datetime.min.time())
+        bucket = buckets.setdefault((record['locNm'], day), {'$set': {}, 'times': []})
+        reading = {
+            'checkTime': check_time,
+            'data': record['dose_nSv_h'],
+            'dose_microSv_h': record['dose_microSv_h']
+        }
+        if 'aveRainData' in record:
+            reading['aveRainData'] = record['aveRainData']
+        bucket['$set'][f"readings.{check_time.strftime('%H%M')}"] = reading
+        bucket['times'].append(check_time)
+    if not buckets:
+        return 0
+
+    now = datetime.now()
+    operations = [
+        UpdateOne(
+            {'locNm': loc, 'day': day},
+            {'$set': {**bucket['$set'], 'updated_at': now},
+             '$min': {'first_time': min(bucket['times'])},
+             '$max': {'last_time': max(bucket['times'])}},
+            upsert=True
+        )
+        for (loc, day), bucket in buckets.items()
+    ]
+    with metrics.WRITE_SECONDS.time(job="Busan_radiation", collection="Busan_radiation_history"):
+        history_collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+# 기존 일자별 백업 컬렉션(Busan_radiation_backup*)을 이력 컬렉션으로 옮김 (1회성)
+def import_legacy_backups():
+    names = [name for name in db.list_collection_names() if name.startswith('Busan_radiation_backup')]
+    for name in sorted(names):
+        records = []
+        for doc in db[name].find({}, {'_id': 0}):
+            check_time = doc.get('checkTime')
+            if isinstance(check_time, str):
+                try:
+                    check_time = datetime.strptime(check_time, '%Y-%m-%d %H:%M:%S')
+                except ValueError:
+                    continue
+            dose_nSv_h = doc.get('dose_nSv_h', doc.get('data'))
+            if not (doc.get('locNm') and check_time and dose_nSv_h is not None):
+                continue
+            record = {
+                'locNm': doc['locNm'],
+                'checkTime': check_time,
+                'dose_nSv_h': float(dose_nSv_h),
+                'dose_microSv_h': round(float(dose_nSv_h) / 1000.0, 5)
+            }
+            ave_rain = doc.get('aveRainData')
+            if ave_rain is not None and to_float(str(ave_rain)) is not None:
+                record['aveRainData'] = to_float(str(ave_rain))
+            records.append(record)
+            if len(records) >= 1000:
+                store_history(records)
+                records = []
+        if records:
+            store_history(records)
+        logging.info(f"{name} 이력 이관 완료")
+
+def create_http_session(pool_size=MAX_PAGE_WORKERS):
+    """페이지 요청이 공유하는 커넥션 풀 세션을 생성"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+# 한 페이지 요청 후 스트리밍 파싱하여 (측정값 목록, 헤더, 본문 해시) 반환
+def fetch_page(page_no):
+    params = {
+        'serviceKey': SERVICE_KEY,
+        'pageNo': str(page_no),
+        'numOfRows': str(NUM_OF_ROWS),
+        'resultType': 'xml'
+    }
+    started = time.perf_counter()
     try:
-        uri = os.getenv("MONGO_URI", "").strip()
-        if uri:
-            client = MongoClient(uri)
-            logging.info("원격 MongoDB 연결 성공")
-        else:
-            client = MongoClient("mongodb://localhost:27017/")
-            logging.info("로컬 MongoDB 연결 성공")
-        return client
-    except Exception as e:
-        logging.error(f"MongoDB 연결 실패: {e}", exc_info=True)
-        sys.exit(1)
-
-# MongoDB 초기화
-client = get_mongo_connection()
-db = client['Data']
-radiation_collection = db['Busan_radiation']
-
-# 기존 데이터를 백업 컬렉션으로 이동 (매일 자정 실행)
-def backup_existing_data():
-    today = datetime.now().strftime("%Y_%m_%d")
-    backup_name = f"Busan_radiation_backup_{today}"
-    backup_col = db[backup_name]
-
-    if backup_col.count_documents({}) == 0:
-        docs = list(radiation_collection.find({}))
-        if docs:
-            try:
-                backup_col.insert_many(docs)
-                logging.info(f"데이터 백업 완료: {backup_name}")
-            except Exception as e:
-                logging.warning(f"백업 중 일부 오류 발생: {e}")
-        else:
-            logging.info("백업할 데이터가 없습니다.")
-    else:
-        logging.info(f"{backup_name} 백업 이미 존재, 건너뜀.")
-
-# 공공 데이터 API에서 방사선량 정보 가져와 저장
+        response = http_session.get(f"{BASE_URL}/getEnvironmentalRadiationInfo", params=params,
+                                    timeout=REQUEST_TIMEOUT, stream=True)
+    except requests.exceptions.RequestException as e:
+        metrics.HTTP_ERRORS.inc(job="Busan_radiation", endpoint="getEnvironmentalRadiationInfo", error=type(e).__name__)
+        raise
+    finally:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started,
+                                     job="Busan_radiation", endpoint="getEnvironmentalRadiationInfo")
+    with response:
+        response.raise_for_status()
+        header = {}
+        body = fingerprint.HashingStream(response)
+        with metrics.PARSE_SECONDS.time(job="Busan_radiation"):  # 본문 수신 포함
+            items = list(parse_busan(body, header))
+    return items, header, body.hexdigest()
+
+
+# 측정값 하나를 저장용 레코드로 변환 (필수 필드 누락 시 None)
+def build_record(item, fetched_at):
+    if not (item.locNm and item.checkTime and item.dose_nSv_h is not None):
+        logging.warning(f"누락된 필드: loc={item.locNm}, time={item.checkTime}, data={item.dose_nSv_h}")
+        return None
+
+    record = {
+        'locNm': item.locNm,
+        'checkTime': item.checkTime,
+        'dose_nSv_h': item.dose_nSv_h,
+        'dose_microSv_h': round(item.dose_nSv_h / 1000.0, 5),
+        'fetched_at': fetched_at
+    }
+    # 좌표는 숫자로 저장
+    for field in ('lat', 'lng'):
+        value = getattr(item, field)
+        if value is not None:
+            record[field] = value
+    if item.aveRainData is not None:
+        record['aveRainData'] = item.aveRainData
+    return record
+
+
+# 공공 데이터 API에서 전체 측정소 방사선량 정보를 가져와 저장
 def fetch_radiation_data():
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logging.info(f"데이터 수집 시작: {now}")
@@ -76,69 +182,111 @@ def fetch_radiation_data():
         logging.error("서비스 키 미설정: Service_key 환경변수를 확인하세요.")
         return
     try:
-        params = {
-            'serviceKey': SERVICE_KEY,
-            'pageNo': '1',
-            'numOfRows': '10',
-            'resultType': 'xml'
-        }
-        response = requests.get(f"{BASE_URL}/getEnvironmentalRadiationInfo", params=params, timeout=10)
-        response.raise_for_status()
+        # 첫 페이지에서 totalCount를 읽어 나머지 페이지 수 계산
+        items, header, first_digest = fetch_page(1)
+        pages = {1: (items, first_digest)}
+        total_count = int(header.get('totalCount') or 0)
+        if not items:
+            logging.error("API 응답에 item 없음")
+            return
+        page_count = max(1, math.ceil(total_count / NUM_OF_ROWS))
 
-        root = ET.fromstring(response.content)
-        items = root.findall('.//item')
+        # 나머지 페이지는 제한된 동시성으로 병렬 요청
+        failed_pages = []
+        if page_count > 1:
+            with ThreadPoolExecutor(max_workers=MAX_PAGE_WORKERS, thread_name_prefix="busan_page") as executor:
+                futures = {executor.submit(fetch_page, page_no): page_no for page_no in range(2, page_count + 1)}
+                for future in as_completed(futures):
+                    try:
+                        page_items, _, page_digest = future.result()
+                        pages[futures[future]] = (page_items, page_digest)
+                    except (requests.exceptions.RequestException, ET.ParseError) as e:
+                        failed_pages.append(futures[future])
+                        metrics.FAILURES.inc(job="Busan_radiation",
+                                             stage="parse" if isinstance(e, ET.ParseError) else "fetch")
+                        logging.error(f"{futures[future]} 페이지 요청 오류: {e}")
 
-        if not items:
-            logging.error(f"API 응답에 item 없음, 상태 코드: {response.status_code}")
+        # 전체 페이지 응답이 이전과 같으면 저장 생략 (페이지별 해시를 페이지 순서대로 합친 해시)
+        digest = fingerprint.body_hash("".join(pages[page_no][1] for page_no in sorted(pages)).encode())
+        if not failed_pages and fingerprint.is_unchanged("busan_radiation", digest):
+            fingerprint.record_cycle("Busan_radiation", skipped=True)
+            logging.info("부산 방사선 데이터 변경 없음, 건너뜀.")
             return
+        for page_no in sorted(pages):
+            if page_no > 1:
+                items.extend(pages[page_no][0])
+        logging.info(f"측정소 {len(items)}/{total_count}건 수신 ({page_count}페이지)")
+
+        # (locNm, checkTime) 기준 중복 제거 후 한 번의 bulk_write로 저장
+        fetched_at = datetime.now()
+        records = {}
         for item in items:
-            loc = item.findtext('locNm')
-            time_str = item.findtext('checkTime')
-            data_str = item.findtext('data')
-            if not (loc and time_str and data_str):
-                logging.warning(f"누락된 필드: loc={loc}, time={time_str}, data={data_str}")
-                continue
-            try:
-                check_time = datetime.strptime(time_str, '%Y%m%d%H%M')
-                dose_nSv_h = float(data_str)
-                dose_uSv_h = dose_nSv_h / 1000.0
-
-                record = {
-                    'locNm': loc,
-                    'checkTime': check_time,
-                    'dose_nSv_h': dose_nSv_h,
-                    'dose_microSv_h': round(dose_uSv_h, 5),
-                    'fetched_at': datetime.now()
-                }
-                radiation_collection.update_one(
-                    {'locNm': loc, 'checkTime': check_time},
-                    {'$set': record},
-                    upsert=True
-                )
-                logging.info(f"저장 완료: {loc} {dose_uSv_h:.3f} μSv/h at {check_time}")
-            except Exception as e:
-                logging.error(f"데이터 처리 오류: loc={loc}, time={time_str}, data={data_str}: {e}")
+            record = build_record(item, fetched_at)
+            if record:
+                records[(record['locNm'], record['checkTime'])] = record
+        if not records:
+            logging.warning("저장할 데이터가 없습니다.")
+            return
+
+        operations = [
+            UpdateOne({'locNm': loc, 'checkTime': check_time}, {'$set': record}, upsert=True)
+            for (loc, check_time), record in records.items()
+        ]
+        with metrics.WRITE_SECONDS.time(job="Busan_radiation", collection="Busan_radiation"):
+            result = radiation_collection.bulk_write(operations, ordered=False)
+        metrics.record_rows("Busan_radiation", inserted=result.upserted_count, updated=result.modified_count,
+                            skipped=result.matched_count - result.modified_count)
+        logging.info(
+            f"저장 완료: 신규 {result.upserted_count}건, 일치 {result.matched_count}건, 변경 {result.modified_count}건")
+
+        # 이력 컬렉션에 증분 기록
+        bucket_count = store_history(records.values())
+        logging.info(f"이력 저장 완료: 버킷 {bucket_count}건 갱신")
+
+        # 새로 저장된 측정값만 시간/일 요약에 반영
+        record_list = list(records.values())
+        try:
+            with metrics.WRITE_SECONDS.time(job="Busan_radiation", collection="Busan_radiation_rollups"):
+                rollups.apply(db, "Busan_radiation", [record_list[index] for index in result.upserted_ids])
+        except Exception as e:
+            logging.error(f"요약 데이터 갱신 중 오류 발생: {e}")
+            metrics.FAILURES.inc(job="Busan_radiation", stage="rollup")
+
+        # 모든 페이지를 저장한 경우에만 지문으로 기록
+        if not failed_pages:
+            fingerprint.remember("busan_radiation", digest, max(check_time for _, check_time in records))
+        fingerprint.record_cycle("Busan_radiation", skipped=False)
     except requests.exceptions.Timeout as e:
         logging.error(f"API 요청 시간 초과: {e}")
+        metrics.FAILURES.inc(job="Busan_radiation", stage="fetch")
     except requests.exceptions.RequestException as e:
         logging.error(f"API 요청 오류: {e}")
+        metrics.FAILURES.inc(job="Busan_radiation", stage="fetch")
     except ET.ParseError as e:
         logging.error(f"XML 파싱 오류: {e}")
+        metrics.FAILURES.inc(job="Busan_radiation", stage="parse")
+    except BulkWriteError as e:
+        logging.error(f"bulk_write 일부 실패: {len(e.details.get('writeErrors', []))}건 오류")
+        metrics.FAILURES.inc(job="Busan_radiation", stage="write")
     except Exception as e:
         logging.error(f"예기치 않은 오류: {e}", exc_info=True)
+        metrics.FAILURES.inc(job="Busan_radiation", stage="other")
 
-# 스케줄링
-schedule.every(60).minutes.do(lambda: (backup_existing_data(), fetch_radiation_data()))
-schedule.every().day.at("00:00").do(backup_existing_data)
+# 스케줄 실행 함수
+def scheduled_task():
+    fetch_radiation_data()
 
-# 종료 시 연결 종료
-atexit.register(lambda: (client.close(), logging.info("MongoDB 연결 종료")))
+
+# 스케줄링
+schedule.every(60).minutes.do(scheduled_task)
 
 # 메인 루프
 if __name__ == '__main__':
     logging.info("스케줄러 시작")
+    # 기존 일자별 백업 이관 옵션
+    if '--import-legacy' in sys.argv:
+        import_legacy_backups()
     # 시작 시 한 번 실행
-    backup_existing_data()
     fetch_radiation_data()
     while True:
         schedule.run_pending()
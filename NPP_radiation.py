@@ -4,15 +4,23 @@
 # 이 스크립트는 15분마다 실행되어 새로운 데이터를 가져옵니다.
 
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
-from pymongo import MongoClient
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
 import logging
 import schedule
 import time
 import os
 from dotenv import load_dotenv
 from datetime import datetime  # 추가된 부분
-from telegram_notifier import send_telegram_message
+from concurrent.futures import ThreadPoolExecutor, wait
+import error_digest
+from xml_stream import parse_radiation
+import fingerprint
+import metrics
+import mongo
+import rollups
 
 
 # 환경 변수 로드
@@ -28,99 +36,314 @@ logging.basicConfig(
 # 텔레그램 설정 - NPP_monitoring 봇 사용
 TELEGRAM_NPP_MONITORING_TOKEN = os.getenv("TELEGRAM_NPP_MONITORING_TOKEN")  # NPP_monitoring 봇의 토큰
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+errors = error_digest.for_channel(TELEGRAM_NPP_MONITORING_TOKEN, TELEGRAM_CHAT_ID)  # 발전소별 오류를 묶어서 알림
 
 # 공공 API URL과 서비스 키
-base_url = "http://data.khnp.co.kr/environ/service/realtime/radiorate"
+# KHNP_BASE_URL로 API 주소를 바꿀 수 있음 (예: mock_api_server.py로 로컬 벤치마크)
+khnp_base_url = os.getenv("KHNP_BASE_URL", "http://data.khnp.co.kr/environ/service/realtime").rstrip("/")
+base_url = f"{khnp_base_url}/radiorate"
 service_key = os.getenv("Service_key")  # env에 설정한 이름을 그대로 사용
 
 # 발전소 목록
 plants = ["WS", "KR", "YK", "UJ", "SU"]
 
-# MongoDB 연결 설정
-client = MongoClient("mongodb://localhost:27017/")
-db = client['Data']
-radiation_collection = db['nuclear_radiation']
-radiation_backup_collection = db['nuclear_radiation_backup']  # 백업 컬렉션
+# HTTP 요청 설정
+REQUEST_TIMEOUT = (5, 20)  # 발전소별 (연결, 읽기) 타임아웃(초)
+CYCLE_DEADLINE = 60  # 한 번의 수집 주기 전체 마감 시간(초)
+
+
+def create_http_session(pool_size=len(plants)):
+    """발전소 요청이 공유하는 커넥션 풀 세션을 생성"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+# MongoDB 연결 설정 (공유 커넥션 풀, MONGO_URI 사용)
+db = mongo.database()
+radiation_collection = mongo.collection('nuclear_radiation')
+radiation_backup_collection = mongo.collection('nuclear_radiation_backup')  # 백업 컬렉션
+ingest_state_collection = mongo.collection('ingest_state')  # 백업 워터마크 등 수집 상태 저장
+
+# 증분 백업 설정
+BACKUP_STATE_ID = "nuclear_radiation_backup"
+BACKUP_BATCH_SIZE = 500
+LEGACY_FETCHED_AT = datetime(1970, 1, 1)
+
+
+def _after_watermark(state):
+    """워터마크 (fetched_at, _id) 이후의 문서를 찾는 쿼리"""
+    if not state:
+        return {}
+    return {"$or": [
+        {"fetched_at": {"$gt": state["fetched_at"]}},
+        {"fetched_at": state["fetched_at"], "_id": {"$gt": state["last_id"]}}
+    ]}
+
+
+def _flush_backup_batch(batch):
+    """
+    백업 배치를 (name, time) 기준 upsert로 저장하고 (재실행해도 중복되지 않음)
+    배치의 마지막 문서를 새 워터마크로 기록합니다.
+    """
+    operations = [
+        UpdateOne({"name": doc["name"], "time": doc["time"]},
+                  {"$set": {k: v for k, v in doc.items() if k != "_id"}}, upsert=True)
+        for doc in batch
+    ]
+    with metrics.WRITE_SECONDS.time(job="NPP_radiation", collection="nuclear_radiation_backup"):
+        radiation_backup_collection.bulk_write(operations, ordered=False)
+    state = {"fetched_at": batch[-1]["fetched_at"], "last_id": batch[-1]["_id"]}
+    ingest_state_collection.update_one({"_id": BACKUP_STATE_ID}, {"$set": state}, upsert=True)
+    return state
 
 
 def backup_existing_data():
-    """기존 데이터를 백업 컬렉션으로 이동"""
+    """
+    워터마크 이후에 수집된 데이터만 백업 컬렉션으로 복사합니다.
+    배치마다 워터마크를 저장하므로 중간에 중단되어도 이어서 진행되며,
+    백업이 끝난 뒤에는 발전소별 최신 측정 시각보다 오래된 데이터만 삭제합니다.
+    """
     try:
-        existing_data = list(radiation_collection.find({}))
-        if existing_data:
-            # 데이터를 백업 컬렉션으로 이동
-            radiation_backup_collection.insert_many(existing_data)
-            # 기존 데이터 삭제
-            result = radiation_collection.delete_many({})
-            logging.info(
-                f"기존 데이터를 nuclear_radiation_backup으로 이동 완료. {len(existing_data)}개의 데이터 백업됨, {result.deleted_count}개의 데이터 삭제됨.")
-        else:
-            logging.info("백업할 데이터가 없습니다.")
+        # fetched_at이 없는 기존 데이터는 가장 오래된 데이터로 취급
+        radiation_collection.update_many({"fetched_at": {"$exists": False}},
+                                         {"$set": {"fetched_at": LEGACY_FETCHED_AT}})
+
+        state = ingest_state_collection.find_one({"_id": BACKUP_STATE_ID})
+        cursor = radiation_collection.find(_after_watermark(state)) \
+            .sort([("fetched_at", ASCENDING), ("_id", ASCENDING)]) \
+            .batch_size(BACKUP_BATCH_SIZE)
+
+        archived = 0
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= BACKUP_BATCH_SIZE:
+                state = _flush_backup_batch(batch)
+                archived += len(batch)
+                batch = []
+        if batch:
+            state = _flush_backup_batch(batch)
+            archived += len(batch)
+        errors.resolve("MongoDB nuclear_radiation_backup", "백업")
+
+        if archived == 0:
+            logging.info("백업할 신규 데이터가 없습니다.")
+            return
+        logging.info(f"신규 데이터 {archived}건을 nuclear_radiation_backup에 백업 완료 (워터마크: {state['fetched_at']}).")
+
+        # 백업된 데이터 중 발전소별 최신 측정 시각 이전의 데이터만 삭제 (라이브 컬렉션이 비는 구간 없음)
+        prune_conditions = []
+        for genName in plants:
+            latest = radiation_collection.find_one({"genName": genName}, {"time": 1},
+                                                   sort=[("time", DESCENDING)])
+            if latest:
+                prune_conditions.append({"genName": genName, "time": {"$lt": latest["time"]}})
+        if prune_conditions:
+            result = radiation_collection.delete_many(
+                {"fetched_at": {"$lte": state["fetched_at"]}, "$or": prune_conditions})
+            logging.info(f"백업이 끝난 이전 데이터 {result.deleted_count}건 삭제 완료.")
     except Exception as e:
         logging.error(f"데이터 백업 중 오류 발생: {e}")
-        # 텔레그램 메시지 전송
-        error_message = f"데이터 백업 중 오류 발생:\n{str(e)}"
-        send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
+        metrics.FAILURES.inc(job="NPP_radiation", stage="backup")
+        errors.report("MongoDB nuclear_radiation_backup", "백업", e)
+
+
+def _upsert_pipeline(record, fetched_at):
+    """
+    측정값 upsert 파이프라인.
+    신규 행이거나 값이 바뀐 행만 fetched_at을 이번 수집 시각으로 옮겨, 정정된 값도 백업 워터마크 뒤에 놓이게 합니다.
+    (값이 같으면 fetched_at을 유지하므로 같은 측정값을 다시 백업하지 않음)
+    """
+    values = {field: {"$literal": value} for field, value in record.items()}
+    changed = {"$or": [{"$ne": [f"${field}", value]} for field, value in values.items()]}
+    return [
+        {"$set": {"fetched_at": {"$cond": [changed, {"$literal": fetched_at}, "$fetched_at"]}}},
+        {"$set": values},
+    ]
+
+
+def store_radiation_records(records):
+    """
+    여러 측정값을 한 번의 비순차(unordered) bulk_write upsert로 저장합니다.
+    (name, time) 기준으로 중복을 제거하며, 신규/일치/변경 건수를 반환합니다.
+    """
+    fetched_at = datetime.now()
+    unique_records = {}
+    for record in records:
+        unique_records[(record["name"], record["time"])] = record
+    if not unique_records:
+        return {"inserted": 0, "matched": 0, "modified": 0}
+
+    operations = [
+        UpdateOne({"name": name, "time": measured_at}, _upsert_pipeline(record, fetched_at), upsert=True)
+        for (name, measured_at), record in unique_records.items()
+    ]
+    try:
+        with metrics.WRITE_SECONDS.time(job="NPP_radiation", collection="nuclear_radiation"):
+            result = radiation_collection.bulk_write(operations, ordered=False)
+        counts = {"inserted": result.upserted_count, "matched": result.matched_count, "modified": result.modified_count}
+        upserted_indexes = list(result.upserted_ids)
+    except BulkWriteError as e:
+        # 일부 실패 시에도 성공한 건수는 반영
+        details = e.details
+        logging.error(f"bulk_write 일부 실패: {len(details.get('writeErrors', []))}건 오류")
+        metrics.FAILURES.inc(len(details.get("writeErrors", [])), job="NPP_radiation", stage="write")
+        counts = {"inserted": details.get("nUpserted", 0), "matched": details.get("nMatched", 0),
+                  "modified": details.get("nModified", 0)}
+        upserted_indexes = [upserted["index"] for upserted in details.get("upserted", [])]
+    metrics.record_rows("NPP_radiation", inserted=counts["inserted"], updated=counts["modified"],
+                        skipped=counts["matched"] - counts["modified"])
+
+    # 새로 저장된 측정값만 시간/일 요약에 반영 (이미 있던 값을 다시 더하지 않도록)
+    records_by_index = list(unique_records.values())
+    try:
+        with metrics.WRITE_SECONDS.time(job="NPP_radiation", collection="nuclear_radiation_rollups"):
+            rollups.apply(db, "nuclear_radiation", [records_by_index[index] for index in upserted_indexes])
+    except Exception as e:
+        logging.error(f"요약 데이터 갱신 중 오류 발생: {e}")
+        metrics.FAILURES.inc(job="NPP_radiation", stage="rollup")
+    return counts
+
+
+def fetch_plant(genName):
+    """
+    단일 발전소 API 요청 후 응답을 스트리밍 파싱합니다. 본문 해시는 파싱하면서 조각 단위로 계산합니다.
+    응답 본문이 마지막으로 저장한 응답과 같으면 파싱 결과를 버리고 unchanged=True를 반환합니다.
+    """
+    url = f"{base_url}?genName={genName}&serviceKey={service_key}"
+    started = time.perf_counter()
+    try:
+        try:
+            response = http_session.get(url, timeout=REQUEST_TIMEOUT, stream=True)
+        finally:
+            metrics.HTTP_LATENCY.observe(time.perf_counter() - started, job="NPP_radiation", endpoint="radiorate")
+        with response:
+            response.raise_for_status()  # 오류 응답 처리
+            body = fingerprint.HashingStream(response)
+            with metrics.PARSE_SECONDS.time(job="NPP_radiation"):  # 본문 수신 포함
+                items = list(parse_radiation(body))
+        digest = body.hexdigest()
+        if fingerprint.is_unchanged(f"radiorate:{genName}", digest):
+            return {"items": None, "digest": digest, "unchanged": True, "error": None,
+                    "latency": time.perf_counter() - started}
+        return {"items": items, "digest": digest, "unchanged": False, "error": None,
+                "latency": time.perf_counter() - started}
+    except requests.exceptions.RequestException as e:
+        metrics.HTTP_ERRORS.inc(job="NPP_radiation", endpoint="radiorate", error=type(e).__name__)
+        metrics.FAILURES.inc(job="NPP_radiation", stage="fetch")
+        return {"items": None, "digest": None, "unchanged": False, "error": e,
+                "latency": time.perf_counter() - started}
+    except ET.ParseError as e:
+        metrics.FAILURES.inc(job="NPP_radiation", stage="parse")
+        return {"items": None, "digest": None, "unchanged": False, "error": e,
+                "latency": time.perf_counter() - started}
+
+
+def fetch_all_plants(deadline=CYCLE_DEADLINE):
+    """
+    모든 발전소에 동시에 요청합니다.
+    전체 소요 시간은 가장 느린 발전소에 맞춰지며, 마감 시간을 넘긴 발전소는 시간 초과로 처리합니다.
+    """
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(plants), thread_name_prefix="npp_radiation")
+    futures = {executor.submit(fetch_plant, genName): genName for genName in plants}
+    done, not_done = wait(futures, timeout=deadline)
+    # 마감 시간을 넘긴 요청은 기다리지 않음 (각 요청은 REQUEST_TIMEOUT으로 정리됨)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in not_done:
+        error = requests.exceptions.Timeout(f"수집 주기 마감 시간({deadline}초) 초과")
+        metrics.FAILURES.inc(job="NPP_radiation", stage="deadline")
+        results[futures[future]] = {"items": None, "digest": None, "unchanged": False, "error": error,
+                                    "latency": time.perf_counter() - started}
+
+    latency_summary = ", ".join(f"{genName}={results[genName]['latency']:.2f}s" for genName in plants)
+    logging.info(f"발전소별 응답 시간: {latency_summary} (전체 {time.perf_counter() - started:.2f}s)")
+    return results
 
 
 def fetch_and_store_radiation_data():
+    """수집 주기를 실행하고, 새로 반영된 응답이 있었는지 여부를 반환"""
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # 현재 시간을 가져옴
     logging.info(f"방사선 데이터 수집 작업 시작 (현재 시간: {current_time})")
 
+    results = fetch_all_plants()
+    cycle_records = []
+    changed_plants = {}  # genName -> (응답 해시, 최신 측정 시각)
+
     for genName in plants:
-        url = f"{base_url}?genName={genName}&serviceKey={service_key}"
+        items = results[genName]["items"]
+        error = results[genName]["error"]
+        if isinstance(error, ET.ParseError):
+            logging.error(f"{genName} 발전소 XML 파싱 오류: {error}")
+            print(f"{genName} 발전소 XML 파싱 오류: {error}")
+            errors.report("KHNP radiorate", genName, error)
+            continue
+        if error is not None:
+            logging.error(f"{genName} 발전소 API 요청 실패. 오류: {error}")
+            print(f"{genName} 발전소 API 요청 실패. 오류: {error}")
+            errors.report("KHNP radiorate", genName, error)
+            continue
+        errors.resolve("KHNP radiorate", genName)
 
-        try:
-            # API 요청
-            response = requests.get(url)
-            response.raise_for_status()  # 오류 응답 처리
-        except requests.exceptions.RequestException as e:
-            logging.error(f"{genName} 발전소 API 요청 실패. 오류: {e}")
-            print(f"{genName} 발전소 API 요청 실패. 오류: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{genName} 발전소 API 요청 실패.\n오류: {e}"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
+        if results[genName]["unchanged"]:
+            logging.info(f"{genName} 발전소 응답 변경 없음, 건너뜀. ({results[genName]['latency']:.2f}s)")
             continue
+        logging.info(f"{genName} 발전소 API 요청 성공. ({results[genName]['latency']:.2f}s)")
 
-        logging.info(f"{genName} 발전소 API 요청 성공.")
+        plant_records = []
+        for item in items:
+            if not (item.name and item.time):
+                logging.warning(f"{genName} 발전소 누락된 필드: name={item.name}, time={item.time}")
+                continue
+            # time은 datetime, value는 숫자(μSv/h)로 저장 (인덱스 기반 기간 조회/최고값 정렬)
+            radiation_data = {
+                "expl": item.expl,
+                "name": item.name,
+                "time": item.time,
+                "value": item.value,
+                "genName": genName
+            }
+            logging.debug(
+                f"설명: {radiation_data['expl']}, 측정소: {radiation_data['name']}, 시간: {radiation_data['time']}, 방사선량: {radiation_data['value']} μSv/h")
+            plant_records.append(radiation_data)
+        cycle_records.extend(plant_records)
+        latest = max((item.time for item in items if item.time), default=None)
+        changed_plants[genName] = (results[genName]["digest"], latest)
+        logging.info(f"{genName} 발전소 측정값 {len(plant_records)}건 파싱 완료.")
 
-        try:
-            # XML 데이터 파싱
-            root = ET.fromstring(response.content)
-            for item in root.findall(".//item"):
-                radiation_data = {
-                    "expl": item.findtext("expl"),
-                    "name": item.findtext("name"),
-                    "time": item.findtext("time"),
-                    "value": item.findtext("value"),
-                    "genName": genName
-                }
-                logging.info(
-                    f"설명: {radiation_data['expl']}, 측정소: {radiation_data['name']}, 시간: {radiation_data['time']}, 방사선량: {radiation_data['value']} μSv/h")
-
-                # MongoDB에 최신 데이터 저장 (upsert로 중복 방지)
-                radiation_collection.update_one(
-                    {"name": radiation_data["name"], "time": radiation_data["time"]},
-                    {"$set": radiation_data},
-                    upsert=True
-                )
-        except ET.ParseError as e:
-            logging.error(f"{genName} 발전소 XML 파싱 오류: {e}")
-            print(f"{genName} 발전소 XML 파싱 오류: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{genName} 발전소 XML 파싱 오류:\n{str(e)}"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
-            continue
-        except Exception as e:
-            logging.error(f"{genName} 발전소 데이터 처리 중 오류 발생: {e}")
-            print(f"{genName} 발전소 데이터 처리 중 오류 발생: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{genName} 발전소 데이터 처리 중 오류 발생:\n{str(e)}"
-            send_telegram_message(
-                TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
-            continue
+    # 변경된 응답이 없으면 저장/백업 생략
+    if not changed_plants:
+        fingerprint.record_cycle("NPP_radiation", skipped=True)
+        logging.info(f"방사선 데이터 변경 없음 (현재 시간: {current_time})")
+        return False
 
+    # 수집 주기 전체 데이터를 한 번에 저장
+    try:
+        counts = store_radiation_records(cycle_records)
+        logging.info(
+            f"방사선 데이터 저장 완료: 신규 {counts['inserted']}건, 일치 {counts['matched']}건, 변경 {counts['modified']}건")
+    except Exception as e:
+        logging.error(f"방사선 데이터 저장 중 오류 발생: {e}")
+        metrics.FAILURES.inc(job="NPP_radiation", stage="write")
+        errors.report("MongoDB nuclear_radiation", "저장", e)
+        return False
+    errors.resolve("MongoDB nuclear_radiation", "저장")
+
+    # 저장에 성공한 응답만 지문으로 기록
+    for genName, (digest, latest) in changed_plants.items():
+        fingerprint.remember(f"radiorate:{genName}", digest, latest)
+    fingerprint.record_cycle("NPP_radiation", skipped=False)
     logging.info(f"방사선 데이터 수집 작업 완료 (현재 시간: {current_time})")
+    return True
 
 
 # 스케줄 실행 시 로그 기록
@@ -128,8 +351,9 @@ def scheduled_task():
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # 현재 시간을 가져옴
     logging.info(f"15분마다 데이터 수집 작업 실행 중... (현재 시간: {current_time})")
     print(f"15분마다 데이터 수집 작업 실행 중... (현재 시간: {current_time})")
-    backup_existing_data()
-    fetch_and_store_radiation_data()
+    # 새로 반영된 데이터가 있을 때만 백업
+    if fetch_and_store_radiation_data():
+        backup_existing_data()
 
 
 # 15분마다 작업을 실행하는 스케줄 설정
@@ -140,9 +364,9 @@ if __name__ == "__main__":
     print(f"15분마다 방사선 데이터를 확인하는 스케줄을 시작합니다. (현재 시간: {current_time})")
     logging.info(f"15분마다 방사선 데이터를 확인하는 스케줄을 시작합니다. (현재 시간: {current_time})")
 
-    # 첫 실행 시 데이터 백업 후 새로운 데이터 수집
-    backup_existing_data()
+    # 첫 실행 시 새로운 데이터 수집 후 증분 백업
     fetch_and_store_radiation_data()
+    backup_existing_data()
 
     # 스케줄을 지속적으로 실행
     while True:
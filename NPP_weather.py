@@ -1,6 +1,6 @@
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
-from pymongo import MongoClient
 import logging
 import schedule
 import time
@@ -9,8 +9,14 @@ import sys
 import os
 from dotenv import load_dotenv
 from datetime import datetime  # 추가된 부분
-from pymongo import MongoClient, DESCENDING
-from telegram_notifier import send_telegram_message  # 텔레그램 알림 통합
+from concurrent.futures import ThreadPoolExecutor, wait
+from pymongo import UpdateOne
+import error_digest  # 텔레그램 오류 알림 (요약 전송)
+from xml_stream import parse_weather, parse_air_stability
+import fingerprint
+import metrics
+import mongo
+import rollups
 
 # 환경 변수 로드
 load_dotenv("C:/Users/user/Desktop/Server_Final/telegram_config.env")  # 환경 변수 파일명 명시
@@ -25,23 +31,38 @@ logging.basicConfig(
 # 텔레그램 설정
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+errors = error_digest.for_channel(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)  # 지역별 오류를 묶어서 알림
 
-# MongoDB 연결
-client = MongoClient("mongodb://localhost:27017/")
-db = client['Data']
+# MongoDB 연결 (공유 커넥션 풀, MONGO_URI 사용)
+db = mongo.database()
 
 # 발전소별 데이터를 저장할 컬렉션
-collection = db['NPP_weather']  # 발전소 데이터를 저장할 컬렉션
-backup_collection = db['NPP_weather_backup']  # 백업 컬렉션
+collection = mongo.collection('NPP_weather')  # 발전소 데이터를 저장할 컬렉션
+backup_collection = mongo.collection('NPP_weather_backup')  # 백업 컬렉션
 
 # 측정 지역 코드
 regions = ['KR', 'WS', 'YK', 'UJ', 'SU']
 
 # 공공 API URL (서비스 키는 동일, region을 동적으로 설정)
-weather_base_url = "http://data.khnp.co.kr/environ/service/realtime/weather"
-air_stability_base_url = "http://data.khnp.co.kr/environ/service/realtime/air"
+# KHNP_BASE_URL로 API 주소를 바꿀 수 있음 (예: mock_api_server.py로 로컬 벤치마크)
+khnp_base_url = os.getenv("KHNP_BASE_URL", "http://data.khnp.co.kr/environ/service/realtime").rstrip("/")
+weather_base_url = f"{khnp_base_url}/weather"
+air_stability_base_url = f"{khnp_base_url}/air"
 service_key = os.getenv("Service_key")  # env에 설정한 이름을 그대로 사용
 
+# HTTP 요청 설정
+REQUEST_TIMEOUT = (5, 20)  # 요청별 (연결, 읽기) 타임아웃(초)
+CYCLE_DEADLINE = 60  # 한 번의 수집 주기 전체 마감 시간(초)
+
+# 기상 측정 항목 → 저장 필드 매핑
+weather_fields = {
+    "온도": "temperature",
+    "습도": "humidity",
+    "강우량": "rainfall",
+    "풍속": "windspeed",
+    "풍향": "winddirection"
+}
+
 # 대기안정도 설명 매핑
 air_stability_mapping = {
     "A": "심한 불안정",
@@ -61,130 +82,222 @@ def log_program_exit():
 # 프로그램 종료 시 처리할 작업 등록
 atexit.register(log_program_exit)
 
-def backup_existing_data():
-    """기존 데이터를 발전소별로 최신 데이터만 남겨두고 백업 컬렉션으로 이동"""
+def create_http_session(pool_size=len(regions) * 2):
+    """기상/대기안정도 요청이 공유하는 커넥션 풀 세션을 생성"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+def fetch_document(base_url, region, parser):
+    """
+    단일 API 요청 후 응답을 스트리밍 파싱합니다. (본문 해시는 파싱하면서 조각 단위로 계산)
+    측정값 목록과 해시 또는 오류와 함께 소요 시간(초)을 반환합니다.
+    """
+    url = f"{base_url}?serviceKey={service_key}&genName={region}"
+    endpoint = base_url.rstrip("/").rsplit("/", 1)[-1]  # weather / air
+    started = time.perf_counter()
     try:
-        # 각 발전소별로 최신 데이터만 찾아서 백업
-        for region in regions:
-            # 각 발전소의 최신 데이터를 가져옴
-            latest_data = collection.find_one({"genName": region}, {"_id": 0}, sort=[("time", DESCENDING)])
-
-            if latest_data:
-                # backup_collection에서 같은 genName과 time을 가진 데이터가 있는지 확인
-                existing_data = backup_collection.find_one({"genName": region, "time": latest_data["time"]})
-
-                if existing_data:
-                    logging.info(f"{region}의 {latest_data['time']}에 해당하는 데이터는 이미 백업되어 있습니다.")
-                else:
-                    # 최신 데이터는 백업 컬렉션으로 이동
-                    backup_collection.insert_one(latest_data)
-                    # 최신 데이터 외에 이전 데이터는 삭제
-                    collection.delete_many({"genName": region, "time": {"$ne": latest_data["time"]}})
-                    logging.info(f"{region}의 최신 데이터를 백업하고 나머지는 삭제 완료.")
-            else:
-                logging.warning(f"{region}에 대한 최신 데이터가 없습니다.")
+        with http_session.get(url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            metrics.HTTP_LATENCY.observe(time.perf_counter() - started, job="NPP_weather", endpoint=endpoint)
+            if response.status_code != 200:
+                metrics.HTTP_ERRORS.inc(job="NPP_weather", endpoint=endpoint, error=f"HTTP {response.status_code}")
+                metrics.FAILURES.inc(job="NPP_weather", stage="fetch")
+                return {"items": None, "digest": None, "status_code": response.status_code, "error": None,
+                        "parse_error": None, "latency": time.perf_counter() - started}
+            body = fingerprint.HashingStream(response)
+            try:
+                with metrics.PARSE_SECONDS.time(job="NPP_weather"):  # 본문 수신 포함
+                    items = list(parser(body))
+            except ET.ParseError as e:
+                metrics.FAILURES.inc(job="NPP_weather", stage="parse")
+                return {"items": None, "digest": None, "status_code": response.status_code, "error": None,
+                        "parse_error": e, "latency": time.perf_counter() - started}
+        return {"items": items, "digest": body.hexdigest(), "status_code": response.status_code, "error": None,
+                "parse_error": None, "latency": time.perf_counter() - started}
+    except requests.exceptions.RequestException as e:
+        latency = time.perf_counter() - started
+        metrics.HTTP_LATENCY.observe(latency, job="NPP_weather", endpoint=endpoint)
+        metrics.HTTP_ERRORS.inc(job="NPP_weather", endpoint=endpoint, error=type(e).__name__)
+        metrics.FAILURES.inc(job="NPP_weather", stage="fetch")
+        return {"items": None, "digest": None, "status_code": None, "error": e, "parse_error": None,
+                "latency": latency}
+
+
+def fetch_all_documents(deadline=CYCLE_DEADLINE):
+    """
+    모든 지역의 기상/대기안정도 문서(지역 수 x 2)를 동시에 요청합니다.
+    결과는 {(종류, 지역): 결과} 형태이며, 마감 시간을 넘긴 요청은 시간 초과로 처리합니다.
+    """
+    started = time.perf_counter()
+    endpoints = {"weather": (weather_base_url, parse_weather), "air": (air_stability_base_url, parse_air_stability)}
+    executor = ThreadPoolExecutor(max_workers=len(regions) * len(endpoints), thread_name_prefix="npp_weather")
+    futures = {
+        executor.submit(fetch_document, url, region, parser): (kind, region)
+        for kind, (url, parser) in endpoints.items() for region in regions
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in not_done:
+        error = requests.exceptions.Timeout(f"수집 주기 마감 시간({deadline}초) 초과")
+        metrics.FAILURES.inc(job="NPP_weather", stage="deadline")
+        results[futures[future]] = {"items": None, "digest": None, "status_code": None, "error": error,
+                                    "parse_error": None, "latency": time.perf_counter() - started}
+    logging.info(f"기상/대기안정도 {len(futures)}건 동시 요청 완료 ({time.perf_counter() - started:.2f}s)")
+    return results
+
+
+def merge_plant_data(region, weather_items, air_stability_items):
+    """기상/대기안정도 측정값을 하나의 발전소 데이터로 병합"""
+    # 각 발전소의 데이터를 저장할 딕셔너리 초기화
+    plant_data = {
+        "genName": region,  # region → genName으로 변경
+        "time": None,
+        "temperature": None,
+        "humidity": None,
+        "rainfall": None,
+        "windspeed": None,
+        "winddirection": None,
+        "stability": None  # 대기안정도
+    }
+
+    # 기상 데이터 처리
+    for item in weather_items:
+        # 시간은 모든 데이터에 동일하므로 한 번만 설정 (datetime으로 저장)
+        if plant_data["time"] is None and item.time is not None:
+            plant_data["time"] = item.time
+
+        # 측정 항목(온도, 습도, 등)에 따라 데이터를 저장
+        field = weather_fields.get(item.expl)
+        if field:
+            plant_data[field] = item.value
+
+    # 대기안정도 데이터 처리
+    for item in air_stability_items:
+        plant_data["stability"] = air_stability_mapping.get((item.code or "").strip(), "Unknown")
+
+    return plant_data
+
+
+def store_plant_data(plant_rows):
+    """
+    수집 주기의 발전소 데이터를 현재/백업 컬렉션에 각각 한 번의 bulk_write로 저장합니다.
+    새로 저장된 발전소는 최신 데이터만 남기고 이전 데이터를 삭제합니다.
+    """
+    # 중복 데이터 방지 - 동일한 genName과 time이 없을 경우에만 삽입
+    operations = [
+        UpdateOne({"genName": row["genName"], "time": row["time"]}, {"$setOnInsert": row}, upsert=True)
+        for row in plant_rows
+    ]
+    with metrics.WRITE_SECONDS.time(job="NPP_weather", collection="NPP_weather"):
+        result = collection.bulk_write(operations, ordered=False)
+    with metrics.WRITE_SECONDS.time(job="NPP_weather", collection="NPP_weather_backup"):
+        backup_collection.bulk_write(operations, ordered=False)
+
+    inserted = [plant_rows[index] for index in result.upserted_ids]
+    if inserted:
+        with metrics.WRITE_SECONDS.time(job="NPP_weather", collection="NPP_weather"):
+            collection.delete_many({"$or": [
+                {"genName": row["genName"], "time": {"$lt": row["time"]}} for row in inserted
+            ]})
+    metrics.record_rows("NPP_weather", inserted=len(inserted), skipped=len(plant_rows) - len(inserted))
+
+    # 새로 저장된 데이터만 시간/일 요약에 반영
+    try:
+        with metrics.WRITE_SECONDS.time(job="NPP_weather", collection="NPP_weather_rollups"):
+            rollups.apply(db, "NPP_weather", inserted)
     except Exception as e:
-        logging.error(f"데이터 백업 중 오류 발생: {e}")
-        print(f"데이터 백업 중 오류 발생: {e}")
-        # 텔레그램 메시지 전송
-        error_message = f"데이터 백업 중 오류 발생:\n{str(e)}"
-        send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
+        logging.error(f"요약 데이터 갱신 중 오류 발생: {e}")
+        metrics.FAILURES.inc(job="NPP_weather", stage="rollup")
+    return inserted
+
 
 def fetch_and_store_data():
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # 현재 시간을 가져옴
     logging.info(f"데이터 수집 작업 시작 (현재 시간: {current_time})")
 
-    for region in regions:
-        try:
-            # 기상 데이터 URL 구성
-            weather_api_url = f"{weather_base_url}?serviceKey={service_key}&genName={region}"
-            air_stability_api_url = f"{air_stability_base_url}?serviceKey={service_key}&genName={region}"
-
-            # 기상 데이터 API 요청 보내기
-            weather_response = requests.get(weather_api_url)
-            air_stability_response = requests.get(air_stability_api_url)
-
-            if weather_response.status_code == 200 and air_stability_response.status_code == 200:
-                logging.info(f"{region} API 응답 성공. 데이터 파싱 시도 중...")
-
-                # XML 데이터 파싱
-                weather_root = ET.fromstring(weather_response.content)
-                air_stability_root = ET.fromstring(air_stability_response.content)
-
-                # 각 발전소의 데이터를 저장할 딕셔너리 초기화
-                plant_data = {
-                    "genName": region,  # region → genName으로 변경
-                    "time": None,
-                    "temperature": None,
-                    "humidity": None,
-                    "rainfall": None,
-                    "windspeed": None,
-                    "winddirection": None,
-                    "stability": None  # 대기안정도
-                }
-
-                # 기상 데이터 처리
-                for item in weather_root.findall('.//item'):
-                    expl = item.find('expl').text  # 측정 항목 (온도, 습도, 등)
-                    value = float(item.find('value').text)  # 측정 값
-                    time_str = item.find('time').text  # 측정 시간
-
-                    # 시간은 모든 데이터에 동일하므로 한 번만 설정
-                    if plant_data["time"] is None:
-                        plant_data["time"] = time_str
-
-                    # 측정 항목에 따라 데이터를 저장
-                    if expl == "온도":
-                        plant_data["temperature"] = value
-                    elif expl == "습도":
-                        plant_data["humidity"] = value
-                    elif expl == "강우량":
-                        plant_data["rainfall"] = value
-                    elif expl == "풍속":
-                        plant_data["windspeed"] = value
-                    elif expl == "풍향":
-                        plant_data["winddirection"] = value
-
-                # 대기안정도 데이터 처리
-                for item in air_stability_root.findall('.//item'):
-                    stability_code = item.find('value').text.strip()  # 공백 제거 추가
-                    plant_data["stability"] = air_stability_mapping.get(stability_code, "Unknown")
-
-                # 중복 데이터 방지 - 동일한 genName과 time이 존재하는지 확인하고, 존재하지 않을 경우에만 삽입
-                query = {"genName": region, "time": plant_data["time"]}  # region → genName으로 변경
-                update = {"$setOnInsert": plant_data}  # 문서가 없을 경우에만 삽입
-                result = collection.update_one(query, update, upsert=True)
-
-                if result.matched_count > 0:
-                    logging.info(f"{region} 데이터 중복으로 저장하지 않음: {plant_data}")
-                else:
-                    # 새로운 데이터가 수집되면 기존 데이터를 백업
-                    backup_existing_data()
-                    logging.info(f"{region} 데이터 저장 완료: {plant_data}")
+    results = fetch_all_documents()
+    plant_rows = []
+    changed_regions = {}  # region -> (기상 응답 해시, 대기안정도 응답 해시)
 
+    for region in regions:
+        weather_result = results[("weather", region)]
+        air_stability_result = results[("air", region)]
+        failed = False
+        for kind, result in (("weather", weather_result), ("air", air_stability_result)):
+            endpoint = f"KHNP {kind}"
+            if result["error"] is not None:
+                logging.error(f"{region} {kind} 데이터 요청 중 네트워크 오류 발생: {result['error']}")
+                errors.report(endpoint, region, result["error"])
+                failed = True
+            elif result["status_code"] != 200:
+                logging.error(f"{region} {kind} API 요청 실패: HTTP {result['status_code']}")
+                errors.report(endpoint, region, f"HTTP {result['status_code']}")
+                failed = True
             else:
-                error_msg = f"{region} API 요청 실패: Weather({weather_response.status_code}) / Air Stability({air_stability_response.status_code})"
-                logging.error(error_msg)
-                print(error_msg)
-                # 텔레그램 메시지 전송
-                send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_msg)
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"{region} 데이터 요청 중 네트워크 오류 발생: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{region} 데이터 요청 중 네트워크 오류 발생:\n{str(e)}"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
-        except ET.ParseError as e:
-            logging.error(f"{region} XML 파싱 오류: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{region} XML 파싱 오류:\n{str(e)}"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
+                errors.resolve(endpoint, region)
+        if failed:
+            continue
+
+        # 기상/대기안정도 응답이 모두 이전과 같으면 파싱/저장 생략
+        if (fingerprint.is_unchanged(f"weather:{region}", weather_result["digest"])
+                and fingerprint.is_unchanged(f"air:{region}", air_stability_result["digest"])):
+            logging.info(f"{region} 응답 변경 없음, 건너뜀.")
+            errors.resolve("KHNP 응답 처리", region)
+            continue
+        parse_error = weather_result["parse_error"] or air_stability_result["parse_error"]
+        if parse_error is not None:
+            logging.error(f"{region} XML 파싱 오류: {parse_error}")
+            errors.report("KHNP 응답 처리", region, parse_error)
+            continue
+        try:
+            logging.info(f"{region} API 응답 성공. 데이터 병합 중...")
+            plant_data = merge_plant_data(region, weather_result["items"], air_stability_result["items"])
         except Exception as e:
             logging.error(f"{region} 데이터 처리 중 오류 발생: {e}")
-            # 텔레그램 메시지 전송
-            error_message = f"{region} 데이터 처리 중 오류 발생:\n{str(e)}"
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, error_message)
+            metrics.FAILURES.inc(job="NPP_weather", stage="parse")
+            errors.report("KHNP 응답 처리", region, e)
+            continue
+        errors.resolve("KHNP 응답 처리", region)
+        plant_rows.append(plant_data)
+        changed_regions[region] = (weather_result["digest"], air_stability_result["digest"])
+
+    # 변경된 응답이 없으면 저장 생략
+    if not plant_rows:
+        fingerprint.record_cycle("NPP_weather", skipped=True)
+        logging.info(f"기상 데이터 변경 없음 (현재 시간: {current_time})")
+        return
 
+    try:
+        inserted = store_plant_data(plant_rows)
+        for row in plant_rows:
+            if row in inserted:
+                logging.info(f"{row['genName']} 데이터 저장 완료: {row}")
+            else:
+                logging.info(f"{row['genName']} 데이터 중복으로 저장하지 않음: {row}")
+    except Exception as e:
+        logging.error(f"데이터 저장 중 오류 발생: {e}")
+        print(f"데이터 저장 중 오류 발생: {e}")
+        metrics.FAILURES.inc(job="NPP_weather", stage="write")
+        errors.report("MongoDB NPP_weather", "저장", e)
+        return
+    errors.resolve("MongoDB NPP_weather", "저장")
+
+    # 저장에 성공한 응답만 지문으로 기록
+    for row in plant_rows:
+        weather_digest, air_stability_digest = changed_regions[row["genName"]]
+        fingerprint.remember(f"weather:{row['genName']}", weather_digest, row["time"])
+        fingerprint.remember(f"air:{row['genName']}", air_stability_digest, row["time"])
+    fingerprint.record_cycle("NPP_weather", skipped=False)
     logging.info(f"데이터 수집 작업 완료 (현재 시간: {current_time})")
 
 
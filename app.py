@@ -4,7 +4,7 @@
 
 
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash # flash 추가
-from pymongo import MongoClient, DESCENDING
+from pymongo import DESCENDING
 from flask_caching import Cache
 import csv
 import io
@@ -15,7 +15,6 @@ from dateutil import parser
 from scipy.signal import find_peaks, savgol_filter
 import matplotlib.pyplot as plt
 import os
-from pymongo import MongoClient, DESCENDING
 from pymongo.errors import PyMongoError
 from map_utils import power_plants, compute_top5_for, generate_topsis_map_html
 from utils import export_csv, upload_csv
@@ -29,6 +28,11 @@ from flask_bcrypt import Bcrypt
 from bson import ObjectId
 from functools import wraps
 from dotenv import load_dotenv # 이 줄이 없으면 추가
+from flask import g, Response
+import time
+import metrics
+import mongo
+import rollups
 
 app = Flask(__name__)
 
@@ -44,17 +48,12 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 
 # MongoDB 연결
 load_dotenv() # .env 파일에서 환경 변수를 로드합니다. (로컬 개발용)
-mongo_uri = os.getenv("MONGO_URI")
-if not mongo_uri: # 환경 변수가 설정되지 않았을 경우를 대비한 체크
+if not os.getenv("MONGO_URI"): # 환경 변수가 설정되지 않았을 경우를 대비한 체크
     raise ValueError("MONGO_URI environment variable not set! Please set MONGO_URI in .env or your deployment environment.")
 
-# --- 이 줄을 다음과 같이 수정해주세요 ---
-mongo_uri = mongo_uri.strip().lstrip('=')
-# ----------------------------------------
-
-client = MongoClient(mongo_uri)
-db = client['Data']
-users = db['users'] # 사용자 컬렉션
+# 공유 커넥션 풀 (gunicorn 워커 등 fork된 프로세스는 첫 요청 시 자신의 연결을 생성)
+db = mongo.database()
+users = mongo.collection('users') # 사용자 컬렉션
 
 
 # User 클래스 정의 바로 위나 아래에 추가
@@ -68,24 +67,23 @@ def admin_required(f):
 
 
 # 컬렉션 설정
-collection = db['NPP_weather']  # NPP_weather 컬렉션 (기존 데이터)
-backup_collection = db['NPP_weather_backup']  # NPP_weather_backup 컬렉션 (백업된 데이터)
-busan_radiation_collection = db['Busan_radiation']
-busan_radiation_backup_collection = db['Busan_radiation_backup']
-nuclear_radiation_collection = db['nuclear_radiation']
-nuclear_radiation_backup_collection = db['nuclear_radiation_backup']
+collection = mongo.collection('NPP_weather')  # NPP_weather 컬렉션 (기존 데이터)
+backup_collection = mongo.collection('NPP_weather_backup')  # NPP_weather_backup 컬렉션 (백업된 데이터)
+busan_radiation_collection = mongo.collection('Busan_radiation')
+busan_radiation_history_collection = mongo.collection('Busan_radiation_history')  # 측정소·일자별 이력 버킷
+nuclear_radiation_collection = mongo.collection('nuclear_radiation')
+nuclear_radiation_backup_collection = mongo.collection('nuclear_radiation_backup')
 
 # 통계 데이터 컬렉션
-stats_collection = db['radiation_stats']
-avg_db = client['radiation_statistics']  # 평균을 저장할 새로운 데이터베이스
-avg_collection = avg_db['daily_average']  # 평균 데이터 저장 컬렉션
-regional_avg_collection = avg_db['regional_average']
+stats_collection = mongo.collection('radiation_stats')
+avg_collection = mongo.collection('daily_average', 'radiation_statistics')  # 평균 데이터 저장 컬렉션
+regional_avg_collection = mongo.collection('regional_average', 'radiation_statistics')
 
 # 세부 과제 컬렉션
-CAU_collection = db['Data_CAU']
-FNC_collection = db['Data_FNC']
-KAERI_collection = db['Data_KAERI']
-RMT_collection = db['Data_RMT']
+CAU_collection = mongo.collection('Data_CAU')
+FNC_collection = mongo.collection('Data_FNC')
+KAERI_collection = mongo.collection('Data_KAERI')
+RMT_collection = mongo.collection('Data_RMT')
 
 analysis1_collection = CAU_collection
 analysis2_collection = FNC_collection    # ← 여기가 핵심!
@@ -121,6 +119,32 @@ logging.basicConfig(
     ]
 )
 
+# 웹 요청 지표 (/metrics)
+REQUEST_SECONDS = metrics.Histogram("http_server_request_seconds", "웹 요청 처리 시간(초)",
+                                    ["endpoint", "method", "status"])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # URL 대신 라우트 이름을 레이블로 사용 (발전소/측정소별로 시계열이 늘어나지 않도록)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or "unknown",
+                                method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 형식 지표"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # 발전소 이름 매핑 (부산과 전남 제외)
 genName_mapping = {
     "KR": "고리 원자력발전소",
@@ -142,10 +166,35 @@ def get_wind_direction(angle):
     index = int((angle + 11.25) // 22.5) % 16
     return directions[index]
 
+# 측정 시각 표시 형식 (DB에는 datetime으로 저장)
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+# 조회 결과의 datetime 필드를 화면/JSON용 문자열로 변환하는 함수
+def format_times(docs, fields=("time",)):
+    for doc in docs:
+        for field in fields:
+            if isinstance(doc.get(field), datetime):
+                doc[field] = doc[field].strftime(TIME_FORMAT)
+    return docs
+
+
+# 날짜 문자열(YYYY-MM-DD) 기간을 datetime 범위 조건으로 변환하는 함수 (종료일 포함)
+def day_range(start_date, end_date):
+    start = parser.parse(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = parser.parse(end_date).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return {"$gte": start, "$lt": end}
+
+# 기간 조회 해상도 (raw: 원본 행, hour/day: 시간/일 요약 문서), 잘못된 값이면 None
+def requested_resolution():
+    resolution = request.args.get('resolution', 'raw')
+    if resolution == 'raw' or resolution in rollups.RESOLUTIONS:
+        return resolution
+    return None
+
 # 방사선 데이터 처리 함수 (여기서는 예시로 데이터를 가져옵니다.)
 def get_radiation_data():
-    client = get_mongo_connection()
-    db = client['power_plant_weather']
+    db = mongo.get_db('power_plant_weather')
     stats_collection = db['radiation_stats']
 
     # 방사선 데이터 가져오기
@@ -157,8 +206,7 @@ def get_radiation_data():
 
 # 방사선 평균값 계산 (예시)
 def get_average_radiation():
-    client = get_mongo_connection()
-    db = client['radiation_statistics']
+    db = mongo.get_db('radiation_statistics')
     avg_collection = db['regional_average']
 
     # 평균값 가져오기 (예시로 최근 날짜 데이터 가져오기)
@@ -225,7 +273,7 @@ def get_latest_weather_data(genName):
         data =collection.find_one({"genName": normalized_genName}, {"_id": 0}, sort=[("time", DESCENDING)])
         if data:
             logging.info(f"Latest data found: {data}")
-            return jsonify(data)
+            return jsonify(format_times([data])[0])
         else:
             logging.warning(f"No latest data found for genName: {normalized_genName}")
             return jsonify({"error": "No data found for this genName"}), 404
@@ -238,22 +286,27 @@ def get_latest_weather_data(genName):
 def get_filtered_weather_data(genName):
     start_date = request.args.get('start')
     end_date = request.args.get('end')
+    resolution = requested_resolution()
     normalized_genName = genName.upper()
     logging.info(f"Received filtered data request for genName: {normalized_genName} from {start_date} to {end_date}")
+    if resolution is None:
+        return jsonify({"error": "resolution must be one of raw, hour, day"}), 400
 
     try:
         query = {"genName": normalized_genName}
         if start_date and end_date:
-            start_time_str = f"{start_date} 00:00"
-            # timedelta는 이미 임포트 되었으므로, datetime.timedelta로 접근할 필요 없이 그냥 timedelta로 사용
-            end_date_obj = parser.parse(end_date) + timedelta(days=1)
-            end_time_str = end_date_obj.strftime("%Y-%m-%d 00:00")
-            query["time"] = {"$gte": start_time_str, "$lt": end_time_str}
+            query["time"] = day_range(start_date, end_date)
 
-        data = list(backup_collection.find(query, {"_id": 0}).sort("time", DESCENDING))
+        if resolution != 'raw':
+            time_range = query.get("time", {})
+            data = rollups.query(db, "NPP_weather", resolution, {"genName": normalized_genName},
+                                 start=time_range.get("$gte"), end=time_range.get("$lt"))
+            data.reverse()  # 원본 조회와 같이 최신순
+        else:
+            data = list(backup_collection.find(query, {"_id": 0}).sort("time", DESCENDING))
         if data:
             logging.info(f"Returning {len(data)} records for genName: {normalized_genName}")
-            return jsonify(data)
+            return jsonify(format_times(data))
         else:
             logging.warning(f"No data found for genName: {normalized_genName} with given date range.")
             return jsonify({"error": "No data found for this genName"}), 404
@@ -304,7 +357,7 @@ def region_data(genName):
     plant_name = genName_mapping.get(normalized_genName, "Unknown Plant")
 
     # 데이터를 템플릿으로 전달
-    return render_template('weather.html', region=normalized_genName, data=data, plant_name=plant_name)
+    return render_template('weather.html', region=normalized_genName, data=format_times(data), plant_name=plant_name)
 # 부산 방사선 데이터 API
 @app.route('/api/busan_radiation', methods=['GET'])
 @cache.cached(timeout=3600)
@@ -315,7 +368,7 @@ def get_busan_radiation_data():
 @app.route('/api/busan_radiation/latest', methods=['GET'])
 def get_latest_radiation_data():
     try:
-        latest_data = list(busan_radiation_collection.find({}, {"_id": 0}).sort("time", DESCENDING))
+        latest_data = list(busan_radiation_collection.find({}, {"_id": 0}).sort("checkTime", DESCENDING))
         data = []
         for item in latest_data:
             data.append({
@@ -339,15 +392,50 @@ def radiation_history_page(locNm):
 @app.route('/api/busan_radiation/history', methods=['GET'])
 def radiation_history():
     locNm = request.args.get('locNm')
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    resolution = requested_resolution()
 
     if not locNm:
         return jsonify({"error": "locNm parameter is required"}), 400
+    if resolution is None:
+        return jsonify({"error": "resolution must be one of raw, hour, day"}), 400
 
     try:
-        history_data = list(busan_radiation_backup_collection.find({"locNm": locNm}).sort("time", DESCENDING))
+        if resolution != 'raw':
+            # 시간/일 요약 문서 조회 (최신순)
+            start = parser.parse(start_date).replace(hour=0, minute=0, second=0, microsecond=0) if start_date else None
+            end = (parser.parse(end_date).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+                   if end_date else None)
+            history_data = rollups.query(db, "Busan_radiation", resolution, {"locNm": locNm}, start=start, end=end)
+            history_data.reverse()
+            for row in history_data:
+                row["checkTime"] = row["checkTime"].strftime('%Y-%m-%d %H:%M:%S')
+            if history_data:
+                return jsonify(history_data)
+            return jsonify({"error": f"No data found for location {locNm}"}), 404
 
-        for item in history_data:
-            item['_id'] = str(item['_id'])
+        # 측정소·일자 인덱스를 타는 단일 쿼리로 기간 내 버킷 조회
+        query = {"locNm": locNm}
+        if start_date or end_date:
+            query["day"] = {}
+            if start_date:
+                query["day"]["$gte"] = parser.parse(start_date).replace(hour=0, minute=0, second=0, microsecond=0)
+            if end_date:
+                query["day"]["$lte"] = parser.parse(end_date).replace(hour=0, minute=0, second=0, microsecond=0)
+        buckets = busan_radiation_history_collection.find(query, {"_id": 0, "readings": 1}).sort("day", DESCENDING)
+
+        history_data = []
+        for bucket in buckets:
+            readings = bucket.get("readings", {})
+            for hhmm in sorted(readings, reverse=True):
+                reading = readings[hhmm]
+                history_data.append({
+                    "locNm": locNm,
+                    "checkTime": reading["checkTime"].strftime('%Y-%m-%d %H:%M:%S'),
+                    "data": reading.get("data"),
+                    "aveRainData": reading.get("aveRainData")
+                })
 
         if history_data:
             return jsonify(history_data)
@@ -367,13 +455,10 @@ def get_nuclear_radiation_data():
     if genName:
         query['genName'] = genName
     if date:
-        start_time_str = f"{date} 00:00"
-        end_date_obj = parser.parse(date) + datetime.timedelta(days=1)
-        end_time_str = end_date_obj.strftime("%Y-%m-%d 00:00")
-        query['time'] = {'$gte': start_time_str, '$lt': end_time_str}
+        query['time'] = day_range(date, date)
 
     data = list(nuclear_radiation_collection.find(query, {"_id": 0}).sort("time", DESCENDING))
-    return jsonify(data)
+    return jsonify(format_times(data))
 
 # 최신 방사선 데이터를 제공하는 API
 @app.route('/api/nuclear_radiation/latest', methods=['GET'])
@@ -391,7 +476,7 @@ def get_latest_nuclear_radiation_data():
                 "lng": {"$first": "$lng"}
             }}
         ]))
-        return jsonify(latest_data)
+        return jsonify(format_times(latest_data))
     except Exception as e:
         logging.error(f"Error fetching latest nuclear radiation data: {e}")
         return jsonify({"error": "Failed to fetch latest radiation data"}), 500
@@ -514,7 +599,7 @@ def get_highest_radiation_by_plant():
 
         # 데이터가 있으면 반환
         if highest_radiation_by_plant:
-            return jsonify(highest_radiation_by_plant)
+            return jsonify(format_times(highest_radiation_by_plant))
         else:
             return jsonify({"error": "No data found"}), 404
 
@@ -556,7 +641,7 @@ def get_radiation_history():
         )
 
         logging.info(f"Fetched history data (latest 4): {history_data}")
-        return jsonify(history_data)
+        return jsonify(format_times(history_data))
 
     except Exception as e:
         logging.error(f"Error fetching history data for {genName}, {expl}: {e}")
@@ -576,18 +661,25 @@ def show_radiation_detail(genName, expl):
 def get_backup_radiation_data():
     genName = request.args.get('genName')
     expl = request.args.get('expl')
+    resolution = requested_resolution()
 
     if not genName or not expl:
         logging.warning("Missing genName or expl in the request for backup data")
         return jsonify([])
+    if resolution is None:
+        return jsonify({"error": "resolution must be one of raw, hour, day"}), 400
 
     try:
-        logging.info(f"Querying backup history for genName: {genName}, expl: {expl}")
+        logging.info(f"Querying backup history for genName: {genName}, expl: {expl} ({resolution})")
 
-        backup_data = list(nuclear_radiation_backup_collection.find(
-            {'genName': genName, 'expl': expl},
-            {'_id': 0, 'time': 1, 'value': 1}
-        ).sort('time', 1))
+        if resolution != 'raw':
+            # 시간/일 요약 문서 (time, value=평균, value_min/value_max, count)
+            backup_data = rollups.query(db, "nuclear_radiation", resolution, {'genName': genName, 'expl': expl})
+        else:
+            backup_data = list(nuclear_radiation_backup_collection.find(
+                {'genName': genName, 'expl': expl},
+                {'_id': 0, 'time': 1, 'value': 1}
+            ).sort('time', 1))
 
         logging.info(f"Fetched backup history data: {backup_data}")
 
@@ -595,7 +687,7 @@ def get_backup_radiation_data():
             logging.warning(f"No backup data found for genName: {genName}, expl: {expl}")
             return jsonify([])
 
-        return jsonify(backup_data)
+        return jsonify(format_times(backup_data))
     except Exception as e:
         logging.error(f"Error fetching backup history data for {genName}, {expl}: {e}")
         return jsonify({"error": "Failed to fetch backup history data"}), 500
@@ -623,7 +715,7 @@ def get_highest_radiation_per_plant():
         result = list(nuclear_radiation_collection.aggregate(pipeline))
 
         if result:
-            return jsonify(result)
+            return jsonify(format_times(result))
         else:
             return jsonify({"error": "데이터가 없습니다."}), 404
     except Exception as e:
@@ -639,11 +731,11 @@ def get_recent_plant_data():
         recent_data = []
 
         for plant in plants:
-            data = collection.find_one({"region": plant}, {"_id": 0}, sort=[("time", DESCENDING)])
+            data = collection.find_one({"genName": plant}, {"_id": 0}, sort=[("time", DESCENDING)])
             if data:
                 recent_data.append({
                     "name": genName_mapping.get(plant, "Unknown Plant"),
-                    "time": data.get("time"),
+                    "time": format_times([data])[0].get("time"),
                     "temperature": data.get("temperature", "N/A"),
                     "humidity": data.get("humidity", "N/A"),
                     "windspeed": data.get("windspeed", "N/A"),
@@ -737,6 +829,7 @@ def export_csv_by_genName(genName):
 
     cursor = backup_collection.find(query, {f: 1 for f in fields}, sort=sort)
     for doc in cursor:
+        doc = format_times([doc])[0]
         row = [doc.get(f, "") for f in fields]
         writer.writerow(row)
 
@@ -1123,13 +1216,12 @@ def accident_result_page(genName):
         rainfall = weather_data.get('rainfall', 0) if weather_data else 0
         logging.info(f"Rainfall: {rainfall} mm")
 
-        # nuclear_radiation에서 해당 발전소(genName) 방사선량 데이터 가져오기
-        radiation_data = list(nuclear_radiation_collection.find({'genName': genName}, {'_id': 0, 'value': 1}))
-        logging.info(f"Radiation data: {radiation_data}")
-
-        # 해당 발전소의 방사선량 평균 계산
-        radiation_values = [float(data['value']) for data in radiation_data if data['value'] is not None]  # float으로 변환
-        average_radiation = sum(radiation_values) / len(radiation_values) if radiation_values else 0.0
+        # 해당 발전소의 방사선량 평균 계산 (숫자로 저장된 값만 DB에서 집계)
+        averages = list(nuclear_radiation_collection.aggregate([
+            {"$match": {"genName": genName, "value": {"$type": "number"}}},
+            {"$group": {"_id": None, "average": {"$avg": "$value"}, "count": {"$sum": 1}}}
+        ]))
+        average_radiation = averages[0]["average"] if averages else 0.0
         logging.info(f"Calculated average radiation for {genName}: {average_radiation} µSv/h")
 
         # 기준값 계산: 방사선량 평균 + 0.097
@@ -1,12 +1,16 @@
+import argparse
 import schedule
 import time
-from pymongo import MongoClient, DESCENDING
+from pymongo import DESCENDING
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #from dotenv import load_dotenv
-import sys # sys 모듈 추가 (get_mongo_connection에서 sys.exit 사용)
+import mongo
+import db_indexes
 from datetime import datetime, timedelta # timedelta 추가
-import requests # 텔레그램 메시지 전송 함수 내부에서 사용
+from dateutil import parser as date_parser
+from telegram_notifier import send_telegram_message  # 큐에 넣고 바로 반환 (백그라운드 전송)
 
 # 환경 변수 로드 (telegram_config.env 파일을 사용)
 #load_dotenv("telegram_config.env")
@@ -34,91 +38,136 @@ plant_names = {
     "SU": "새울발전소 (울산 울주)"
 }
 
-# 텔레그램 메시지 전송 함수
-def send_telegram_message(token, chat_id, message):
-    """
-    텔레그램으로 메시지를 전송하는 함수
-    """
-    try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": message,
-            "parse_mode": "Markdown" # Markdown 포맷팅 사용
-        }
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status() # HTTP 오류 발생 시 예외 발생
-        logging.info("텔레그램 메시지 전송 성공.")
-    except requests.exceptions.Timeout:
-        logging.error("텔레그램 메시지 전송 시간 초과.")
-    except requests.exceptions.RequestException as e:
-        logging.error(f"텔레그램 메시지 전송 중 오류 발생: {e}")
-    except Exception as e:
-        logging.error(f"예상치 못한 텔레그램 전송 오류: {e}")
+# radiation_stats 측정소 이름 → 날씨 데이터 지역 코드 (매핑 없으면 측정소 이름 그대로 사용)
+region_mapping_for_weather = {
+    "고리본부": "KR",
+    "월성본부": "WS",
+    "한빛본부": "YK",
+    "한울본부": "UJ",
+    "새울본부": "SU"
+}
 
+# 컬렉션 정의 (공유 커넥션 풀, 첫 사용 시 연결)
+radiation_stats_collection = mongo.collection('radiation_stats') # data.py에서 처리된 최종 데이터
+average_results_collection = mongo.collection('daily_average_radiation') # 최종 평균 결과 저장
 
-# MongoDB 연결 함수
-def get_mongo_connection():
+# 과거 기간 재계산 설정 (python average.py --backfill FROM TO)
+BACKFILL_CHUNK_DAYS = 7  # 작업 하나가 순서대로 처리할 일수
+BACKFILL_WORKERS = 4  # 동시에 실행할 집계 수 (공유 커넥션 풀에서 동시에 사용하는 연결 수 상한)
+
+
+# 일일 평균 집계 파이프라인
+def daily_average_pipeline(day):
     """
-    MongoDB에 연결하고 클라이언트를 반환합니다.
-    연결에 실패하면 스크립트를 종료합니다.
+    day 하루의 발전소별 평균을 계산하여 daily_average_radiation에 (date, plant_name) 기준으로 저장하는 집계 파이프라인.
+    그날 해당 지역 날씨에 '비' 또는 '눈'이 한 번이라도 있으면 그날 측정값 전체를 비 온 날로 분류합니다.
+    측정 행마다가 아니라 발전소마다 한 번씩 날씨를 조회하도록 $group 뒤에 $lookup을 둡니다.
     """
-    try:
-        railway_mongo_uri = os.getenv("MONGO_URI")
-
-        if railway_mongo_uri:
-            # MONGO_URI에 불필요한 '=' 문자가 붙어있을 경우 제거
-            cleaned_railway_mongo_uri = railway_mongo_uri.lstrip('=')
-            client = MongoClient(cleaned_railway_mongo_uri)
-            logging.info("Railway MongoDB 클라이언트 설정 및 연결 시도 성공")
-        else:
-            # MONGO_URI가 없으면 로컬 MongoDB에 연결 (개발/테스트용)
-            client = MongoClient("mongodb://localhost:27017/")
-            logging.info("로컬 MongoDB 클라이언트 설정 완료")
+    start_of_day = datetime.combine(day, datetime.min.time())
+    end_of_day = start_of_day + timedelta(days=1)
+    region_code = {'$switch': {
+        'branches': [{'case': {'$eq': ['$_id', locNm]}, 'then': code}
+                     for locNm, code in region_mapping_for_weather.items()],
+        'default': '$_id'
+    }}
+    # 숫자로 변환할 수 없는 측정값은 평균/건수에서 제외
+    value = {'$convert': {'input': '$curVal', 'to': 'double', 'onError': None, 'onNull': None}}
+
+    return [
+        {'$match': {'tm': {'$gte': start_of_day, '$lt': end_of_day}, 'locNm': {'$ne': None}}},
+        {'$group': {
+            '_id': '$locNm',
+            'avg': {'$avg': value},
+            'count': {'$sum': {'$cond': [{'$eq': [value, None]}, 0, 1]}}
+        }},
+        # 그날 비/눈 기록이 있는지 (한 건만 확인)
+        {'$lookup': {
+            'from': 'NPP_weather',
+            'let': {'region': region_code},
+            'pipeline': [
+                {'$match': {
+                    'data_fetch_time': {'$gte': start_of_day, '$lt': end_of_day},
+                    'wthStt': {'$regex': '비|눈'},
+                    '$expr': {'$eq': ['$region', '$$region']}
+                }},
+                {'$limit': 1},
+                {'$project': {'_id': 1}}
+            ],
+            'as': 'rain_records'
+        }},
+        {'$set': {'is_rain': {'$gt': [{'$size': '$rain_records'}, 0]},
+                  'avg': {'$ifNull': ['$avg', 0]}}},
+        {'$project': {
+            '_id': 0,
+            'date': {'$literal': start_of_day.strftime('%Y-%m-%d')},
+            'plant_name': '$_id',
+            'rain_days': {'$cond': ['$is_rain', '$count', 0]},  # 비 온 날로 분류된 데이터 포인트 수
+            'no_rain_days': {'$cond': ['$is_rain', 0, '$count']},  # 비 오지 않은 날로 분류된 데이터 포인트 수
+            'rain_avg': {'$cond': ['$is_rain', '$avg', 0]},
+            'no_rain_avg': {'$cond': ['$is_rain', 0, '$avg']},
+            'processed_at': {'$literal': datetime.now()}  # 기존 행과 같이 로컬 시각 ($$NOW는 서버 UTC)
+        }},
+        # 증가율 (비가 오지 않은 날 평균이 0이면 N/A)
+        {'$set': {'percentage_increase': {'$cond': [
+            {'$gt': ['$no_rain_avg', 0]},
+            {'$toString': {'$round': [{'$multiply': [
+                {'$divide': [{'$subtract': ['$rain_avg', '$no_rain_avg']}, '$no_rain_avg']}, 100]}, 2]}},
+            'N/A'
+        ]}}},
+        {'$merge': {'into': 'daily_average_radiation', 'on': ['date', 'plant_name'],
+                    'whenMatched': 'merge', 'whenNotMatched': 'insert'}}
+    ]
 
-        return client
-    except Exception as e:
-        logging.error(f"MongoDB 연결 실패: {e}")
-        # MongoDB 연결 실패 시 텔레그램 알림
-        send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, f"MongoDB 연결 실패: {e}")
-        sys.exit(1) # 연결 실패 시 스크립트 종료
 
+def ensure_merge_index():
+    """$merge에 필요한 daily_average_radiation (date, plant_name) unique 인덱스 생성 (이미 있으면 변경 없음)"""
+    for keys, options in db_indexes.INDEXES[("Data", "daily_average_radiation")]:
+        average_results_collection.create_index(keys, **options)
 
-# MongoDB 클라이언트 초기화
-client = get_mongo_connection()
-db = client['Data']
 
-# 컬렉션 정의
-radiation_stats_collection = db['radiation_stats'] # data.py에서 처리된 최종 데이터
-weather_collection = db['NPP_weather'] # 날씨 데이터
-average_results_collection = db['daily_average_radiation'] # 최종 평균 결과 저장
+def compute_daily_average(day):
+    """하루치 평균을 계산하여 저장 (집계/날씨 판단/저장을 서버에서 한 번에 실행, $merge이므로 반환 문서 없음)"""
+    radiation_stats_collection.aggregate(daily_average_pipeline(day))
 
 
-# 날짜에 따른 날씨 데이터 가져오기 (비가 왔는지 안 왔는지)
-def get_weather_status(region_code, date_str):
+# 과거 기간 재계산 함수
+def backfill(start_day, end_day, chunk_days=BACKFILL_CHUNK_DAYS, workers=BACKFILL_WORKERS):
     """
-    주어진 지역 코드와 날짜에 해당하는 날씨 상태를 반환합니다.
-    '비' 또는 '비/눈'이 있으면 'rain', 아니면 'no_rain'을 반환합니다.
+    start_day ~ end_day(포함)의 일일 평균을 다시 계산합니다. 텔레그램 리포트는 보내지 않습니다.
+    기간을 chunk_days일씩 나누어 workers개 스레드에서 처리하며, 스레드마다 한 번에 집계 하나만 실행합니다.
+    (date, plant_name) 기준 $merge이므로 같은 기간을 다시 실행해도 결과가 중복되지 않습니다.
     """
-    # 날짜 문자열을 datetime 객체로 변환 (날짜만)
-    target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-
-    # 해당 날짜의 모든 날씨 데이터 조회
-    # data_fetch_time이 해당 날짜에 속하는 문서 검색
-    start_of_day = datetime.combine(target_date, datetime.min.time())
-    end_of_day = datetime.combine(target_date, datetime.max.time())
-
-    weather_data = weather_collection.find({
-        'region': region_code,
-        'data_fetch_time': {'$gte': start_of_day, '$lte': end_of_day}
-    })
-
-    # 해당 날짜에 비가 온 기록이 있는지 확인
-    for record in weather_data:
-        wth_stt = record.get('wthStt', '').strip()
-        if '비' in wth_stt or '눈' in wth_stt:
-            return 'rain'
-    return 'no_rain'
+    days = [start_day + timedelta(days=offset) for offset in range((end_day - start_day).days + 1)]
+    chunks = [days[index:index + chunk_days] for index in range(0, len(days), chunk_days)]
+
+    def run_chunk(chunk):
+        for day in chunk:
+            compute_daily_average(day)
+        return len(chunk)
+
+    ensure_merge_index()
+    started = time.perf_counter()
+    completed = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="average_backfill") as executor:
+        futures = {executor.submit(run_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            chunk_range = f"{chunk[0]:%Y-%m-%d} ~ {chunk[-1]:%Y-%m-%d}"
+            try:
+                completed += future.result()
+            except Exception as e:
+                failed.append(chunk_range)
+                logging.error(f"일일 평균 재계산 실패 ({chunk_range}): {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            logging.info(f"일일 평균 재계산 {chunk_range} 완료: {completed}/{len(days)}일 "
+                         f"({completed / elapsed if elapsed else 0:.1f}일/s)")
+
+    elapsed = time.perf_counter() - started
+    logging.info(f"일일 평균 재계산 완료: {completed}/{len(days)}일, {elapsed:.1f}s "
+                 f"({completed / elapsed if elapsed else 0:.1f}일/s)")
+    return completed, failed
 
 
 # 메인 처리 로직
@@ -128,110 +177,20 @@ def calculate_and_store_daily_average():
     print(f"일일 평균 방사선량 계산 시작 (현재 시간: {current_time_log})")
 
     # 어제 날짜 설정
-    yesterday = datetime.now() - timedelta(days=1)
+    yesterday = (datetime.now() - timedelta(days=1)).date()
     yesterday_date_str = yesterday.strftime('%Y-%m-%d')
     logging.info(f"처리 대상 날짜: {yesterday_date_str}")
 
-    # 어제 날짜에 해당하는 데이터만 필터링
-    start_of_yesterday = datetime.combine(yesterday.date(), datetime.min.time())
-    end_of_yesterday = datetime.combine(yesterday.date(), datetime.max.time())
-
-    # radiation_stats 컬렉션에서 어제 데이터 가져오기
-    pipeline = [
-        {
-            '$match': {
-                'tm': {'$gte': start_of_yesterday, '$lte': end_of_yesterday}
-            }
-        },
-        {
-            '$project': {
-                '_id': 0,
-                'locNm': '$locNm',
-                'curVal': '$curVal',
-                'wthStt': '$wthStt', # 날씨 상태 필드 포함
-                'tm_date': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$tm'}}, # 날짜 부분만 추출
-                'tm_hour': {'$hour': '$tm'} # 시간 부분만 추출 (나중에 사용 가능)
-            }
-        }
-    ]
-    daily_stats_data = list(radiation_stats_collection.aggregate(pipeline))
-    logging.info(f"어제 날짜({yesterday_date_str})의 radiation_stats 데이터 {len(daily_stats_data)}건 조회 완료.")
-
-    # 지역별 데이터 그룹화
-    grouped_by_plant = {}
-    for item in daily_stats_data:
-        locNm = item.get('locNm')
-        if locNm not in grouped_by_plant:
-            grouped_by_plant[locNm] = []
-        grouped_by_plant[locNm].append(item)
-
-    results_to_store = []
-
-    # 각 발전소별로 처리
-    for locNm, data_list in grouped_by_plant.items():
-        # 날씨 데이터에 사용할 region code 매핑
-        region_mapping_for_weather = {
-            "고리본부": "KR",
-            "월성본부": "WS",
-            "한빛본부": "YK",
-            "한울본부": "UJ",
-            "새울본부": "SU"
-        }
-        region_code = region_mapping_for_weather.get(locNm, locNm) # 매핑 없으면 locNm 그대로 사용
-
-        # 어제의 실제 날씨 상태 확인
-        # get_weather_status 함수는 해당 날짜에 '비'가 있는지 없는지 판단
-        actual_weather_status_yesterday = get_weather_status(region_code, yesterday_date_str)
-        logging.info(f"[{locNm}] 어제의 실제 날씨 상태 ({yesterday_date_str}): {actual_weather_status_yesterday}")
-
-        total_radiation = {'rain': [], 'no_rain': []}
-        rain_days_count = 0
-        no_rain_days_count = 0
-
-        # 데이터 순회하며 비/비 없음 분류
-        for item in data_list:
-            curVal = item.get('curVal')
-            if curVal is not None:
-                # weather_status = item.get('wthStt') # radiation_stats에 저장된 날씨 상태 (필요시 사용)
-                # 여기서는 실제 어제의 날씨 상태를 기준으로 분류
-                if actual_weather_status_yesterday == 'rain':
-                    total_radiation['rain'].append(curVal)
-                else:
-                    total_radiation['no_rain'].append(curVal)
-
-        # 평균 계산
-        rain_avg = sum(total_radiation['rain']) / len(total_radiation['rain']) if total_radiation['rain'] else 0
-        no_rain_avg = sum(total_radiation['no_rain']) / len(total_radiation['no_rain']) if total_radiation['no_rain'] else 0
-
-        # 증가율 계산 (no_rain_avg가 0이 아니어야 함)
-        percentage_increase = '-'
-        if no_rain_avg > 0:
-            increase = rain_avg - no_rain_avg
-            percentage_increase = (increase / no_rain_avg) * 100
-            percentage_increase = f"{percentage_increase:.2f}"
-        else:
-            percentage_increase = "N/A" # 비가 오지 않은 날 평균이 0일 경우
-
-        # 결과를 리스트에 추가
-        result_entry = {
-            "date": yesterday_date_str,
-            "plant_name": locNm,
-            "rain_days": len(total_radiation['rain']), # 해당 날짜에 비가 왔다고 분류된 데이터 포인트 수
-            "no_rain_days": len(total_radiation['no_rain']), # 해당 날짜에 비가 오지 않았다고 분류된 데이터 포인트 수
-            "rain_avg": rain_avg,
-            "no_rain_avg": no_rain_avg,
-            "percentage_increase": percentage_increase,
-            "processed_at": datetime.now()
-        }
-        results_to_store.append(result_entry)
-        logging.info(f"[{locNm}] 일일 평균 계산 완료: 비 온 날 평균={rain_avg:.4f} μSv/h, 비 안 온 날 평균={no_rain_avg:.4f} μSv/h, 증가율={percentage_increase}%")
-
-
-    # MongoDB average_results_collection에 저장 (날짜와 발전소 이름으로 upsert)
+    ensure_merge_index()
+    compute_daily_average(yesterday)
+
+    # 리포트용으로 저장된 결과 조회
+    results_to_store = list(average_results_collection.find({"date": yesterday_date_str}, {"_id": 0})
+                            .sort("plant_name", 1))
     if results_to_store:
         for entry in results_to_store:
-            query = {"date": entry["date"], "plant_name": entry["plant_name"]}
-            average_results_collection.update_one(query, {"$set": entry}, upsert=True)
+            logging.info(f"[{entry['plant_name']}] 일일 평균 계산 완료: 비 온 날 평균={entry['rain_avg']:.4f} μSv/h, "
+                         f"비 안 온 날 평균={entry['no_rain_avg']:.4f} μSv/h, 증가율={entry['percentage_increase']}%")
         logging.info(f"일일 평균 방사선량 데이터 {len(results_to_store)}건 average_results_collection에 저장/업데이트 완료.")
     else:
         logging.info("저장할 일일 평균 방사선량 데이터가 없습니다.")
@@ -263,7 +222,7 @@ def send_daily_report_via_telegram(avg_data_list):
                     f"비 안 온 날 평균 방사선량: `{no_rain_avg:.4f} μSv/h`\n"
                     f"방사선량 증가율: `{percentage_increase}%`\n\n"
                 )
-            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, message)
+            send_telegram_message(TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, message, parse_mode="Markdown")
             logging.info("일일 방사선량 평균 리포트 텔레그램 전송 완료.")
         else:
             logging.info("전송할 일일 평균 데이터가 없습니다.")
@@ -272,7 +231,8 @@ def send_daily_report_via_telegram(avg_data_list):
         send_telegram_message(
             TELEGRAM_TOKEN,
             TELEGRAM_CHAT_ID,
-            f"일일 리포트 전송 중 오류 발생:\\n{e}"
+            f"일일 리포트 전송 중 오류 발생:\\n{e}",
+            parse_mode="Markdown"
         )
 
 
@@ -282,3 +242,19 @@ def automate():
 
 # 스케줄 설정
 schedule.every().day.at("08:00").do(automate) # 매일 오전 8시에 실행
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="일일 평균 방사선량 과거 기간 재계산")
+    parser.add_argument("--backfill", nargs=2, metavar=("FROM", "TO"), required=True,
+                        help="재계산할 기간 (YYYY-MM-DD, 종료일 포함)")
+    parser.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="동시에 실행할 집계 수")
+    args = parser.parse_args()
+
+    backfill_start, backfill_end = (date_parser.parse(value).date() for value in args.backfill)
+    if backfill_start > backfill_end:
+        parser.error("시작일이 종료일보다 늦습니다.")
+    _, failed_chunks = backfill(backfill_start, backfill_end, chunk_days=args.chunk_days, workers=args.workers)
+    if failed_chunks:
+        print(f"실패: {', '.join(failed_chunks)}")
+        raise SystemExit(1)
@@ -1,15 +1,30 @@
 # process_radiation_stats.py
-# 이 스크립트는 24시간치 기상 및 방사선 데이터를 조회하여 결합 처리하고 MongoDB에 저장합니다.
+# 이 스크립트는 기상 및 방사선 데이터를 결합 처리하여 MongoDB(radiation_stats)에 저장합니다.
 # 1시간마다 자동 실행되며, 로깅은 파일과 stdout에 동시에 출력됩니다.
+#
+# 증분 처리: 원본(기상/방사선)별 처리 워터마크(data_fetch_time)를 ingest_state에 저장하고,
+# 매 실행마다 워터마크 이후에 수집된 문서만 조회합니다. (늦게 저장된 행을 놓치지 않도록 WATERMARK_OVERLAP만큼 겹쳐 조회)
+# - 새 방사선 행: 같은 지역에서 측정 시각 이전 가장 가까운 기상 관측(JOIN_TOLERANCE 이내)과 결합하여 조건부 upsert
+# - 늦게 도착한 기상 행: 그 관측이 결합될 수 있는 구간의 기존 행만 다시 결합
+# 결합은 양쪽을 pandas 표로 읽어 지역별 merge_asof 한 번으로 처리합니다.
+# 워터마크가 없으면(첫 실행) 최근 24시간부터 처리합니다.
+#
+# 실행 예:
+#   python data.py                                       # 1시간마다 증분 처리
+#   python data.py --backfill 2025-01-01 2025-03-31      # 과거 기간을 일 단위로 나누어 병렬 처리 (종료일 포함)
+#   python data.py --benchmark                           # 처리 기간별 소요 시간 측정 (1일/7일/30일)
 
 import logging
 import schedule
 import time
-import os
 import sys
-import atexit
-from pymongo import MongoClient
+import mongo
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+import pandas as pd
+from dateutil import parser as date_parser
+from pymongo import UpdateOne
 
 # 로깅 설정: 파일 및 stdout
 logging.basicConfig(
@@ -21,104 +36,299 @@ logging.basicConfig(
     ]
 )
 
-# MongoDB 연결 함수
-def get_mongo_connection():
-    try:
-        uri = os.getenv('MONGO_URI', '').lstrip('=').strip()
-        if uri:
-            client = MongoClient(uri)
-            logging.info('원격 MongoDB 연결 성공')
-        else:
-            client = MongoClient('mongodb://localhost:27017/')
-            logging.info('로컬 MongoDB 연결 성공')
-        return client
-    except Exception as e:
-        logging.error(f'MongoDB 연결 실패: {e}', exc_info=True)
-        sys.exit(1)
+# MongoDB 초기화 (공유 커넥션 풀, 첫 사용 시 연결)
+weather_collection   = mongo.collection('NPP_weather')
+radiation_collection = mongo.collection('NPP_radiation')
+stats_collection     = mongo.collection('radiation_stats')
+state_collection     = mongo.collection('ingest_state')  # 원본별 처리 워터마크
 
-# MongoDB 초기화
-client = get_mongo_connection()
-db = client['Data']
-weather_collection   = db['NPP_weather']
-radiation_collection = db['NPP_radiation']
-stats_collection     = db['radiation_stats']
+# 측정소 → 기상 지역 코드 (목록에 없는 측정소는 이름을 그대로 지역으로 사용)
+REGION_MAP = {'고리본부': 'KR', '월성본부': 'WS', '한빛본부': 'YK', '한울본부': 'UJ', '새울본부': 'SU'}
 
-# 기상 및 방사선 데이터 결합 처리 함수
-def process_radiation_data():
-    end   = datetime.now()
-    start = end - timedelta(days=1)
-    logging.info(f'데이터 처리 시작: {end.strftime("%Y-%m-%d %H:%M:%S")}')
-
-    # 최근 24시간 기상/방사선 데이터 조회
-    weather_data   = list(weather_collection.find({'data_fetch_time': {'$gte': start, '$lte': end}}))
-    radiation_data = list(radiation_collection.find({'data_fetch_time': {'$gte': start, '$lte': end}}))
-    logging.info(f'기상 데이터 {len(weather_data)}건, 방사선 데이터 {len(radiation_data)}건 조회')
-
-    # (지역, 시간) 키로 날씨 상태 맵 생성
-    weather_map = {}
-    for item in weather_data:
-        tm_raw = item.get('tm')
-        region = item.get('region')
-        if not (tm_raw and region):
-            continue
-        try:
-            dt_key = datetime.strptime(tm_raw[:12], '%Y%m%d%H%M').strftime('%Y-%m-%d %H')
-            key    = (region, dt_key)
-            if key not in weather_map:
-                weather_map[key] = item.get('wthStt')
-        except Exception as e:
-            logging.warning(f'날씨 데이터 파싱 오류(tm={tm_raw}): {e}')
-
-    # 결합 후 중복 제거
-    processed = {}
-    region_map = {'고리본부':'KR','월성본부':'WS','한빛본부':'YK','한울본부':'UJ','새울본부':'SU'}
-    for item in radiation_data:
-        tm_raw = item.get('tm')
-        loc    = item.get('locNm')
-        val    = item.get('curVal')
-        fetched = item.get('data_fetch_time')
-        if not (tm_raw and loc):
-            continue
-        try:
-            dt_key = datetime.strptime(tm_raw[:12], '%Y%m%d%H%M').strftime('%Y-%m-%d %H')
-            region = region_map.get(loc, loc)
-            weather_status = weather_map.get((region, dt_key))
-            key = (loc, tm_raw, fetched)
-            if key not in processed:
-                processed[key] = {
-                    'locNm': loc,
-                    'tm': datetime.strptime(tm_raw, '%Y%m%d%H%M%S'),
-                    'curVal': val,
-                    'wthStt': weather_status,
-                    'data_fetch_time': fetched
-                }
-        except Exception as e:
-            logging.warning(f'방사선 데이터 파싱 오류(tm={tm_raw}): {e}')
-
-    # MongoDB에 upsert
-    to_insert = []
-    for doc in processed.values():
-        query    = {'locNm': doc['locNm'], 'tm': doc['tm']}
-        existing = stats_collection.find_one(query)
-        if existing:
-            if doc['data_fetch_time'] > existing.get('data_fetch_time'):
-                stats_collection.update_one(query, {'$set': doc})
-                logging.info(f'업데이트: {doc["locNm"]} {doc["tm"]}')
-        else:
-            to_insert.append(doc)
-
-    if to_insert:
-        stats_collection.insert_many(to_insert)
-        logging.info(f'신규 데이터 {len(to_insert)}건 저장 완료')
+# 증분 처리 설정
+STATE_PREFIX = 'radiation_stats:'  # ingest_state _id 접두사 (+ weather / radiation)
+INITIAL_WINDOW = timedelta(days=1)  # 워터마크가 없을 때 처리할 기간
+# 수집 스크립트는 data_fetch_time을 저장 완료 전에 기록하므로, 워터마크 직전에 찍힌 행이 조회 후에 저장될 수 있음
+# 매 실행마다 워터마크보다 이만큼 앞부터 다시 조회 (수집 작업 제한 시간 10분보다 넉넉하게, 중복 처리는 조건부 upsert로 무해)
+WATERMARK_OVERLAP = timedelta(minutes=20)
+
+# 측정 시각 이전 가장 가까운 기상 관측을 찾을 최대 간격 (더 오래된 관측만 있으면 wthStt=None)
+JOIN_TOLERANCE = timedelta(hours=1)
+
+# 과거 기간 재처리 설정 (python data.py --backfill FROM TO)
+BACKFILL_CHUNK = timedelta(days=1)
+BACKFILL_WORKERS = 4
+
+# 처리 기간 측정용 (python data.py --benchmark)
+BENCHMARK_WINDOWS = [timedelta(days=1), timedelta(days=7), timedelta(days=30)]
+
+
+def region_locations(region):
+    """기상 지역 코드에 속한 측정소 이름 목록"""
+    return [loc for loc, code in REGION_MAP.items() if code == region] + [region]
+
+
+def build_upsert(doc):
+    """
+    (locNm, tm) 기준 upsert 연산.
+    저장된 문서보다 data_fetch_time이 새로울 때(또는 신규일 때)만 덮어쓰는 조건부 파이프라인 업데이트입니다.
+    값은 $literal로 감싸 '$'로 시작하는 문자열이 필드 경로로 해석되지 않도록 합니다.
+    """
+    values = {field: {'$literal': value} for field, value in doc.items()}
+    is_newer = {'$or': [
+        {'$eq': [{'$type': '$data_fetch_time'}, 'missing']},
+        {'$lt': ['$data_fetch_time', {'$literal': doc['data_fetch_time']}]}
+    ]}
+    return UpdateOne(
+        {'locNm': doc['locNm'], 'tm': doc['tm']},
+        [{'$replaceWith': {'$cond': [is_newer, {'$mergeObjects': ['$$ROOT', values]}, '$$ROOT']}}],
+        upsert=True
+    )
+
+
+def to_time(values, fmt=None):
+    """문자열/날짜 열 → datetime64[ns] 열 (변환 실패는 NaT)"""
+    if fmt is not None:
+        values = values.astype('string')
+    return pd.to_datetime(values, format=fmt, errors='coerce').astype('datetime64[ns]')
+
+
+def weather_frame(weather_data):
+    """
+    기상 문서 → (region, time, wthStt) 표.
+    같은 (지역, 관측 시각)에 여러 행이 있으면 먼저 수집된 값을 사용합니다.
+    """
+    weather = pd.DataFrame(list(weather_data), columns=['tm', 'region', 'wthStt', 'data_fetch_time'])
+    weather['time'] = to_time(weather['tm'].astype('string').str[:12], '%Y%m%d%H%M')
+    weather['data_fetch_time'] = to_time(weather['data_fetch_time'])
+    invalid = weather['time'].isna() | weather['region'].isna()
+    if invalid.any():
+        logging.warning(f'날씨 데이터 파싱 오류 {int(invalid.sum())}건 제외')
+    return (weather[~invalid]
+            .sort_values('data_fetch_time', kind='stable', na_position='last')
+            .drop_duplicates(['region', 'time'], keep='first')
+            [['region', 'time', 'wthStt']])
+
+
+def load_weather_frame(start, end, regions=None, tolerance=JOIN_TOLERANCE):
+    """관측 시각(tm)이 [start - tolerance, end]인 기상 관측 (수집 시각과 관계없이 이전 실행에서 처리한 행도 포함)"""
+    query = {'tm': {'$gte': (start - tolerance).strftime('%Y%m%d%H%M'),
+                    '$lt': (end + timedelta(minutes=1)).strftime('%Y%m%d%H%M')}}
+    if regions is not None:
+        query['region'] = {'$in': list(regions)}
+    return weather_frame(weather_collection.find(query, {'_id': 0, 'tm': 1, 'region': 1, 'wthStt': 1,
+                                                         'data_fetch_time': 1}))
+
+
+def radiation_frame(radiation_data):
+    """방사선 문서 → (locNm, region, time, curVal, data_fetch_time) 표, (locNm, tm)별로 가장 최근에 수집한 값만 남김"""
+    readings = pd.DataFrame(list(radiation_data), columns=['locNm', 'tm', 'curVal', 'data_fetch_time'])
+    readings['time'] = to_time(readings['tm'], '%Y%m%d%H%M%S')
+    readings['data_fetch_time'] = to_time(readings['data_fetch_time'])
+    invalid = readings['time'].isna() | readings['locNm'].isna()
+    if invalid.any():
+        logging.warning(f'방사선 데이터 파싱 오류 {int(invalid.sum())}건 제외')
+    readings = readings[~invalid].drop(columns='tm')
+    readings['region'] = readings['locNm'].map(REGION_MAP).fillna(readings['locNm'])
+    return (readings
+            .sort_values('data_fetch_time', kind='stable', na_position='first')
+            .drop_duplicates(['locNm', 'time'], keep='last'))
+
+
+def asof_join(readings, weather, tolerance=JOIN_TOLERANCE):
+    """
+    각 측정 행에 같은 지역에서 측정 시각 이전(같은 시각 포함) 가장 가까운 기상 관측의 wthStt를 붙입니다.
+    tolerance보다 오래된 관측만 있으면 None입니다. 전체를 한 번의 merge_asof로 결합합니다.
+    """
+    readings = readings.sort_values('time', kind='stable')
+    if weather.empty:
+        joined = readings.assign(wthStt=None)
     else:
-        logging.info('신규 데이터 없음')
+        joined = pd.merge_asof(readings, weather.sort_values('time'), on='time', by='region',
+                               direction='backward', tolerance=pd.Timedelta(tolerance))
+    joined['wthStt'] = joined['wthStt'].astype(object).where(joined['wthStt'].notna(), None)
+    return joined
+
+
+def to_documents(joined):
+    """결합 결과 → radiation_stats 문서 목록 (NaN/NaT는 None)"""
+    docs = joined[['locNm', 'time', 'curVal', 'wthStt', 'data_fetch_time']].rename(columns={'time': 'tm'})
+    docs = docs.astype(object).where(docs.notna(), None)
+    return docs.to_dict('records')
+
+
+def write_processed(processed):
+    """MongoDB에 한 번의 비순차 bulk_write로 조건부 upsert (문서별 조회 없음)"""
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    if processed:
+        with metrics.WRITE_SECONDS.time(job='data', collection='radiation_stats'):
+            result = stats_collection.bulk_write([build_upsert(doc) for doc in processed], ordered=False)
+        counts = {'inserted': result.upserted_count, 'updated': result.modified_count,
+                  'skipped': result.matched_count - result.modified_count}
+        metrics.record_rows('data', **counts)
+    return counts
+
+
+def rejoin_late_weather(weather_data, tolerance=JOIN_TOLERANCE):
+    """
+    늦게 도착한 기상 관측이 결합될 수 있는 구간(지역별 관측 시각 ~ 관측 시각 + tolerance)의
+    radiation_stats 행만 다시 결합하고, 날씨 상태가 바뀐 행 수를 반환합니다.
+    """
+    late = weather_frame(weather_data)
+    if late.empty:
+        return 0
+
+    stats = []
+    for region, times in late.groupby('region')['time']:
+        stats.extend(stats_collection.find(
+            {'locNm': {'$in': region_locations(region)},
+             'tm': {'$gte': times.min().to_pydatetime(), '$lte': (times.max() + tolerance).to_pydatetime()}},
+            {'locNm': 1, 'tm': 1, 'wthStt': 1}))
+    if not stats:
+        return 0
 
-    logging.info('데이터 처리 완료')
+    readings = pd.DataFrame(stats, columns=['_id', 'locNm', 'tm', 'wthStt']).rename(columns={'wthStt': 'previous'})
+    readings['time'] = to_time(readings['tm'])
+    readings['region'] = readings['locNm'].map(REGION_MAP).fillna(readings['locNm'])
+    weather = load_weather_frame(readings['time'].min().to_pydatetime(), readings['time'].max().to_pydatetime(),
+                                 regions=late['region'].unique(), tolerance=tolerance)
+    joined = asof_join(readings, weather, tolerance)
+    changed = joined[joined['wthStt'].fillna('').astype(str) != joined['previous'].fillna('').astype(str)]
+    if changed.empty:
+        return 0
+
+    operations = [UpdateOne({'_id': _id}, {'$set': {'wthStt': status}})
+                  for _id, status in zip(changed['_id'], changed['wthStt'])]
+    with metrics.WRITE_SECONDS.time(job='data', collection='radiation_stats'):
+        result = stats_collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def process_range(start, end, tolerance=JOIN_TOLERANCE):
+    """
+    data_fetch_time이 (start, end]인 방사선 데이터를 결합하여 저장하고 단계별 소요 시간과 저장 결과를 반환합니다.
+    워터마크를 읽거나 갱신하지 않으므로 백필/성능 측정에 사용합니다.
+    """
+    started = time.perf_counter()
+    readings = radiation_frame(radiation_collection.find({'data_fetch_time': {'$gt': start, '$lte': end}},
+                                                         {'_id': 0, 'locNm': 1, 'tm': 1, 'curVal': 1,
+                                                          'data_fetch_time': 1}))
+    weather = pd.DataFrame(columns=['region', 'time', 'wthStt'])
+    if not readings.empty:
+        weather = load_weather_frame(readings['time'].min().to_pydatetime(), readings['time'].max().to_pydatetime(),
+                                     regions=readings['region'].unique(), tolerance=tolerance)
+    read_seconds = time.perf_counter() - started
+
+    processed = to_documents(asof_join(readings, weather, tolerance))
+    join_seconds = time.perf_counter() - started - read_seconds
+
+    counts = write_processed(processed)
+    write_seconds = time.perf_counter() - started - read_seconds - join_seconds
+
+    return {'start': start, 'end': end, 'weather': len(weather), 'radiation': len(readings),
+            'rows': len(processed), **counts, 'read': read_seconds, 'join': join_seconds,
+            'write': write_seconds, 'elapsed': time.perf_counter() - started}
+
+
+def load_watermarks(default):
+    """원본별 처리 워터마크 (저장된 값이 없으면 default)"""
+    states = {doc['_id']: doc.get('data_fetch_time')
+              for doc in state_collection.find({'_id': {'$in': [STATE_PREFIX + 'weather', STATE_PREFIX + 'radiation']}})}
+    return (states.get(STATE_PREFIX + 'weather') or default,
+            states.get(STATE_PREFIX + 'radiation') or default)
+
+
+def save_watermark(source, watermark):
+    state_collection.update_one({'_id': STATE_PREFIX + source},
+                                {'$set': {'data_fetch_time': watermark, 'updated_at': datetime.now()}},
+                                upsert=True)
+
+
+# 기상 및 방사선 데이터 증분 결합 처리 함수
+def process_radiation_data():
+    """
+    워터마크(- WATERMARK_OVERLAP) 이후에 수집된 기상/방사선 데이터만 처리하고 결과를 반환합니다.
+    저장이 끝난 뒤에만 워터마크를 옮기므로, 실패하면 다음 실행에서 같은 구간을 다시 처리합니다.
+    (조건부 upsert라 같은 행을 다시 처리해도 결과는 같음)
+    """
+    started = time.perf_counter()
+    end = datetime.now()
+    weather_mark, radiation_mark = load_watermarks(end - INITIAL_WINDOW)
+    weather_mark -= WATERMARK_OVERLAP
+    radiation_mark -= WATERMARK_OVERLAP
+    logging.info(f'데이터 처리 시작: 기상 {weather_mark:%Y-%m-%d %H:%M:%S} 이후, '
+                 f'방사선 {radiation_mark:%Y-%m-%d %H:%M:%S} 이후 ~ {end:%Y-%m-%d %H:%M:%S}')
+
+    result = process_range(radiation_mark, end)
+    save_watermark('radiation', end)
+
+    new_weather = list(weather_collection.find({'data_fetch_time': {'$gt': weather_mark, '$lte': end}},
+                                               {'tm': 1, 'region': 1, 'wthStt': 1, 'data_fetch_time': 1}))
+    rejoined = rejoin_late_weather(new_weather)
+    save_watermark('weather', end)
+
+    elapsed = time.perf_counter() - started
+    logging.info(f'데이터 처리 완료: 방사선 {result["radiation"]}건 → 신규 {result["inserted"]}건, '
+                 f'갱신 {result["updated"]}건, 변경 없음 {result["skipped"]}건 / '
+                 f'신규 기상 {len(new_weather)}건 → 재결합 {rejoined}건 ({elapsed:.2f}s: 조회 {result["read"]:.2f}s, '
+                 f'결합 {result["join"]:.2f}s, 저장 {result["write"]:.2f}s)')
+    return {**result, 'new_weather': len(new_weather), 'rejoined': rejoined, 'elapsed': elapsed}
+
+
+def backfill(start, end, chunk=BACKFILL_CHUNK, workers=BACKFILL_WORKERS):
+    """
+    [start, end) 기간을 chunk 단위로 나누어 병렬로 처리합니다. 워터마크는 바꾸지 않습니다.
+    기상 상태는 측정 시각으로 조회하므로 구간 경계에서도 결합이 누락되지 않습니다.
+    """
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunks.append((chunk_start, min(chunk_start + chunk, end)))
+        chunk_start += chunk
+
+    started = time.perf_counter()
+    totals = {'radiation': 0, 'inserted': 0, 'updated': 0, 'skipped': 0}
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='data_backfill') as executor:
+        futures = {executor.submit(process_range, chunk_start, chunk_end): (chunk_start, chunk_end)
+                   for chunk_start, chunk_end in chunks}
+        for future in as_completed(futures):
+            chunk_start, chunk_end = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append((chunk_start, chunk_end))
+                logging.error(f'백필 실패 ({chunk_start:%Y-%m-%d %H:%M} ~ {chunk_end:%Y-%m-%d %H:%M}): {e}')
+                continue
+            for field in totals:
+                totals[field] += result[field]
+            logging.info(f'백필 {chunk_start:%Y-%m-%d %H:%M} ~ {chunk_end:%Y-%m-%d %H:%M}: 방사선 {result["radiation"]}건, '
+                         f'신규 {result["inserted"]}건, 갱신 {result["updated"]}건 ({result["elapsed"]:.2f}s)')
+
+    elapsed = time.perf_counter() - started
+    logging.info(f'백필 완료: {len(chunks) - len(failed)}/{len(chunks)}개 구간, 방사선 {totals["radiation"]}건, '
+                 f'신규 {totals["inserted"]}건, 갱신 {totals["updated"]}건, 변경 없음 {totals["skipped"]}건 ({elapsed:.1f}s)')
+    return totals, failed
+
+
+# 처리 기간(1일/7일/30일)별 소요 시간 측정
+# 같은 데이터를 다시 처리하면 data_fetch_time이 같아 덮어쓰지 않으므로 운영 데이터에 실행해도 결과는 바뀌지 않습니다.
+def benchmark(windows=BENCHMARK_WINDOWS):
+    end = datetime.now()
+    results = [{**process_range(end - window, end), 'window_days': window.days} for window in windows]
+    print(f"{'기간':>6}{'방사선':>10}{'처리 행':>10}{'조회':>9}{'결합':>9}{'저장':>9}{'전체':>9}")
+    for r in results:
+        print(f"{r['window_days']:>5}일{r['radiation']:>10}{r['rows']:>10}"
+              f"{r['read']:>8.2f}s{r['join']:>8.2f}s{r['write']:>8.2f}s{r['elapsed']:>8.2f}s")
+    return results
 
 # 자동 실행 함수
 def automated_process():
     logging.info('자동 처리 시작')
-    process_radiation_data()
+    try:
+        process_radiation_data()
+    except Exception as e:
+        logging.error(f'데이터 처리 실패 (워터마크 유지, 다음 실행에서 재시도): {e}')
 
 # 메인 함수
 def main():
@@ -129,8 +339,16 @@ def main():
         schedule.run_pending()
         time.sleep(1)
 
-# 종료 시 MongoDB 연결 종료 등록
-atexit.register(lambda: (client.close(), logging.info('MongoDB 연결 종료')))
-
 if __name__ == '__main__':
-    main()
+    if '--benchmark' in sys.argv:
+        benchmark()
+    elif '--backfill' in sys.argv:
+        index = sys.argv.index('--backfill')
+        if len(sys.argv) < index + 3:
+            sys.exit('사용법: python data.py --backfill FROM TO (예: 2025-01-01 2025-03-31, 종료일 포함)')
+        backfill_start = date_parser.parse(sys.argv[index + 1])
+        backfill_end = date_parser.parse(sys.argv[index + 2]) + timedelta(days=1)
+        _, failed_chunks = backfill(backfill_start, backfill_end)
+        sys.exit(1 if failed_chunks else 0)
+    else:
+        main()
@@ -0,0 +1,252 @@
+# db_indexes.py
+# app.py와 수집 스크립트가 사용하는 컬렉션의 인덱스를 한 곳에서 선언하고 관리합니다.
+# - ensure_indexes(): 선언된 인덱스를 생성 (이미 있으면 아무 작업도 하지 않으므로 시작 시마다 호출해도 안전)
+#   main.py 시작 시와 아래 apply 명령에서만 호출합니다. (웹 앱 워커는 import 시 DB에 연결하지 않음)
+# - audit(): app.py의 조회 형태별로 explain()을 실행하여 COLLSCAN 또는 메모리 정렬(SORT)이 있으면 실패 처리
+#
+# 실행 예:
+#   python db_indexes.py apply    # 인덱스 생성
+#   python db_indexes.py audit    # 실행 계획 점검 (문제가 있으면 종료 코드 1)
+
+import argparse
+import logging
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+import mongo
+
+# (데이터베이스, 컬렉션) -> [(키, 옵션), ...]
+# 기존 데이터에 중복이 있을 수 있는 수집 컬렉션은 unique를 지정하지 않습니다.
+INDEXES = {
+    ("Data", "NPP_weather"): [
+        ([("genName", ASCENDING), ("time", DESCENDING)], {}),
+        ([("data_fetch_time", ASCENDING)], {}),  # data.py 워터마크 이후 조회
+        ([("tm", ASCENDING)], {}),  # data.py 시간대별 날씨 상태 결합
+        ([("region", ASCENDING), ("data_fetch_time", ASCENDING)], {}),  # average.py 일별 비/눈 여부 $lookup
+    ],
+    ("Data", "NPP_weather_backup"): [
+        ([("genName", ASCENDING), ("time", DESCENDING)], {}),
+        ([("time", ASCENDING)], {}),  # retention.py 기한 경과 삭제
+    ],
+    ("Data", "nuclear_radiation"): [
+        ([("genName", ASCENDING), ("expl", ASCENDING), ("time", DESCENDING)], {}),
+        ([("genName", ASCENDING), ("time", DESCENDING)], {}),
+        ([("genName", ASCENDING), ("value", DESCENDING)], {}),
+        ([("time", DESCENDING)], {}),  # 발전소별 최신값 집계
+        ([("value", DESCENDING)], {}),  # 발전소별 최고값 집계
+        ([("name", ASCENDING), ("time", ASCENDING)], {}),  # 수집 upsert 키
+        ([("fetched_at", ASCENDING), ("_id", ASCENDING)], {}),  # 증분 백업 워터마크
+    ],
+    ("Data", "nuclear_radiation_backup"): [
+        ([("genName", ASCENDING), ("expl", ASCENDING), ("time", ASCENDING)], {}),
+        ([("name", ASCENDING), ("time", ASCENDING)], {}),  # 백업 upsert 키
+        ([("time", ASCENDING)], {}),  # retention.py 기한 경과 삭제 / 요약 재계산
+    ],
+    ("Data", "NPP_radiation"): [
+        ([("data_fetch_time", ASCENDING)], {}),  # data.py 워터마크 이후 조회 / 백필
+    ],
+    ("Data", "Busan_radiation"): [
+        ([("locNm", ASCENDING), ("checkTime", ASCENDING)], {}),  # 수집 upsert 키
+        ([("checkTime", DESCENDING)], {}),
+    ],
+    ("Data", "Busan_radiation_history"): [
+        ([("locNm", ASCENDING), ("day", ASCENDING)], {"unique": True}),
+        ([("day", ASCENDING)], {}),  # retention.py 기한 경과 삭제
+    ],
+    # rollups.py 시간/일 요약 (새 컬렉션이므로 upsert 키에 unique 지정)
+    ("Data", "nuclear_radiation_hourly"): [
+        ([("genName", ASCENDING), ("expl", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+        ([("bucket", ASCENDING)], {}),  # retention.py 기한 경과 삭제
+    ],
+    ("Data", "nuclear_radiation_daily"): [
+        ([("genName", ASCENDING), ("expl", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+    ],
+    ("Data", "Busan_radiation_hourly"): [
+        ([("locNm", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+        ([("bucket", ASCENDING)], {}),
+    ],
+    ("Data", "Busan_radiation_daily"): [([("locNm", ASCENDING), ("bucket", ASCENDING)], {"unique": True})],
+    ("Data", "NPP_weather_hourly"): [
+        ([("genName", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+        ([("bucket", ASCENDING)], {}),
+    ],
+    ("Data", "NPP_weather_daily"): [([("genName", ASCENDING), ("bucket", ASCENDING)], {"unique": True})],
+    ("Data", "radiation_stats"): [
+        ([("locNm", ASCENDING), ("tm", ASCENDING)], {}),  # data.py upsert 키
+        ([("tm", DESCENDING)], {}),
+        ([("date", DESCENDING)], {}),
+    ],
+    # average.py $merge 대상 (on 필드에 unique 인덱스 필요)
+    ("Data", "daily_average_radiation"): [
+        ([("date", ASCENDING), ("plant_name", ASCENDING)], {"unique": True}),
+    ],
+    ("Data", "users"): [
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING)], {}),
+    ],
+    ("Data", "Data_CAU"): [([("time", DESCENDING)], {})],
+    ("Data", "Data_FNC"): [([("time", DESCENDING)], {})],
+    ("Data", "Data_RMT"): [([("time", DESCENDING)], {})],
+    ("radiation_statistics", "daily_average"): [([("date", DESCENDING)], {})],
+    ("radiation_statistics", "regional_average"): [([("date", DESCENDING)], {})],
+}
+
+# 점검용 예시 값
+_SAMPLE_DAY = datetime(2025, 7, 8)
+
+# app.py의 조회 형태 (find / aggregate / distinct)
+QUERY_SHAPES = [
+    {"name": "기상 최신값", "db": "Data", "collection": "NPP_weather",
+     "filter": {"genName": "KR"}, "sort": [("time", DESCENDING)], "limit": 1},
+    {"name": "기상 기간 조회", "db": "Data", "collection": "NPP_weather_backup",
+     "filter": {"genName": "KR", "time": {"$gte": _SAMPLE_DAY, "$lt": _SAMPLE_DAY + timedelta(days=1)}},
+     "sort": [("time", DESCENDING)]},
+    {"name": "기상 최근 200건", "db": "Data", "collection": "NPP_weather_backup",
+     "filter": {"genName": "KR"}, "sort": [("time", DESCENDING)], "limit": 200},
+    {"name": "풍향/풍속", "db": "Data", "collection": "NPP_weather_backup",
+     "filter": {"genName": "KR"}},
+    {"name": "부산 최신값", "db": "Data", "collection": "Busan_radiation",
+     "filter": {}, "sort": [("checkTime", DESCENDING)]},
+    {"name": "부산 이력", "db": "Data", "collection": "Busan_radiation_history",
+     "filter": {"locNm": "부산시청", "day": {"$gte": _SAMPLE_DAY}}, "sort": [("day", DESCENDING)]},
+    {"name": "방사선 발전소별 조회", "db": "Data", "collection": "nuclear_radiation",
+     "filter": {"genName": "KR", "time": {"$gte": _SAMPLE_DAY, "$lt": _SAMPLE_DAY + timedelta(days=1)}},
+     "sort": [("time", DESCENDING)]},
+    {"name": "방사선 측정소 최근 4건", "db": "Data", "collection": "nuclear_radiation",
+     "filter": {"genName": "KR", "expl": "ERMS-1"}, "sort": [("time", DESCENDING)], "limit": 4},
+    {"name": "방사선 발전소 최고값", "db": "Data", "collection": "nuclear_radiation",
+     "filter": {"genName": "KR"}, "sort": [("value", DESCENDING)], "limit": 1},
+    {"name": "방사선 발전소 평균", "db": "Data", "collection": "nuclear_radiation",
+     "filter": {"genName": "KR"}},
+    {"name": "방사선 측정소 목록", "db": "Data", "collection": "nuclear_radiation",
+     "distinct": "expl", "filter": {"genName": "KR"}},
+    {"name": "방사선 최신값 집계", "db": "Data", "collection": "nuclear_radiation",
+     "pipeline": [{"$sort": {"time": -1}},
+                  {"$group": {"_id": "$genName", "time": {"$first": "$time"}, "value": {"$first": "$value"}}}]},
+    {"name": "방사선 최고값 집계", "db": "Data", "collection": "nuclear_radiation",
+     "pipeline": [{"$sort": {"value": -1}},
+                  {"$group": {"_id": "$genName", "max_value": {"$max": "$value"}, "time": {"$first": "$time"}}}]},
+    {"name": "방사선 백업 이력", "db": "Data", "collection": "nuclear_radiation_backup",
+     "filter": {"genName": "KR", "expl": "ERMS-1"}, "sort": [("time", ASCENDING)]},
+    {"name": "방사선 시간 요약", "db": "Data", "collection": "nuclear_radiation_hourly",
+     "filter": {"genName": "KR", "expl": "ERMS-1"}, "sort": [("bucket", ASCENDING)]},
+    {"name": "부산 일 요약", "db": "Data", "collection": "Busan_radiation_daily",
+     "filter": {"locNm": "부산시청", "bucket": {"$gte": _SAMPLE_DAY}}, "sort": [("bucket", ASCENDING)]},
+    {"name": "기상 시간 요약", "db": "Data", "collection": "NPP_weather_hourly",
+     "filter": {"genName": "KR", "bucket": {"$gte": _SAMPLE_DAY, "$lt": _SAMPLE_DAY + timedelta(days=1)}},
+     "sort": [("bucket", ASCENDING)]},
+    {"name": "방사선 통계 최근값", "db": "Data", "collection": "radiation_stats",
+     "filter": {}, "sort": [("date", DESCENDING)], "limit": 35},
+    {"name": "지역 평균", "db": "radiation_statistics", "collection": "regional_average",
+     "filter": {}, "sort": [("date", DESCENDING)]},
+    {"name": "사용자 로그인", "db": "Data", "collection": "users",
+     "filter": {"email": "user@example.com"}, "limit": 1},
+    {"name": "가입 승인 대기", "db": "Data", "collection": "users",
+     "filter": {"status": "pending"}},
+    {"name": "분석1", "db": "Data", "collection": "Data_CAU", "filter": {}, "sort": [("time", DESCENDING)]},
+    {"name": "분석2", "db": "Data", "collection": "Data_FNC", "filter": {}, "sort": [("time", DESCENDING)]},
+    {"name": "분석4", "db": "Data", "collection": "Data_RMT", "filter": {}, "sort": [("time", DESCENDING)]},
+]
+
+# 문제로 판단하는 실행 단계
+BAD_STAGES = {"COLLSCAN": "컬렉션 전체 스캔", "SORT": "메모리 정렬", "$sort": "메모리 정렬"}
+
+
+def ensure_indexes(client=None):
+    """선언된 인덱스를 생성합니다. 실패한 인덱스는 로그만 남기고 나머지는 계속 생성합니다."""
+    client = client or mongo.get_client()
+    created, failed = 0, 0
+    for (db_name, collection_name), specs in INDEXES.items():
+        collection = client[db_name][collection_name]
+        for keys, options in specs:
+            try:
+                collection.create_index(keys, **options)
+                created += 1
+            except PyMongoError as e:
+                failed += 1
+                logging.error(f"인덱스 생성 실패 {db_name}.{collection_name} {keys}: {e}")
+    logging.info(f"인덱스 확인 완료: {created}개 적용, {failed}개 실패")
+    return failed == 0
+
+
+def _plan_stages(node, stages):
+    """explain 결과에서 채택된 실행 계획의 단계 이름을 모두 수집"""
+    if isinstance(node, dict):
+        if isinstance(node.get("stage"), str):
+            stages.append(node["stage"])
+        for key, value in node.items():
+            if key in ("rejectedPlans", "allPlansExecution", "command"):
+                continue  # 채택되지 않은 계획과 요청 원문은 제외
+            if key == "stages" and isinstance(value, list):
+                # 파이프라인 단계: 인덱스로 처리된 $sort는 $cursor 안으로 흡수되어 여기 남지 않음
+                for item in value:
+                    for name, stage in item.items():
+                        if name != "$cursor":
+                            stages.append(name)
+                        _plan_stages(stage, stages)
+                continue
+            _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+def explain_shape(client, shape):
+    """조회 형태 하나의 explain 결과"""
+    db = client[shape["db"]]
+    collection = db[shape["collection"]]
+    if "pipeline" in shape:
+        return db.command("aggregate", shape["collection"], pipeline=shape["pipeline"], explain=True)
+    if "distinct" in shape:
+        return db.command("explain", {"distinct": shape["collection"], "key": shape["distinct"],
+                                      "query": shape.get("filter", {})})
+    cursor = collection.find(shape.get("filter", {}))
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    if shape.get("limit"):
+        cursor = cursor.limit(shape["limit"])
+    return cursor.explain()
+
+
+def audit(client=None):
+    """모든 조회 형태의 실행 계획을 점검하고 (이름, 문제 목록) 리스트를 반환"""
+    client = client or mongo.get_client()
+    results = []
+    for shape in QUERY_SHAPES:
+        try:
+            stages = _plan_stages(explain_shape(client, shape), [])
+            problems = sorted({BAD_STAGES[stage] for stage in stages if stage in BAD_STAGES})
+        except PyMongoError as e:
+            problems = [f"explain 실패: {e}"]
+            stages = []
+        results.append({"name": shape["name"], "collection": f"{shape['db']}.{shape['collection']}",
+                        "stages": stages, "problems": problems})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="인덱스 생성 및 실행 계획 점검")
+    parser.add_argument("command", choices=["apply", "audit"])
+    parser.add_argument("--apply-first", action="store_true", help="audit 전에 인덱스를 먼저 생성")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    mongo_client = mongo.get_client()
+    if args.command == "apply":
+        sys.exit(0 if ensure_indexes(mongo_client) else 1)
+
+    if args.apply_first:
+        ensure_indexes(mongo_client)
+    failures = 0
+    for result in audit(mongo_client):
+        status = "OK " if not result["problems"] else "FAIL"
+        if result["problems"]:
+            failures += 1
+        print(f"[{status}] {result['name']:<20} {result['collection']:<40} "
+              f"{' > '.join(result['stages']) or '-'}  {', '.join(result['problems'])}")
+    print(f"조회 형태 {len(QUERY_SHAPES)}개 중 문제 {failures}개")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,163 @@
+# error_digest.py
+# 수집 오류 텔레그램 알림을 묶어서 보내는 모듈입니다.
+# KHNP 서버 장애 시 발전소/지역마다 알림을 보내는 대신, 같은 오류 시그니처(엔드포인트, 오류 유형)를
+# 집계 시간(WINDOW_SECONDS) 동안 모아 한 번의 요약 메시지로 전송합니다.
+# - 새로운 시그니처가 생기거나 새 대상(발전소/지역)이 추가될 때만 알림 (같은 장애는 반복 전송하지 않음)
+# - 알림을 보낸 시그니처의 모든 대상이 정상화되면 복구 알림을 한 번 전송
+# - 같은 채널(봇 토큰, 채팅 ID)을 쓰는 모듈은 하나의 요약을 공유 (for_channel)
+
+import atexit
+import html
+import logging
+import threading
+from datetime import datetime
+
+from telegram_notifier import send_telegram_message
+
+WINDOW_SECONDS = 120  # 첫 오류 이후 요약을 보내기까지 모으는 시간(초)
+DETAIL_LENGTH = 200  # 요약에 포함할 오류 메시지 최대 길이
+
+_registry_lock = threading.Lock()
+_digests = {}  # (token, chat_id) -> ErrorDigest
+
+
+def error_kind(error):
+    """오류 유형 이름 (예외는 클래스 이름, 문자열은 그대로 사용. 예: 'HTTP 503')"""
+    if isinstance(error, BaseException):
+        return type(error).__name__
+    return str(error)
+
+
+def _format_time(value):
+    return value.strftime("%m-%d %H:%M")
+
+
+class ErrorDigest:
+    """한 텔레그램 채널로 보내는 오류 요약"""
+
+    def __init__(self, token, chat_id, window=WINDOW_SECONDS):
+        self.token = token
+        self.chat_id = chat_id
+        self.window = window
+        self._lock = threading.Lock()
+        self._active = {}  # (endpoint, kind) -> 상태
+        self._recovered = []  # 알림 후 복구되어 아직 보고하지 않은 (시그니처, 상태)
+        self._timer = None
+
+    def report(self, endpoint, subject, error):
+        """
+        대상(subject, 예: 발전소 코드)의 엔드포인트 요청이 실패했음을 기록합니다.
+        같은 대상의 다른 오류 유형은 이 오류로 바뀐 것으로 처리합니다.
+        """
+        signature = (endpoint, error_kind(error))
+        now = datetime.now()
+        with self._lock:
+            self._clear_subject(endpoint, subject, keep=signature)
+            state = self._active.get(signature)
+            if state is None:
+                state = self._active[signature] = {
+                    "count": 0,
+                    "subjects": set(),
+                    "notified_subjects": set(),
+                    "first_seen": now,
+                    "last_seen": now,
+                    "detail": ""
+                }
+            state["count"] += 1
+            state["subjects"].add(subject)
+            state["last_seen"] = now
+            state["detail"] = str(error)[:DETAIL_LENGTH]
+            if not state["subjects"] <= state["notified_subjects"]:
+                self._schedule()
+
+    def resolve(self, endpoint, subject):
+        """대상의 엔드포인트 요청이 성공했음을 기록 (시그니처의 모든 대상이 정상화되면 복구)"""
+        with self._lock:
+            self._clear_subject(endpoint, subject)
+
+    def _clear_subject(self, endpoint, subject, keep=None):
+        """잠금 보유 상태에서 호출"""
+        for signature, state in list(self._active.items()):
+            if signature[0] != endpoint or signature == keep or subject not in state["subjects"]:
+                continue
+            state["subjects"].discard(subject)
+            if state["subjects"]:
+                continue
+            del self._active[signature]
+            # 알림을 보내지 않은 일시적 오류는 복구 알림도 보내지 않음
+            if state["notified_subjects"]:
+                state["recovered_at"] = datetime.now()
+                self._recovered.append((signature, state))
+                self._schedule()
+
+    def _schedule(self):
+        """집계 시간이 지나면 요약을 전송하도록 예약 (잠금 보유 상태에서 호출)"""
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """모인 변경 사항이 있으면 요약 메시지 1건을 전송"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            new = []
+            ongoing = []
+            for signature, state in sorted(self._active.items()):
+                added = state["subjects"] - state["notified_subjects"]
+                (new if added else ongoing).append((signature, dict(state, subjects=set(state["subjects"]))))
+                state["notified_subjects"] |= state["subjects"]
+            recovered = self._recovered
+            self._recovered = []
+
+        if not new and not recovered:
+            return
+        message = self._format(new, ongoing, recovered)
+        logging.info(f"오류 요약 전송: 신규/변경 {len(new)}건, 지속 {len(ongoing)}건, 복구 {len(recovered)}건")
+        send_telegram_message(self.token, self.chat_id, message)
+
+    @staticmethod
+    def _format(new, ongoing, recovered):
+        def line(signature, state):
+            endpoint, kind = signature
+            subjects = ", ".join(sorted(state["subjects"]))
+            return (f"- <b>{html.escape(endpoint)}</b> · {html.escape(kind)}: {state['count']}회 "
+                    f"({html.escape(subjects)}, {_format_time(state['first_seen'])}~{_format_time(state['last_seen'])})")
+
+        lines = [f"<b>[수집 오류 요약]</b> {datetime.now():%Y-%m-%d %H:%M}"]
+        if new:
+            lines.append("\n⚠️ 신규/변경")
+            for signature, state in new:
+                lines.append(line(signature, state))
+                lines.append(f"  <code>{html.escape(state['detail'])}</code>")
+        if ongoing:
+            lines.append("\n⏳ 지속 중")
+            lines.extend(line(signature, state) for signature, state in ongoing)
+        if recovered:
+            lines.append("\n✅ 복구")
+            for (endpoint, kind), state in recovered:
+                lines.append(f"- <b>{html.escape(endpoint)}</b> · {html.escape(kind)}: 총 {state['count']}회, "
+                             f"{_format_time(state['first_seen'])}~{_format_time(state['recovered_at'])}")
+        return "\n".join(lines)
+
+
+def for_channel(token, chat_id, window=WINDOW_SECONDS):
+    """채널(봇 토큰, 채팅 ID)별로 공유되는 ErrorDigest"""
+    with _registry_lock:
+        digest = _digests.get((token, chat_id))
+        if digest is None:
+            digest = _digests[(token, chat_id)] = ErrorDigest(token, chat_id, window=window)
+        return digest
+
+
+def flush_all():
+    """종료 전 모든 채널의 남은 요약을 전송"""
+    with _registry_lock:
+        digests = list(_digests.values())
+    for digest in digests:
+        digest.flush()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,76 @@
+# fingerprint.py
+# 엔드포인트별 응답 본문 해시와 최신 측정 시각을 기억하여, 내용이 바뀌지 않은 수집 주기를 건너뛰도록 합니다.
+# KHNP는 약 10분, 부산 API는 1시간 단위로 갱신되므로 같은 응답을 다시 파싱/저장/백업하는 일을 줄여줍니다.
+# 지문은 저장이 성공한 뒤에만 갱신해야 합니다. (저장에 실패한 응답은 다음 주기에 다시 처리)
+# 해시는 HashingStream으로 xml_stream 파서가 읽는 조각마다 갱신하므로 응답 본문 전체를 메모리에 모으지 않습니다.
+
+import hashlib
+import logging
+import threading
+
+import metrics
+
+_lock = threading.Lock()
+_fingerprints = {}  # endpoint -> {"hash": str, "latest_time": datetime}
+_cycle_counts = {}  # source -> {"skipped": int, "effective": int}
+
+
+def body_hash(body):
+    """응답 본문(bytes)의 SHA-256 해시"""
+    return hashlib.sha256(body).hexdigest()
+
+
+class HashingStream:
+    """
+    requests 응답(stream=True)을 감싸 xml_stream 파서가 조각을 읽을 때마다 SHA-256을 갱신합니다.
+    파서가 본문을 끝까지 읽은 뒤 hexdigest()가 body_hash(전체 본문)와 같습니다.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._hash = hashlib.sha256()
+
+    def iter_content(self, chunk_size):
+        for chunk in self._response.iter_content(chunk_size=chunk_size):
+            self._hash.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def is_unchanged(endpoint, digest):
+    """마지막으로 저장에 성공한 응답과 해시가 같은지 확인"""
+    with _lock:
+        previous = _fingerprints.get(endpoint)
+    return previous is not None and previous["hash"] == digest
+
+
+def remember(endpoint, digest, latest_time=None):
+    """저장에 성공한 응답의 해시와 최신 측정 시각을 기록"""
+    with _lock:
+        _fingerprints[endpoint] = {"hash": digest, "latest_time": latest_time}
+
+
+def latest_time(endpoint):
+    """엔드포인트의 마지막 최신 측정 시각 (없으면 None)"""
+    with _lock:
+        previous = _fingerprints.get(endpoint)
+    return previous["latest_time"] if previous else None
+
+
+def record_cycle(source, skipped):
+    """수집 주기 결과(건너뜀/반영)를 집계하고 현재 누적값을 로그로 남김"""
+    with _lock:
+        counts = _cycle_counts.setdefault(source, {"skipped": 0, "effective": 0})
+        counts["skipped" if skipped else "effective"] += 1
+        snapshot = dict(counts)
+    metrics.CYCLES.inc(job=source, result="skipped" if skipped else "effective")
+    logging.info(f"[{source}] 수집 주기 {'건너뜀' if skipped else '반영'} "
+                 f"(누적 건너뜀 {snapshot['skipped']}회 / 반영 {snapshot['effective']}회)")
+
+
+def cycle_counts():
+    """소스별 건너뜀/반영 주기 수"""
+    with _lock:
+        return {source: dict(counts) for source, counts in _cycle_counts.items()}
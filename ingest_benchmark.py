@@ -0,0 +1,121 @@
+# ingest_benchmark.py
+# mock_api_server.py와 로컬 MongoDB를 대상으로 수집 주기(NPP_weather, NPP_radiation, Busan_radiation)를
+# 반복 실행하여 처리량을 측정합니다. 수집 코드 변경 전후의 성능을 숫자로 비교하기 위한 도구입니다.
+#
+# 실행 예:
+#   python ingest_benchmark.py --cycles 50 --latency 0.05 --jitter 0.05 --stations 40 --busan-stations 300
+#   python ingest_benchmark.py --cycles 20 --static          (응답 변경 없음 → 건너뛰기 경로 측정)
+#
+# 주의: 수집 스크립트가 사용하는 로컬 MongoDB의 Data 데이터베이스에 실제로 기록합니다.
+
+import argparse
+import importlib
+import json
+import logging
+import math
+import os
+import time
+from urllib.parse import urlparse
+
+import mock_api_server
+
+JOBS = ["NPP_weather", "NPP_radiation", "Busan_radiation"]
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def percentile(values, percent):
+    """값 목록의 백분위수 (nearest-rank)"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def rows_written(metrics, job):
+    """지표에 누적된 신규+변경 행 수"""
+    return metrics.ROWS.value(job=job, result="inserted") + metrics.ROWS.value(job=job, result="updated")
+
+
+def run_benchmark(jobs, cycles, warmup=1):
+    """
+    작업별로 수집 주기를 cycles회 실행하고 결과를 반환합니다.
+    환경 변수(KHNP_BASE_URL 등) 설정 후 호출해야 수집 모듈이 mock 서버로 연결됩니다.
+    """
+    import metrics
+
+    modules = {job: importlib.import_module(job) for job in jobs}
+    results = {}
+    for job, module in modules.items():
+        # 첫 주기는 연결 수립/인덱스 생성 등이 섞이므로 측정에서 제외
+        for _ in range(warmup):
+            module.scheduled_task()
+
+        durations = []
+        rows_before = rows_written(metrics, job)
+        started = time.perf_counter()
+        for _ in range(cycles):
+            cycle_started = time.perf_counter()
+            module.scheduled_task()
+            durations.append(time.perf_counter() - cycle_started)
+        elapsed = time.perf_counter() - started
+        rows = rows_written(metrics, job) - rows_before
+
+        results[job] = {
+            "cycles": cycles,
+            "elapsed": elapsed,
+            "cycles_per_sec": cycles / elapsed if elapsed else None,
+            "rows": rows,
+            "rows_per_sec": rows / elapsed if elapsed else None,
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "max": max(durations) if durations else None
+        }
+    return results
+
+
+def format_report(results):
+    lines = [f"{'작업':<16}{'주기':>6}{'cycles/s':>10}{'rows':>9}{'rows/s':>10}{'p50':>9}{'p95':>9}{'max':>9}"]
+    for job, result in results.items():
+        lines.append(
+            f"{job:<16}{result['cycles']:>6}{result['cycles_per_sec']:>10.2f}{result['rows']:>9}"
+            f"{result['rows_per_sec']:>10.1f}{result['p50']:>8.3f}s{result['p95']:>8.3f}s{result['max']:>8.3f}s")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="수집 주기 처리량 벤치마크 (mock API + 로컬 MongoDB)")
+    parser.add_argument("--cycles", type=int, default=20, help="작업별 측정 주기 수")
+    parser.add_argument("--warmup", type=int, default=1, help="측정 전 실행할 주기 수")
+    parser.add_argument("--jobs", default=",".join(JOBS), help=f"측정할 작업 (쉼표 구분, 기본: {','.join(JOBS)})")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/", help="벤치마크용 MongoDB URI")
+    parser.add_argument("--allow-remote", action="store_true", help="로컬이 아닌 MongoDB 사용 허용")
+    parser.add_argument("--json", dest="json_path", help="결과를 JSON 파일로 저장 (변경 전후 비교용)")
+    mock_api_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s:%(message)s')
+    jobs = [job.strip() for job in args.jobs.split(",") if job.strip()]
+    unknown = [job for job in jobs if job not in JOBS]
+    if unknown:
+        parser.error(f"알 수 없는 작업: {unknown}")
+    if urlparse(args.mongo_uri).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error("운영 데이터 보호를 위해 로컬 MongoDB만 사용합니다. (--allow-remote로 해제)")
+
+    server, base = mock_api_server.start_server(mock_api_server.settings_from_args(args))
+    # 수집 모듈은 import 시점에 설정을 읽으므로 import 전에 환경 변수를 지정
+    os.environ.update(mock_api_server.base_urls(base))
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ.setdefault("Service_key", "benchmark")
+
+    print(f"mock API: {base} (지연 {args.latency}s + 최대 {args.jitter}s, 오류율 {args.error_rate})")
+    try:
+        results = run_benchmark(jobs, args.cycles, warmup=args.warmup)
+    finally:
+        server.shutdown()
+
+    print(format_report(results))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"결과 저장: {args.json_path}")
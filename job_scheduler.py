@@ -0,0 +1,228 @@
+# job_scheduler.py
+# main.py에서 사용하는 단일 프로세스 작업 스케줄러입니다.
+# 하나의 디스패처 스레드가 실행 시각을 판단하고, 작업 실행은 워커 풀에서 처리합니다.
+# - 작업별 동시 실행 1개 제한 (이전 실행이 끝나지 않았으면 겹쳐 실행하지 않음)
+# - 실행 시각 지터(jitter)로 여러 작업이 같은 순간에 몰리지 않도록 분산
+# - 긴 실행 때문에 놓친 실행은 끝난 직후 한 번만 보충 실행 (catch-up)
+# - 작업별 제한 시간 초과 감지 및 다음 실행 시각/최근 소요 시간/상태 현황표 제공
+# 시작 시 초기 작업은 run_task_graph()로 의존 관계에 따라 병렬 실행합니다.
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+import metrics
+
+TICK_SECONDS = 1  # 디스패처 확인 주기(초)
+
+# 지표 레이블용 상태 이름
+STATUS_LABELS = {"성공": "success", "실패": "failure", "시간 초과": "timeout"}
+
+
+class Job:
+    """스케줄러에 등록되는 작업 하나의 설정과 실행 상태"""
+
+    def __init__(self, name, func, interval=None, at=None, jitter=0, timeout=None):
+        if (interval is None) == (at is None):
+            raise ValueError("interval(초) 또는 at('HH:MM') 중 하나만 지정해야 합니다.")
+        self.name = name
+        self.func = func
+        self.interval = timedelta(seconds=interval) if interval is not None else None
+        self.at = datetime.strptime(at, "%H:%M").time() if at is not None else None
+        self.jitter = jitter
+        self.timeout = timeout
+
+        self.next_run = None  # 지터를 더한 실제 실행 시각 (디스패처가 확인)
+        self._base_run = None  # 지터를 더하기 전 주기 기준 시각 (지터가 누적되지 않도록 이 값으로 다음 시각 계산)
+        self.last_run = None
+        self.last_duration = None
+        self.last_status = "대기"
+        self.running = False
+        self.started_at = None
+        self.timed_out = False
+        self.catch_up = False
+
+    def describe(self):
+        if self.at is not None:
+            return f"매일 {self.at.strftime('%H:%M')}"
+        return f"{int(self.interval.total_seconds() // 60)}분마다"
+
+    def schedule_next(self, now):
+        """다음 실행 시각 계산 (지나간 실행 시각은 건너뛰고 지터를 더함)"""
+        if self.at is not None:
+            next_run = datetime.combine(now.date(), self.at)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+        else:
+            next_run = (self._base_run or now) + self.interval
+            while next_run <= now:
+                next_run += self.interval
+        self._base_run = next_run
+        self.next_run = next_run + timedelta(seconds=random.uniform(0, self.jitter))
+
+
+class JobScheduler:
+    """디스패처 1개 + 워커 풀로 등록된 작업을 실행하는 스케줄러"""
+
+    def __init__(self, max_workers=None):
+        self.jobs = []
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = None
+        self._dispatcher = None
+
+    def add_job(self, name, func, interval=None, at=None, jitter=0, timeout=None, run_now=False):
+        """
+        작업 등록. interval은 초 단위 반복 주기, at은 매일 실행할 'HH:MM'.
+        run_now=True이면 시작 직후 한 번 실행합니다.
+        """
+        job = Job(name, func, interval=interval, at=at, jitter=jitter, timeout=timeout)
+        now = datetime.now()
+        if run_now:
+            job.next_run = job._base_run = now
+        else:
+            job.schedule_next(now)
+        with self._lock:
+            self.jobs.append(job)
+        return job
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers or max(1, len(self.jobs)),
+                                            thread_name_prefix="job")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job_dispatcher", daemon=True)
+        self._dispatcher.start()
+        logging.info(f"스케줄러 시작: 작업 {len(self.jobs)}개")
+
+    def stop(self, wait=False):
+        self._stop.set()
+        if self._dispatcher:
+            self._dispatcher.join(timeout=TICK_SECONDS * 2)
+        if self._executor:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            now = datetime.now()
+            with self._lock:
+                for job in self.jobs:
+                    if job.running:
+                        self._check_running(job, now)
+                    elif job.next_run <= now:
+                        job.running = True
+                        job.started_at = now
+                        job.timed_out = False
+                        job.last_status = "실행 중"
+                        job.schedule_next(now)
+                        self._executor.submit(self._run, job)
+            self._stop.wait(TICK_SECONDS)
+
+    def _check_running(self, job, now):
+        """실행 중인 작업의 제한 시간 초과와 놓친 실행 시각을 확인 (잠금 보유 상태에서 호출)"""
+        if job.timeout and not job.timed_out and now - job.started_at > timedelta(seconds=job.timeout):
+            # 스레드는 강제로 중단할 수 없으므로 표시만 하고, 끝날 때까지 겹쳐 실행하지 않음
+            job.timed_out = True
+            job.last_status = "시간 초과"
+            logging.error(f"[{job.name}] 제한 시간 {job.timeout}초 초과 (실행 중, 다음 실행은 종료 후 진행)")
+        if job.next_run <= now:
+            # 실행 중에 놓친 실행은 한 번으로 합쳐 종료 직후 보충 실행
+            if not job.catch_up:
+                logging.warning(f"[{job.name}] 이전 실행이 끝나지 않아 {job.next_run:%H:%M:%S} 실행을 보류, 종료 후 보충 실행")
+            job.catch_up = True
+            job.schedule_next(now)
+
+    def _run(self, job):
+        started = time.perf_counter()
+        status = "성공"
+        try:
+            job.func()
+        except Exception as e:
+            status = "실패"
+            logging.error(f"[{job.name}] 작업 실행 중 오류 발생: {e}", exc_info=True)
+        finally:
+            duration = time.perf_counter() - started
+            now = datetime.now()
+            with self._lock:
+                job.running = False
+                job.last_run = job.started_at
+                job.last_duration = duration
+                job.last_status = "시간 초과" if job.timed_out else status
+                if job.catch_up:
+                    job.catch_up = False
+                    job.next_run = now
+            metrics.JOB_SECONDS.observe(duration, job=job.name)
+            metrics.JOB_RUNS.inc(job=job.name, status=STATUS_LABELS[job.last_status])
+            logging.info(f"[{job.name}] 작업 {job.last_status} ({duration:.2f}s)")
+
+    def status_table(self):
+        """작업별 현황 (다음 실행 / 최근 소요 시간 / 최근 상태)"""
+        with self._lock:
+            return [{
+                "name": job.name,
+                "schedule": job.describe(),
+                "next_run": job.next_run,
+                "last_run": job.last_run,
+                "last_duration": job.last_duration,
+                "last_status": job.last_status,
+                "running": job.running
+            } for job in self.jobs]
+
+    def format_status_table(self):
+        """현황표를 로그 출력용 문자열로 변환"""
+        lines = [f"{'작업':<16}{'주기':<12}{'다음 실행':<21}{'최근 소요':>10}  상태"]
+        for row in self.status_table():
+            next_run = row["next_run"].strftime("%Y-%m-%d %H:%M:%S") if row["next_run"] else "-"
+            duration = f"{row['last_duration']:.1f}s" if row["last_duration"] is not None else "-"
+            lines.append(f"{row['name']:<16}{row['schedule']:<12}{next_run:<21}{duration:>10}  {row['last_status']}")
+        return "\n".join(lines)
+
+
+def run_task_graph(tasks, max_workers=None):
+    """
+    의존 관계가 있는 초기 작업들을 가능한 한 병렬로 실행합니다.
+    tasks: {이름: (함수, [선행 작업 이름, ...])}
+    선행 작업이 실패해도 후속 작업은 실행하며(이미 저장된 데이터로 처리), 작업별 결과를 반환합니다.
+    """
+    for name, (_, deps) in tasks.items():
+        unknown = [dep for dep in deps if dep not in tasks]
+        if unknown:
+            raise ValueError(f"[{name}] 알 수 없는 선행 작업: {unknown}")
+
+    results = {}  # 이름 -> {"status", "duration"}
+    started = time.perf_counter()
+
+    def run(name, func):
+        task_started = time.perf_counter()
+        try:
+            func()
+            status = "성공"
+        except Exception as e:
+            status = "실패"
+            logging.error(f"[초기 작업 {name}] 실행 중 오류 발생: {e}", exc_info=True)
+        duration = time.perf_counter() - task_started
+        logging.info(f"[초기 작업 {name}] {status} ({duration:.2f}s)")
+        return {"status": status, "duration": duration}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks), thread_name_prefix="warm_start") as executor:
+        pending = dict(tasks)
+        running = {}
+        while pending or running:
+            # 선행 작업이 모두 끝난 작업 제출
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    failed = [dep for dep in deps if results[dep]["status"] != "성공"]
+                    if failed:
+                        logging.warning(f"[초기 작업 {name}] 선행 작업 실패({', '.join(failed)}), 기존 데이터로 진행")
+                    running[executor.submit(run, name, func)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"순환 의존 관계: {list(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    logging.info(f"초기 작업 {len(tasks)}개 완료, 준비까지 {time.perf_counter() - started:.2f}s")
+    return results
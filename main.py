@@ -4,7 +4,10 @@ import time
 import logging
 from datetime import datetime
 import sys
-import threading # 스케줄러를 별도의 스레드에서 실행하기 위함
+import os
+from job_scheduler import JobScheduler, run_task_graph
+import metrics
+import db_indexes
 
 # 각 스케줄러 스크립트를 임포트합니다.
 # 이 스크립트들이 같은 디렉토리에 있다고 가정합니다.
@@ -13,7 +16,7 @@ import NPP_radiation
 import Busan_radiation
 import data
 import average
-import Busan_alert
+import retention
 
 # 로깅 설정 (main.py의 로그도 볼 수 있도록)
 logging.basicConfig(
@@ -25,54 +28,76 @@ logging.basicConfig(
     ]
 )
 
-def run_scheduler_in_thread(scheduler_name, scheduler_module):
-    """각 스케줄러 모듈의 run_pending()을 별도의 스레드에서 실행합니다."""
-    logging.info(f"[{scheduler_name}] 스케줄러 스레드 시작.")
-    while True:
-        scheduler_module.schedule.run_pending()
-        time.sleep(1) # 1초 대기
+# 현황표 출력 주기(초)
+STATUS_LOG_INTERVAL = 300
+
+# 수집 작업 지표 엔드포인트 포트 (http://<host>:METRICS_PORT/metrics, 0이면 비활성화)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+
+def build_startup_tasks():
+    """
+    시작 시 한 번 실행할 초기 작업과 선행 관계.
+    세 수집 작업은 서로 독립적이므로 동시에 실행하고, 가공/평균 작업은 수집이 끝난 뒤 실행합니다.
+    """
+    return {
+        "NPP_weather": (NPP_weather.scheduled_task, []),
+        "NPP_radiation": (NPP_radiation.scheduled_task, []),
+        "Busan_radiation": (Busan_radiation.scheduled_task, []),
+        "data": (data.process_radiation_data, ["NPP_weather", "NPP_radiation", "Busan_radiation"]),
+        "average": (average.automate, ["data"]),
+    }
+
+
+def build_scheduler():
+    """
+    모든 주기 작업을 하나의 스케줄러에 등록합니다.
+    각 모듈이 import 시 전역 schedule에 등록한 작업 대신 이 목록이 실행 기준입니다.
+    """
+    scheduler = JobScheduler()
+    scheduler.add_job("NPP_weather", NPP_weather.scheduled_task, interval=15 * 60, jitter=30, timeout=10 * 60)
+    scheduler.add_job("NPP_radiation", NPP_radiation.scheduled_task, interval=15 * 60, jitter=30, timeout=10 * 60)
+    scheduler.add_job("Busan_radiation", Busan_radiation.scheduled_task, interval=60 * 60, jitter=60, timeout=20 * 60)
+    scheduler.add_job("data", data.automated_process, interval=60 * 60, jitter=60, timeout=30 * 60)
+    scheduler.add_job("average", average.automate, at="08:00", timeout=30 * 60)
+    # 수집이 적은 새벽에 보관 기한 정리 (1회 처리량이 제한되어 있어 밀린 데이터는 며칠에 걸쳐 정리)
+    scheduler.add_job("retention", retention.run, at="03:30", timeout=60 * 60)
+    return scheduler
+
 
 if __name__ == "__main__":
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logging.info(f"main.py 스크립트 시작 (모든 스케줄러 통합) - 현재 시간: {current_time}")
     print(f"main.py 스크립트 시작 (모든 스케줄러 통합) - 현재 시간: {current_time}")
 
-    # 각 스크립트의 초기 실행 함수를 호출합니다.
-    # 이 함수들은 스크립트 시작 시 한 번 실행되어야 하는 로직을 포함합니다.
+    # 초기 작업부터 지표를 확인할 수 있도록 먼저 시작
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+
+    # 수집/조회에 필요한 인덱스 생성 (이미 있으면 변경 없음)
+    db_indexes.ensure_indexes()
+
+    # 각 스크립트의 초기 실행 함수를 의존 관계에 따라 병렬로 실행합니다.
     logging.info("모든 스케줄러 스크립트의 초기 작업 실행 중...")
-    NPP_weather.scheduled_task() # NPP_weather의 초기 실행 함수
-    NPP_radiation.scheduled_task() # NPP_radiation의 초기 실행 함수
-    Busan_radiation.scheduled_task() # Busan_radiation의 초기 실행 함수
-    data.automated_process() # data.py의 초기 실행 함수
-    average.automate() # average.py의 초기 실행 함수
-    Busan_alert.scheduled_alert_task() # Busan_alert의 초기 실행 함수
+    run_task_graph(build_startup_tasks())
     logging.info("모든 스케줄러 스크립트 초기 작업 완료.")
 
+    # 모듈별 전역 schedule 작업은 사용하지 않음 (중복 실행 방지)
+    schedule.clear()
 
-    # 각 스케줄러의 run_pending()을 별도의 스레드에서 실행
-    # 이렇게 하면 한 스케줄러가 블로킹되어도 다른 스케줄러가 계속 작동합니다.
-    scheduler_threads = []
-    threads_to_run = [
-        ("NPP_weather", NPP_weather),
-        ("NPP_radiation", NPP_radiation),
-        ("Busan_radiation", Busan_radiation),
-        ("data", data),
-        ("average", average),
-        ("Busan_alert", Busan_alert)
-    ]
-
-    for name, module in threads_to_run:
-        thread = threading.Thread(target=run_scheduler_in_thread, args=(name, module), daemon=True)
-        scheduler_threads.append(thread)
-        thread.start()
+    # 하나의 디스패처와 워커 풀로 모든 주기 작업을 실행
+    scheduler = build_scheduler()
+    scheduler.start()
 
-    # 메인 스레드는 모든 스케줄러 스레드가 계속 실행되도록 유지
+    # 메인 스레드는 주기적으로 작업 현황표를 출력
     try:
         while True:
-            time.sleep(60) # 메인 스레드는 1분마다 깨어나서 스레드들이 살아있는지 확인
+            time.sleep(STATUS_LOG_INTERVAL)
+            logging.info("작업 현황\n" + scheduler.format_status_table())
     except KeyboardInterrupt:
-        logging.info("스크립트 종료 요청 감지. 모든 스케줄러 스레드 종료 중...")
-        print("스크립트 종료 요청 감지. 모든 스케줄러 스레드 종료 중...")
+        logging.info("스크립트 종료 요청 감지. 스케줄러 종료 중...")
+        print("스크립트 종료 요청 감지. 스케줄러 종료 중...")
+        scheduler.stop()
     finally:
         # atexit에 등록된 함수들이 호출될 것입니다.
         logging.info("main.py 스크립트 종료.")
@@ -7,7 +7,7 @@ from folium.plugins import MarkerCluster
 from folium.features import GeoJsonTooltip, DivIcon
 import branca.colormap as cm
 import geopy.distance
-from pymongo import MongoClient
+import mongo
 from sklearn.preprocessing import MinMaxScaler, StandardScaler
 from sklearn.decomposition import PCA
 import logging
@@ -61,17 +61,11 @@ mapping_codes = {
 if not logging.root.handlers:
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-mongo_uri = os.getenv("MONGO_URI")
-if not mongo_uri:
+if not os.getenv("MONGO_URI"):
     raise ValueError("MONGO_URI environment variable not set in Railway! Check your service variables.")
 
-# URI 문자열 정제 (이 부분은 이전과 동일)
-mongo_uri = mongo_uri.strip().lstrip('=').strip()
-logging.info(f"DEBUG: Retrieved MONGO_URI (after clean): '{mongo_uri}' (Length: {len(mongo_uri)})")
-
-client = MongoClient(mongo_uri)
-db = client['Data']
-col = db['NPP_weather']
+# 공유 커넥션 풀 사용 (app.py와 같은 클라이언트)
+col = mongo.collection('NPP_weather')
 
 # ----------------------------
 # GeoDataFrame 로드 및 전처리
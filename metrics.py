@@ -0,0 +1,200 @@
+# metrics.py
+# 수집 작업(NPP_weather, NPP_radiation, Busan_radiation 등)이 공통으로 기록하는 지표 모듈입니다.
+# 카운터/히스토그램을 스레드 안전하게 누적하고 Prometheus 텍스트 형식으로 내보냅니다.
+# - app.py: /metrics 라우트 (웹 요청 지표 포함)
+# - main.py: serve()로 띄우는 단독 /metrics 엔드포인트 (METRICS_PORT)
+# 지표는 프로세스별로 누적되므로 수집 작업 지표는 main.py 엔드포인트에서 확인합니다.
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 히스토그램 기본 구간(초): 수 ms 단위의 파싱부터 수십 초의 API 요청까지
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_registry_lock = threading.Lock()
+_registry = []  # 등록 순서대로 출력
+_collectors = []  # 출력 시점에 값을 읽어오는 함수 (다른 모듈의 상태 등)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: 레이블 {self.labelnames}가 필요합니다. (받은 값: {tuple(labels)})")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    """증가만 하는 누적 값 (예: 저장 건수, 실패 횟수)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """소요 시간 등의 분포 (구간별 누적 건수, 합계, 건수)"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with 블록의 소요 시간(초)을 기록 (예외가 발생해도 기록)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_samples(self, items):
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, extra=[("le", _format_value(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state['sum'])}"
+            yield f"{self.name}_count{labels} {state['count']}"
+
+
+def register_collector(func):
+    """
+    출력 시점에 값을 읽어오는 함수를 등록합니다.
+    func()는 (이름, 타입, 설명, [({레이블}, 값), ...]) 목록을 반환해야 합니다.
+    """
+    with _registry_lock:
+        _collectors.append(func)
+    return func
+
+
+def render():
+    """등록된 모든 지표를 Prometheus 텍스트 형식으로 반환"""
+    with _registry_lock:
+        metrics = list(_registry)
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            logging.error(f"지표 수집 함수 오류: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(labels, labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"metrics: {format % args}")
+
+
+def serve(port, host="0.0.0.0"):
+    """/metrics만 제공하는 단독 HTTP 서버를 백그라운드 스레드로 실행"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics_server", daemon=True)
+    thread.start()
+    logging.info(f"지표 엔드포인트 시작: http://{host}:{port}/metrics")
+    return server
+
+
+# 수집 작업 공통 지표 (job: NPP_weather / NPP_radiation / Busan_radiation)
+HTTP_LATENCY = Histogram("ingest_http_request_seconds", "수집 API 요청 소요 시간(초)", ["job", "endpoint"])
+HTTP_ERRORS = Counter("ingest_http_errors_total", "수집 API 요청 실패 횟수", ["job", "endpoint", "error"])
+PARSE_SECONDS = Histogram("ingest_parse_seconds", "응답 XML 파싱 소요 시간(초)", ["job"])
+WRITE_SECONDS = Histogram("ingest_write_seconds", "MongoDB 쓰기 소요 시간(초)", ["job", "collection"])
+ROWS = Counter("ingest_rows_total", "저장 결과별 행 수 (inserted/updated/skipped)", ["job", "result"])
+FAILURES = Counter("ingest_failures_total", "수집 단계별 실패 횟수 (fetch/parse/write)", ["job", "stage"])
+CYCLES = Counter("ingest_cycles_total", "수집 주기 결과별 횟수 (effective/skipped)", ["job", "result"])
+
+# 스케줄러 작업 지표 (job_scheduler)
+JOB_SECONDS = Histogram("job_run_seconds", "스케줄러 작업 실행 소요 시간(초)", ["job"])
+JOB_RUNS = Counter("job_runs_total", "스케줄러 작업 실행 결과별 횟수", ["job", "status"])
+
+
+def record_rows(job, inserted=0, updated=0, skipped=0):
+    """저장 결과 건수를 한 번에 기록"""
+    for result, count in (("inserted", inserted), ("updated", updated), ("skipped", skipped)):
+        if count:
+            ROWS.inc(count, job=job, result=result)
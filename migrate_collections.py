@@ -0,0 +1,222 @@
+# migrate_collections.py
+# 로컬(원본) MongoDB의 수집 컬렉션을 원격(대상) MongoDB로 복사하는 스크립트입니다. (migrate.sh 대체)
+# - 원본 커서에서 읽은 문서를 파일로 내보내지 않고 바로 대상에 배치 단위 비순차 upsert(_id 기준 교체)
+# - 컬렉션별로 병렬 처리
+# - 배치마다 마지막 _id를 대상 DB의 ingest_state에 기록하므로 중단 후 다시 실행하면 이어서 복사
+# - 복사가 끝난 컬렉션은 진행 위치를 지우므로, 완료 후 다시 실행하면 전체를 다시 upsert합니다.
+#   (mongoimport --mode=upsert와 같이 원본에서 갱신된 문서도 반영)
+# - 컬렉션별 처리량(건/s)과 예상 남은 시간을 주기적으로 출력
+#
+# _id 순서로 이어 받으므로 _id가 ObjectId(기본값)인 컬렉션을 전제로 합니다.
+#
+# 실행 예:
+#   MIGRATE_SOURCE_URI=mongodb://localhost:27017/ MONGO_URI=<대상 URI> python migrate_collections.py
+#   python migrate_collections.py --collections NPP_weather_backup --batch-size 2000 --workers 2
+#   python migrate_collections.py --dry-run      # 컬렉션별 남은 건수만 출력
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient, ReplaceOne, ASCENDING
+
+import rollups
+
+# 수집/가공 작업이 쓰고 웹 앱이 읽는 컬렉션 (시간/일 요약은 rollups.SOURCES에서 생성)
+COLLECTIONS = [
+    "Busan_radiation",
+    "Busan_radiation_history",
+    "NPP_weather",
+    "NPP_weather_backup",
+    "nuclear_radiation",
+    "nuclear_radiation_backup",
+    "radiation_stats",
+    "daily_average_radiation",
+] + [rollups.collection_name(source, resolution) for source in rollups.SOURCES for resolution in rollups.RESOLUTIONS]
+DB_NAME = "Data"
+BATCH_SIZE = 1000
+WORKERS = 4
+PROGRESS_INTERVAL = 10  # 진행 상황 출력 간격(초)
+STATE_PREFIX = "collection_migration:"
+
+
+def clean_uri(uri):
+    """환경 변수 값 앞에 붙은 '='와 공백 제거"""
+    return (uri or "").strip().lstrip("=").strip()
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "-"
+    return str(timedelta(seconds=int(seconds)))
+
+
+class Progress:
+    """컬렉션 하나의 복사 진행 상황 (처리량/예상 남은 시간 계산)"""
+
+    def __init__(self, name, total, done):
+        self.name = name
+        self.total = total  # 원본 예상 문서 수 (estimated_document_count)
+        self.done = done  # 이전 실행을 포함한 누적 복사 건수
+        self.copied = 0  # 이번 실행에서 복사한 건수
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def add(self, count):
+        self.done += count
+        self.copied += count
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.copied / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self):
+        if not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        percent = self.done / self.total * 100 if self.total else 100.0
+        logging.info(f"[{self.name}] {self.done:,}/{self.total:,}건 ({percent:.1f}%), "
+                     f"{self.rate:,.0f}건/s, 남은 시간 {format_eta(self.eta)}")
+
+
+def migrate_collection(source_db, target_db, name, batch_size=BATCH_SIZE, stop_event=None):
+    """
+    컬렉션 하나를 _id 순서로 복사합니다.
+    배치 쓰기가 끝난 뒤에만 진행 위치를 기록하므로, 중단되면 마지막 배치부터 다시 복사합니다.
+    (_id 기준 교체이므로 같은 문서를 다시 써도 결과는 같음)
+    """
+    source = source_db[name]
+    target = target_db[name]
+    state_collection = target_db["ingest_state"]
+    state_id = STATE_PREFIX + name
+
+    state = state_collection.find_one({"_id": state_id}) or {}
+    last_id = state.get("last_id")
+    progress = Progress(name, source.estimated_document_count(), state.get("copied", 0))
+    if last_id is not None:
+        logging.info(f"[{name}] {last_id} 이후부터 이어서 복사 (누적 {progress.done:,}건)")
+
+    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+    cursor = source.find(query, no_cursor_timeout=True).sort("_id", ASCENDING).batch_size(batch_size)
+    try:
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) < batch_size:
+                continue
+            last_id = _write_batch(target, state_collection, state_id, batch, progress)
+            batch = []
+            if stop_event is not None and stop_event.is_set():
+                logging.warning(f"[{name}] 중단 요청으로 {last_id}에서 멈춤")
+                return progress
+        if batch:
+            _write_batch(target, state_collection, state_id, batch, progress)
+    finally:
+        cursor.close()
+
+    # 완료 후에는 진행 위치를 지워 다음 실행이 전체를 다시 upsert하도록 함
+    # (_id 이후만 복사하면 원본에서 제자리 갱신($set upsert 등)된 문서가 다시 복사되지 않음)
+    state_collection.update_one({"_id": state_id},
+                                {"$set": {"completed_at": datetime.now(), "copied": 0},
+                                 "$unset": {"last_id": ""}}, upsert=True)
+    progress.report(force=True)
+    logging.info(f"[{name}] 복사 완료: 이번 실행 {progress.copied:,}건")
+    return progress
+
+
+def _write_batch(target, state_collection, state_id, batch, progress):
+    target.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in batch], ordered=False)
+    last_id = batch[-1]["_id"]
+    progress.add(len(batch))
+    state_collection.update_one(
+        {"_id": state_id},
+        {"$set": {"last_id": last_id, "copied": progress.done, "updated_at": datetime.now()},
+         "$unset": {"completed_at": ""}},
+        upsert=True)
+    progress.report()
+    return last_id
+
+
+def pending_counts(source_db, target_db, names):
+    """컬렉션별 (남은 건수, 원본 전체 건수)"""
+    counts = {}
+    for name in names:
+        state = target_db["ingest_state"].find_one({"_id": STATE_PREFIX + name}) or {}
+        query = {"_id": {"$gt": state["last_id"]}} if state.get("last_id") is not None else {}
+        counts[name] = (source_db[name].count_documents(query), source_db[name].estimated_document_count())
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MongoDB 컬렉션 병렬 복사 (중단 후 이어서 실행 가능)")
+    parser.add_argument("--source-uri", default=os.getenv("MIGRATE_SOURCE_URI", "mongodb://localhost:27017/"),
+                        help="원본 MongoDB URI (기본: MIGRATE_SOURCE_URI 또는 로컬)")
+    parser.add_argument("--target-uri", default=os.getenv("MONGO_URI"),
+                        help="대상 MongoDB URI (기본: MONGO_URI)")
+    parser.add_argument("--collections", default=",".join(COLLECTIONS), help="복사할 컬렉션 (쉼표 구분)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="동시에 복사할 컬렉션 수")
+    parser.add_argument("--dry-run", action="store_true", help="복사하지 않고 남은 건수만 출력")
+    parser.add_argument("--reset", action="store_true", help="저장된 진행 위치를 지우고 처음부터 복사")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    source_uri, target_uri = clean_uri(args.source_uri), clean_uri(args.target_uri)
+    if not target_uri:
+        parser.error("대상 URI가 없습니다. --target-uri 또는 MONGO_URI를 지정하세요.")
+    if source_uri == target_uri:
+        parser.error("원본과 대상 URI가 같습니다.")
+    names = [name.strip() for name in args.collections.split(",") if name.strip()]
+
+    source_db = MongoClient(source_uri, maxPoolSize=args.workers + 1)[DB_NAME]
+    target_db = MongoClient(target_uri, maxPoolSize=args.workers + 1)[DB_NAME]
+
+    if args.dry_run:
+        for name, (remaining, total) in pending_counts(source_db, target_db, names).items():
+            print(f"{name:<28} 남은 {remaining:>12,}건 / 전체 {total:>12,}건")
+        sys.exit(0)
+    if args.reset:
+        target_db["ingest_state"].delete_many({"_id": {"$in": [STATE_PREFIX + name for name in names]}})
+
+    started = time.perf_counter()
+    stop_event = threading.Event()
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="migrate")
+    futures = {executor.submit(migrate_collection, source_db, target_db, name, args.batch_size, stop_event): name
+               for name in names}
+    results = {}
+    try:
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                failed.append(name)
+                logging.error(f"[{name}] 복사 실패 (다시 실행하면 이어서 진행): {e}")
+    except KeyboardInterrupt:
+        # 진행 중인 배치를 마치고 진행 위치를 기록한 뒤 종료
+        logging.warning("중단 요청: 진행 중인 배치를 마치는 중...")
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        sys.exit(130)
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    copied = sum(progress.copied for progress in results.values())
+    print(f"완료: {len(results)}개 컬렉션, {copied:,}건, {elapsed:.1f}s ({copied / elapsed if elapsed else 0:,.0f}건/s)")
+    if failed:
+        print(f"실패: {', '.join(failed)}")
+        sys.exit(1)
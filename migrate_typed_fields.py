@@ -0,0 +1,194 @@
+# migrate_typed_fields.py
+# 문자열로 저장된 기존 측정 데이터를 숫자/날짜 타입으로 변환하는 1회성 마이그레이션 스크립트입니다.
+# - nuclear_radiation(_backup): time "YYYY-MM-DD HH:MM" → datetime, value "0.091" → double
+# - NPP_weather(_backup): time "YYYY-MM-DD HH:MM" → datetime
+# - Busan_radiation: checkTime 문자열 → datetime, lat/lng/aveRainData 문자열 → double
+#
+# _id 순서로 배치 단위 변환하며, 배치마다 진행 위치를 ingest_state 컬렉션에 저장하므로
+# 중단 후 다시 실행하면 이어서 진행합니다. 수집 스크립트를 멈추지 않고 실행해도 됩니다.
+# 변환된 문서와 같은 키의 타입 지정 문서가 이미 있으면(배포 후 재수집된 경우) 기존 문서를 삭제합니다.
+#
+# 실행 예:
+#   python migrate_typed_fields.py                          # 전체 컬렉션
+#   python migrate_typed_fields.py --collections nuclear_radiation --batch-size 2000
+#   python migrate_typed_fields.py --dry-run                # 변환 대상 건수만 확인
+
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne, DeleteOne, ASCENDING
+
+import mongo
+from xml_stream import to_float
+
+BATCH_SIZE = 1000
+STATE_PREFIX = "typed_migration:"
+
+
+def to_datetime(text, formats):
+    """여러 형식 중 맞는 것으로 datetime 변환 (실패 시 None)"""
+    for fmt in formats:
+        try:
+            return datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def khnp_time(text):
+    return to_datetime(text, ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'))
+
+
+def busan_time(text):
+    return to_datetime(text, ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y%m%d%H%M'))
+
+
+def number(text):
+    return to_float(text.strip())
+
+
+# 컬렉션별 (중복 판단 키, {필드: 변환 함수})
+MIGRATIONS = {
+    "nuclear_radiation": (("name", "time"), {"time": khnp_time, "value": number}),
+    "nuclear_radiation_backup": (("name", "time"), {"time": khnp_time, "value": number}),
+    "NPP_weather": (("genName", "time"), {"time": khnp_time}),
+    "NPP_weather_backup": (("genName", "time"), {"time": khnp_time}),
+    "Busan_radiation": (("locNm", "checkTime"),
+                        {"checkTime": busan_time, "lat": number, "lng": number, "aveRainData": number}),
+}
+
+
+def pending_query(fields, last_id=None):
+    """아직 문자열 필드가 남아 있는 문서"""
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+    return query
+
+
+def convert(doc, converters):
+    """
+    문서의 문자열 필드를 변환한 $set 내용과 변환 실패 필드 목록을 반환합니다.
+    변환에 실패한 필드는 None으로 저장합니다. (숫자/날짜 정렬에서 제외)
+    """
+    changes, invalid = {}, []
+    for field, converter in converters.items():
+        value = doc.get(field)
+        if not isinstance(value, str):
+            continue
+        converted = converter(value) if value.strip() else None
+        if converted is None and value.strip():
+            invalid.append(field)
+        changes[field] = converted
+    return changes, invalid
+
+
+def migrate_batch(collection, docs, key_fields, converters):
+    """배치 하나를 변환. (변환, 중복 삭제, 변환 실패) 건수 반환"""
+    converted_docs = []
+    invalid_count = 0
+    for doc in docs:
+        changes, invalid = convert(doc, converters)
+        if invalid:
+            invalid_count += 1
+            logging.warning(f"{collection.name} {doc['_id']} 변환 실패 필드: {invalid}")
+        converted_docs.append((doc, changes))
+
+    # 같은 키의 다른 문서(_id가 다른 문서)가 이미 있는지 한 번의 조회로 확인
+    # 키 필드는 이미 타입이 지정되어 있고 다른 필드만 문자열인 문서는 자기 자신이 조회되므로 _id로 구분
+    keys = [tuple({**doc, **changes}.get(field) for field in key_fields) for doc, changes in converted_docs]
+    existing = {}  # 키 -> 해당 키를 가진 _id 집합
+    if keys:
+        candidates = collection.find(
+            {field: {"$in": list({key[index] for key in keys})} for index, field in enumerate(key_fields)},
+            {"_id": 1, **{field: 1 for field in key_fields}})
+        for candidate in candidates:
+            existing.setdefault(tuple(candidate.get(field) for field in key_fields), set()).add(candidate["_id"])
+
+    batch_ids = {doc["_id"] for doc, _ in converted_docs}
+    operations = []
+    duplicates = 0
+    kept = set()  # 이번 배치에서 변환하여 남긴 키 (같은 키로 변환되는 문서가 배치 안에 여럿이면 첫 문서만 남김)
+    for (doc, changes), key in zip(converted_docs, keys):
+        has_twin = bool(existing.get(key, set()) - batch_ids)  # 배치 밖의 같은 키 문서
+        if None not in key and (has_twin or key in kept):
+            operations.append(DeleteOne({"_id": doc["_id"]}))
+            duplicates += 1
+        else:
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+            kept.add(key)
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(operations) - duplicates, duplicates, invalid_count
+
+
+def migrate_collection(db, name, batch_size=BATCH_SIZE, dry_run=False):
+    key_fields, converters = MIGRATIONS[name]
+    collection = db[name]
+    state_collection = db["ingest_state"]
+    state_id = STATE_PREFIX + name
+
+    if dry_run:
+        remaining = collection.count_documents(pending_query(converters))
+        logging.info(f"[{name}] 변환 대상 {remaining}건")
+        return remaining
+
+    state = state_collection.find_one({"_id": state_id}) or {}
+    last_id = state.get("last_id")
+    totals = {"converted": state.get("converted", 0), "duplicates": state.get("duplicates", 0),
+              "invalid": state.get("invalid", 0)}
+    if last_id is not None:
+        logging.info(f"[{name}] {last_id} 이후부터 이어서 진행")
+
+    started = time.perf_counter()
+    processed = 0
+    while True:
+        docs = list(collection.find(pending_query(converters, last_id))
+                    .sort("_id", ASCENDING).limit(batch_size))
+        if not docs:
+            break
+        converted, duplicates, invalid = migrate_batch(collection, docs, key_fields, converters)
+        last_id = docs[-1]["_id"]
+        totals["converted"] += converted
+        totals["duplicates"] += duplicates
+        totals["invalid"] += invalid
+        processed += len(docs)
+        state_collection.update_one({"_id": state_id}, {"$set": {"last_id": last_id, **totals,
+                                                                 "updated_at": datetime.now()}}, upsert=True)
+        elapsed = time.perf_counter() - started
+        logging.info(f"[{name}] {processed}건 처리 ({processed / elapsed:,.0f}건/s), "
+                     f"누적 변환 {totals['converted']} / 중복 삭제 {totals['duplicates']} / 변환 실패 {totals['invalid']}")
+
+    # 진행 위치 이전에 새로 생긴 문자열 문서가 없는지 확인 후 완료 처리
+    remaining = collection.count_documents(pending_query(converters))
+    if remaining:
+        logging.warning(f"[{name}] 진행 위치 이전에 남은 문자열 문서 {remaining}건 (다시 실행하면 처음부터 확인)")
+        state_collection.update_one({"_id": state_id}, {"$unset": {"last_id": ""}})
+    else:
+        state_collection.update_one({"_id": state_id}, {"$set": {"completed_at": datetime.now()}})
+        logging.info(f"[{name}] 마이그레이션 완료: {totals}")
+    return remaining
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="문자열 측정값/시각을 숫자/날짜 타입으로 변환")
+    parser.add_argument("--collections", default=",".join(MIGRATIONS),
+                        help=f"대상 컬렉션 (쉼표 구분, 기본: 전체)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="변환하지 않고 대상 건수만 출력")
+    parser.add_argument("--reset", action="store_true", help="저장된 진행 위치를 지우고 처음부터 진행")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    names = [name.strip() for name in args.collections.split(",") if name.strip()]
+    unknown = [name for name in names if name not in MIGRATIONS]
+    if unknown:
+        parser.error(f"알 수 없는 컬렉션: {unknown}")
+
+    db = mongo.get_db()
+    for name in names:
+        if args.reset:
+            db["ingest_state"].delete_one({"_id": STATE_PREFIX + name})
+        migrate_collection(db, name, batch_size=args.batch_size, dry_run=args.dry_run)
@@ -0,0 +1,244 @@
+# mock_api_server.py
+# KHNP(data.khnp.co.kr) / 공공데이터포털(apis.data.go.kr) API를 대신하는 로컬 테스트 서버입니다.
+# data/mock_payloads/의 녹화된 XML 응답을 재생하며, 지연 시간/오류율/측정소 수를 조절할 수 있습니다.
+#
+# 제공 엔드포인트:
+#   /environ/service/realtime/weather?genName=KR
+#   /environ/service/realtime/air?genName=KR
+#   /environ/service/realtime/radiorate?genName=KR
+#   /6260000/EnvironmentalRadiationInfoService/getEnvironmentalRadiationInfo?pageNo=1&numOfRows=100
+#
+# 수집 스크립트를 이 서버로 연결하려면:
+#   KHNP_BASE_URL=http://127.0.0.1:8085/environ/service/realtime
+#   BUSAN_BASE_URL=http://127.0.0.1:8085/6260000/EnvironmentalRadiationInfoService
+#
+# 실행 예: python mock_api_server.py --port 8085 --latency 0.2 --jitter 0.1 --error-rate 0.05 --stations 40
+
+import argparse
+import copy
+import logging
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from xml_stream import KHNP_TIME_FORMAT, BUSAN_TIME_FORMAT
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mock_payloads")
+KHNP_PREFIX = "/environ/service/realtime/"
+BUSAN_PATH = "/6260000/EnvironmentalRadiationInfoService/getEnvironmentalRadiationInfo"
+PLANTS = ["KR", "WS", "YK", "UJ", "SU"]
+
+# 응답마다 측정 시각을 진행시키는 간격 (실제 API 갱신 주기와 동일)
+KHNP_STEP = timedelta(minutes=10)
+BUSAN_STEP = timedelta(minutes=60)
+
+
+class MockSettings:
+    """서버 동작 설정 (요청 처리 중에도 읽기 전용)"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 stations=None, busan_stations=None, static=False, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stations = stations  # 발전소별 방사선 측정소 수 (None이면 녹화된 그대로)
+        self.busan_stations = busan_stations  # 부산 측정소 수 (None이면 녹화된 그대로)
+        self.static = static  # True이면 항상 같은 응답 (변경 없음 경로 측정용)
+        self.random = random.Random(seed)
+
+
+def load_items(name):
+    """녹화된 응답에서 item 목록을 {태그: 텍스트} 딕셔너리로 읽음"""
+    root = ET.parse(os.path.join(PAYLOAD_DIR, f"{name}.xml")).getroot()
+    return [{child.tag: child.text or "" for child in item} for item in root.iter("item")]
+
+
+def resize(items, count, key_fields):
+    """
+    녹화된 측정소 목록을 count개로 늘리거나 줄입니다.
+    늘릴 때는 key_fields 값 뒤에 번호를 붙여 서로 다른 측정소로 만듭니다.
+    """
+    if count is None or not items:
+        return items
+    resized = []
+    for index in range(count):
+        item = dict(items[index % len(items)])
+        copy_no = index // len(items)
+        if copy_no:
+            for field in key_fields:
+                item[field] = f"{item[field]}-{copy_no}"
+        resized.append(item)
+    return resized
+
+
+def build_document(items, body_fields=None):
+    """공공 API 형식의 XML 응답 본문 생성"""
+    response = ET.Element("response")
+    header = ET.SubElement(response, "header")
+    ET.SubElement(header, "resultCode").text = "00"
+    ET.SubElement(header, "resultMsg").text = "NORMAL SERVICE."
+    body = ET.SubElement(response, "body")
+    items_elem = ET.SubElement(body, "items")
+    for item in items:
+        item_elem = ET.SubElement(items_elem, "item")
+        for tag, text in item.items():
+            ET.SubElement(item_elem, tag).text = text
+    for tag, text in (body_fields or {}).items():
+        ET.SubElement(body, tag).text = str(text)
+    return ET.tostring(response, encoding="utf-8", xml_declaration=True)
+
+
+class PayloadStore:
+    """엔드포인트별 녹화 응답과 재생 시각(요청마다 진행)을 관리"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._ticks = {}  # 재생 키 -> 응답 횟수
+        self._busan_offset = timedelta(0)
+        self.khnp = {}
+        for genName in PLANTS:
+            self.khnp[("weather", genName)] = load_items(f"weather_{genName}")
+            self.khnp[("air", genName)] = load_items(f"air_{genName}")
+            self.khnp[("radiorate", genName)] = resize(load_items(f"radiorate_{genName}"),
+                                                       settings.stations, ("name", "expl"))
+        self.busan = resize(load_items("getEnvironmentalRadiationInfo"), settings.busan_stations, ("locNm",))
+
+    def _shift(self, key, step):
+        """static이 아니면 요청마다 측정 시각을 한 주기씩 진행"""
+        if self.settings.static:
+            return timedelta(0)
+        with self._lock:
+            tick = self._ticks.get(key, 0)
+            self._ticks[key] = tick + 1
+        return step * tick
+
+    @staticmethod
+    def _shift_time(items, field, fmt, offset):
+        if not offset:
+            return items
+        shifted = copy.deepcopy(items)
+        for item in shifted:
+            if item.get(field):
+                item[field] = (datetime.strptime(item[field], fmt) + offset).strftime(fmt)
+        return shifted
+
+    def khnp_document(self, kind, genName):
+        items = self.khnp.get((kind, genName))
+        if items is None:
+            return None
+        items = self._shift_time(items, "time", KHNP_TIME_FORMAT, self._shift((kind, genName), KHNP_STEP))
+        return build_document(items, {"numOfRows": len(items), "pageNo": 1, "totalCount": len(items)})
+
+    def busan_document(self, page_no, num_of_rows):
+        # 여러 페이지가 같은 시각의 데이터를 받도록 첫 페이지 요청에서만 시각을 진행
+        if page_no == 1:
+            self._busan_offset = self._shift("busan", BUSAN_STEP)
+        offset = self._busan_offset
+        start = (page_no - 1) * num_of_rows
+        items = self._shift_time(self.busan[start:start + num_of_rows], "checkTime", BUSAN_TIME_FORMAT, offset)
+        return build_document(items, {"numOfRows": num_of_rows, "pageNo": page_no, "totalCount": len(self.busan)})
+
+
+def make_handler(store, settings):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive (수집 스크립트의 커넥션 풀 재사용)
+
+        def do_GET(self):
+            delay = settings.latency + settings.random.uniform(0, settings.jitter)
+            if delay:
+                time.sleep(delay)
+            if settings.error_rate and settings.random.random() < settings.error_rate:
+                self._send(settings.error_status, b"Service Unavailable")
+                return
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            body = None
+            if url.path.startswith(KHNP_PREFIX):
+                kind = url.path[len(KHNP_PREFIX):]
+                body = store.khnp_document(kind, query.get("genName", [""])[0])
+            elif url.path == BUSAN_PATH:
+                try:
+                    page_no = int(query.get("pageNo", ["1"])[0])
+                    num_of_rows = int(query.get("numOfRows", ["10"])[0])
+                except ValueError:
+                    self._send(400, b"Bad Request")
+                    return
+                body = store.busan_document(page_no, num_of_rows)
+            if body is None:
+                self._send(404, b"Not Found")
+                return
+            self._send(200, body, "application/xml; charset=utf-8")
+
+        def _send(self, status, body, content_type="text/plain; charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(f"mock_api: {format % args}")
+
+    return MockHandler
+
+
+def start_server(settings, host="127.0.0.1", port=0):
+    """서버를 백그라운드 스레드로 시작하고 (서버, 기본 주소)를 반환 (port=0이면 빈 포트 사용)"""
+    store = PayloadStore(settings)
+    server = ThreadingHTTPServer((host, port), make_handler(store, settings))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock_api_server", daemon=True)
+    thread.start()
+    base = f"http://{host}:{server.server_address[1]}"
+    return server, base
+
+
+def base_urls(base):
+    """수집 스크립트용 환경 변수 값"""
+    return {
+        "KHNP_BASE_URL": base + KHNP_PREFIX.rstrip("/"),
+        "BUSAN_BASE_URL": base + BUSAN_PATH.rsplit("/", 1)[0]
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="응답 기본 지연 시간(초)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="기본 지연에 더하는 무작위 지연 최대값(초)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="오류 응답 비율 (0~1)")
+    parser.add_argument("--error-status", type=int, default=503, help="오류 응답 HTTP 상태 코드")
+    parser.add_argument("--stations", type=int, default=None, help="발전소별 방사선 측정소 수")
+    parser.add_argument("--busan-stations", type=int, default=None, help="부산 측정소 수")
+    parser.add_argument("--static", action="store_true", help="측정 시각을 진행하지 않고 같은 응답을 재생")
+    parser.add_argument("--seed", type=int, default=None, help="지연/오류 난수 시드")
+
+
+def settings_from_args(args):
+    return MockSettings(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status, stations=args.stations,
+                        busan_stations=args.busan_stations, static=args.static, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KHNP / data.go.kr 로컬 대체 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    server, base = start_server(settings_from_args(args), host=args.host, port=args.port)
+    for name, value in base_urls(base).items():
+        print(f"{name}={value}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,215 @@
+# mongo.py
+# 모든 수집 스크립트와 웹 앱이 공유하는 MongoDB 연결 모듈입니다.
+# - 프로세스당 MongoClient(커넥션 풀) 하나를 처음 사용할 때 생성합니다. (import 시점에는 연결하지 않음)
+# - fork된 자식 프로세스(gunicorn 워커 등)는 부모의 소켓을 쓰지 않고 자신의 클라이언트를 새로 만듭니다.
+# - 풀 크기/타임아웃은 환경 변수로 조정하며, 풀 사용 현황을 metrics(/metrics)로 내보냅니다.
+#
+# 사용 예:
+#   import mongo
+#   db = mongo.get_db()                            # Data 데이터베이스
+#   collection = mongo.collection("NPP_weather")   # 모듈 전역 변수로 두어도 되는 지연 컬렉션
+#
+# 환경 변수: MONGO_URI (없으면 로컬), MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+#           MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+#           MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_MAX_IDLE_TIME_MS
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
+
+import metrics
+
+DEFAULT_URI = "mongodb://localhost:27017/"
+DEFAULT_DB = "Data"
+
+# 수집 작업(스레드 풀)과 웹 요청이 한 풀을 같이 쓰므로 기본값보다 여유 있게 설정
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+}
+
+CHECKOUT_WAIT = metrics.Histogram("mongo_pool_checkout_wait_seconds", "커넥션 풀에서 연결을 얻기까지 대기한 시간(초)",
+                                  buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+
+
+def get_uri():
+    """MONGO_URI 환경 변수 (앞에 붙은 '='와 공백 제거, 없으면 로컬)"""
+    return os.getenv("MONGO_URI", "").strip().lstrip("=").strip() or DEFAULT_URI
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """커넥션 풀 이벤트를 세어 현재 사용 중/열린 연결 수 등을 보관"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()  # 스레드별 대기 시작 시각
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.in_use = 0
+            self.created = 0
+            self.closed = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.clears = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {"open": self.open, "in_use": self.in_use, "created": self.created, "closed": self.closed,
+                    "checkouts": self.checkouts, "checkout_failures": self.checkout_failures,
+                    "clears": self.clears, "max_pool_size": POOL_OPTIONS["maxPoolSize"]}
+
+    def _add(self, **changes):
+        with self._lock:
+            for name, amount in changes.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def _observe_wait(self):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait()
+        self._add(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._observe_wait()
+        self._add(in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+
+pool_stats = PoolStats()
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """현재 프로세스의 공유 MongoClient (처음 호출 시 생성)"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # connect=False: 첫 요청 시점에 연결하므로 import만으로는 네트워크를 사용하지 않음
+            _client = MongoClient(get_uri(), connect=False, event_listeners=[pool_stats], **POOL_OPTIONS)
+            _client_pid = pid
+            logging.info(f"MongoDB 클라이언트 생성 (pid {pid}, 최대 풀 크기 {POOL_OPTIONS['maxPoolSize']})")
+    return _client
+
+
+def get_db(name=DEFAULT_DB):
+    """공유 클라이언트의 데이터베이스"""
+    return get_client()[name]
+
+
+class _LazyDatabase:
+    """사용할 때마다 현재 프로세스의 클라이언트에서 데이터베이스를 찾는 핸들"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getitem__(self, collection_name):
+        return get_client()[self._name][collection_name]
+
+    def __getattr__(self, attribute):
+        return getattr(get_client()[self._name], attribute)
+
+
+class _LazyCollection:
+    """사용할 때마다 현재 프로세스의 클라이언트에서 컬렉션을 찾는 핸들 (모듈 전역 변수용)"""
+
+    def __init__(self, name, db_name):
+        self._name = name
+        self._db_name = db_name
+
+    def __getattr__(self, attribute):
+        return getattr(get_client()[self._db_name][self._name], attribute)
+
+
+def database(name=DEFAULT_DB):
+    """fork 후에도 안전하게 모듈 전역에 둘 수 있는 데이터베이스 핸들"""
+    return _LazyDatabase(name)
+
+
+def collection(name, db_name=DEFAULT_DB):
+    """fork 후에도 안전하게 모듈 전역에 둘 수 있는 컬렉션 핸들"""
+    return _LazyCollection(name, db_name)
+
+
+def close():
+    """현재 프로세스의 클라이언트를 닫음 (다음 사용 시 다시 생성)"""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+            logging.info("MongoDB 연결 종료")
+        _client, _client_pid = None, None
+
+
+def _after_fork_in_child():
+    # 부모의 소켓은 닫지 않고 버림 (닫으면 부모 연결에 영향), 다음 사용 시 새로 생성
+    global _client, _client_pid, _lock
+    _client, _client_pid = None, None
+    _lock = threading.Lock()
+    pool_stats.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(close)
+
+
+@metrics.register_collector
+def _collect_metrics():
+    stats = pool_stats.snapshot()
+    return [
+        ("mongo_pool_connections", "gauge", "열린 MongoDB 연결 수", [({}, stats["open"])]),
+        ("mongo_pool_connections_in_use", "gauge", "사용 중인 MongoDB 연결 수", [({}, stats["in_use"])]),
+        ("mongo_pool_max_size", "gauge", "커넥션 풀 최대 크기", [({}, stats["max_pool_size"])]),
+        ("mongo_pool_checkouts_total", "counter", "커넥션 풀 연결 획득 횟수", [({}, stats["checkouts"])]),
+        ("mongo_pool_checkout_failures_total", "counter", "커넥션 풀 연결 획득 실패 횟수 (대기 시간 초과 등)",
+         [({}, stats["checkout_failures"])]),
+        ("mongo_pool_connections_created_total", "counter", "생성된 MongoDB 연결 수", [({}, stats["created"])]),
+        ("mongo_pool_clears_total", "counter", "커넥션 풀 초기화 횟수 (서버 오류 등)", [({}, stats["clears"])]),
+    ]
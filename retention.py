@@ -0,0 +1,188 @@
+# retention.py
+# 원본/백업 컬렉션의 보관 기한을 선언하고, 기한이 지난 데이터를 요약(rollups) 후 삭제하는 작업입니다.
+# 기본 정책: 원본 30일 → 시간 요약 1년 → 일 요약 영구 보관
+#
+# - 원본 컬렉션: 기한이 지난 날짜의 시간/일 요약을 원본에서 다시 계산(rollups.rebuild)한 뒤 원본 행을 삭제
+# - 요약/통계 컬렉션: 기한이 지난 문서를 삭제
+# - 부산 일자별 백업 컬렉션(Busan_radiation_backup*): Busan_radiation 원본의 일자별 사본이므로
+#   마지막 측정 시각이 기한을 지나면 컬렉션을 삭제
+#
+# 한 번 실행할 때 규칙마다 최대 MAX_BATCHES x BATCH_SIZE건, 원본 규칙은 최대 MAX_DAYS_PER_RUN일만 처리하므로
+# 쌓인 데이터가 많아도 작업 시간이 제한됩니다. (남은 데이터는 다음 실행에서 이어서 처리)
+#
+# 실행 예:
+#   python retention.py --dry-run    # 삭제 대상 문서 수와 예상 회수 용량만 출력
+#   python retention.py              # 1회 실행 (main.py에서는 매일 예약 실행)
+
+import argparse
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING
+
+import mongo
+import rollups
+
+BATCH_SIZE = 1000
+MAX_BATCHES = 50  # 규칙당 1회 실행에서 삭제할 최대 배치 수
+MAX_DAYS_PER_RUN = 7  # 원본 규칙당 1회 실행에서 요약 후 삭제할 최대 일수
+BATCH_PAUSE = 0.05  # 배치 사이 대기(초), 수집/조회 부하 완화
+
+RAW_DAYS = 30
+HOURLY_DAYS = 365
+
+# 보관 규칙
+# - collection: 대상 컬렉션, time: 기준 시각 필드, keep_days: 보관 일수
+# - rollup: 삭제 전에 요약을 다시 계산할 rollups.SOURCES 이름 (원본 컬렉션만)
+RULES = [
+    {"collection": "nuclear_radiation_backup", "time": "time", "keep_days": RAW_DAYS, "rollup": "nuclear_radiation"},
+    {"collection": "NPP_weather_backup", "time": "time", "keep_days": RAW_DAYS, "rollup": "NPP_weather"},
+    {"collection": "Busan_radiation", "time": "checkTime", "keep_days": RAW_DAYS, "rollup": "Busan_radiation"},
+    {"collection": "Busan_radiation_history", "time": "day", "keep_days": RAW_DAYS},
+    {"collection": "radiation_stats", "time": "tm", "keep_days": HOURLY_DAYS},
+] + [
+    # 시간 요약은 1년, 일 요약은 규칙 없음 (영구 보관)
+    {"collection": rollups.collection_name(source, "hour"), "time": "bucket", "keep_days": HOURLY_DAYS}
+    for source in rollups.SOURCES
+]
+
+# 일자별 백업 컬렉션 이름 패턴과 보관 일수
+LEGACY_PATTERN = re.compile(r"^Busan_radiation_backup")
+LEGACY_TIME_FIELD = "checkTime"
+LEGACY_KEEP_DAYS = RAW_DAYS
+
+
+def cutoff_day(keep_days, now=None):
+    """보관 기한 경계 (이 시각 이전 데이터가 삭제 대상, 날짜 단위로 내림)"""
+    now = now or datetime.now()
+    return (now - timedelta(days=keep_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def collection_size(db, name):
+    """(문서 수, 평균 문서 크기, 저장 크기) - collStats 실패 시 0"""
+    try:
+        stats = db.command("collStats", name)
+    except Exception as e:
+        logging.warning(f"{name} collStats 조회 실패: {e}")
+        return 0, 0, 0
+    return stats.get("count", 0), stats.get("avgObjSize", 0), stats.get("storageSize", 0)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:,.1f}{unit}"
+        size /= 1024
+    return f"{size:,.1f}TB"
+
+
+def delete_before(collection, time_field, cutoff, max_batches=MAX_BATCHES):
+    """cutoff 이전 문서를 _id 배치 단위로 삭제하고 삭제 건수를 반환 (max_batches=None이면 모두 삭제)"""
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        ids = [doc["_id"] for doc in collection.find({time_field: {"$lt": cutoff}}, {"_id": 1}).limit(BATCH_SIZE)]
+        if not ids:
+            break
+        deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+        if len(ids) < BATCH_SIZE:
+            break
+        time.sleep(BATCH_PAUSE)
+    return deleted
+
+
+def apply_rule(db, rule, now=None, dry_run=False):
+    """규칙 하나를 적용하고 결과(대상/삭제 건수, 예상 회수 용량)를 반환"""
+    collection = db[rule["collection"]]
+    time_field = rule["time"]
+    cutoff = cutoff_day(rule["keep_days"], now)
+    expired = collection.count_documents({time_field: {"$lt": cutoff}})
+    _, avg_size, _ = collection_size(db, rule["collection"])
+    result = {"collection": rule["collection"], "cutoff": cutoff, "expired": expired,
+              "bytes": expired * avg_size, "deleted": 0}
+    if dry_run or not expired:
+        return result
+
+    if not rule.get("rollup"):
+        result["deleted"] = delete_before(collection, time_field, cutoff)
+        return result
+
+    # 오래된 날짜부터 최대 MAX_DAYS_PER_RUN일씩 요약을 다시 계산한 뒤 그 기간을 모두 삭제
+    # (일부만 삭제하고 멈추면 다음 재계산에서 삭제된 행이 요약에서 빠지므로 일 단위로 끝까지 삭제)
+    oldest = collection.find_one({time_field: {"$lt": cutoff}}, {time_field: 1}, sort=[(time_field, ASCENDING)])
+    oldest_day = rollups.bucket_start(oldest[time_field], "day")
+    delete_until = min(cutoff, oldest_day + timedelta(days=MAX_DAYS_PER_RUN))
+    rollups.rebuild(db, rule["rollup"], start=oldest_day, end=delete_until)
+    result["deleted"] = delete_before(collection, time_field, delete_until, max_batches=None)
+    return result
+
+
+def legacy_collections(db, now=None):
+    """기한이 지난 일자별 백업 컬렉션 [(이름, 마지막 측정 시각)]"""
+    cutoff = cutoff_day(LEGACY_KEEP_DAYS, now)
+    expired = []
+    for name in sorted(db.list_collection_names()):
+        if not LEGACY_PATTERN.match(name):
+            continue
+        latest = db[name].find_one({}, {LEGACY_TIME_FIELD: 1}, sort=[(LEGACY_TIME_FIELD, DESCENDING)])
+        latest_time = latest.get(LEGACY_TIME_FIELD) if latest else None
+        if isinstance(latest_time, str):
+            try:
+                latest_time = datetime.strptime(latest_time, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue  # 시각을 알 수 없으면 삭제하지 않음
+        if latest is None or (latest_time is not None and latest_time < cutoff):
+            expired.append((name, latest_time))
+    return expired
+
+
+def run(dry_run=False, now=None):
+    """모든 보관 규칙을 적용하고 결과 목록을 반환 (main.py 예약 작업)"""
+    db = mongo.get_db()
+    results = []
+    for rule in RULES:
+        try:
+            result = apply_rule(db, rule, now=now, dry_run=dry_run)
+        except Exception as e:
+            logging.error(f"보관 규칙 적용 실패 ({rule['collection']}): {e}")
+            continue
+        results.append(result)
+        if result["expired"]:
+            action = "삭제 예정" if dry_run else f"{result['deleted']:,}건 삭제"
+            logging.info(f"[보관] {result['collection']}: {result['cutoff']:%Y-%m-%d} 이전 {result['expired']:,}건 "
+                         f"(약 {format_bytes(result['bytes'])}) {action}")
+
+    for name, latest_time in legacy_collections(db, now):
+        count, _, storage_size = collection_size(db, name)
+        results.append({"collection": name, "cutoff": cutoff_day(LEGACY_KEEP_DAYS, now), "expired": count,
+                        "bytes": storage_size, "deleted": 0 if dry_run else count})
+        if not dry_run:
+            db.drop_collection(name)
+        logging.info(f"[보관] {name} (마지막 측정 {latest_time}): {count:,}건, {format_bytes(storage_size)} "
+                     f"{'삭제 예정' if dry_run else '컬렉션 삭제'}")
+    return results
+
+
+def format_report(results, dry_run):
+    lines = [f"{'컬렉션':<32}{'기준일':>12}{'대상':>12}{'예상 회수':>12}{'삭제':>12}"]
+    for result in results:
+        deleted = "-" if dry_run else f"{result['deleted']:,}"
+        lines.append(f"{result['collection']:<32}{result['cutoff'].strftime('%Y-%m-%d'):>12}"
+                     f"{result['expired']:>12,}{format_bytes(result['bytes']):>12}{deleted:>12}")
+    total_bytes = sum(result["bytes"] for result in results)
+    total_docs = sum(result["expired"] for result in results)
+    lines.append(f"합계: 대상 {total_docs:,}건, 예상 회수 {format_bytes(total_bytes)}"
+                 + (" (dry-run, 변경 없음)" if dry_run else ""))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="보관 기한이 지난 데이터 요약 후 삭제")
+    parser.add_argument("--dry-run", action="store_true", help="삭제하지 않고 대상 건수와 예상 회수 용량만 출력")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    print(format_report(run(dry_run=args.dry_run), args.dry_run))
@@ -0,0 +1,219 @@
+# rollups.py
+# 측정소별 시간/일 단위 요약(rollup) 문서를 수집 시점에 증분 갱신합니다.
+# 기간 차트(/api/nuclear_radiation/backup, /api/busan_radiation/history, /api/data/<genName>/filtered)는
+# resolution=hour|day로 요청하면 원본 행 대신 이 요약 문서를 조회합니다.
+#
+# 요약 문서 구조 (컬렉션: <원본>_hourly / <원본>_daily)
+#   {<측정소 키>, bucket: 구간 시작 시각, count: 행 수, updated_at,
+#    stats: {<필드>: {count, sum, min, max, last: {time, value}}}}
+# 평균은 조회 시 sum / count로 계산합니다.
+# $inc/$min/$max upsert로만 갱신하므로 같은 행을 두 번 반영하면 count/sum이 중복됩니다.
+# 따라서 수집 스크립트는 새로 저장된(upsert된) 행만 apply()에 넘깁니다.
+#
+# 기존 데이터 반영 (요약 컬렉션을 원본 보관 컬렉션에서 다시 계산):
+#   python rollups.py rebuild --source nuclear_radiation --start 2025-01-01
+
+import argparse
+import logging
+from datetime import datetime, timedelta
+from numbers import Number
+
+from dateutil import parser as date_parser
+from pymongo import UpdateOne, ASCENDING
+
+import mongo
+
+# 원본 컬렉션별 설정
+# - keys: 측정소를 구분하는 필드
+# - time: 측정 시각 필드 (조회 결과에서도 같은 이름으로 반환)
+# - fields: 요약할 숫자 필드 -> 조회 결과 필드 이름
+# - archive: 재계산(rebuild) 시 읽을 전체 이력 컬렉션
+SOURCES = {
+    "nuclear_radiation": {
+        "keys": ("genName", "expl"),
+        "time": "time",
+        "fields": {"value": "value"},
+        "archive": "nuclear_radiation_backup",
+    },
+    "Busan_radiation": {
+        "keys": ("locNm",),
+        "time": "checkTime",
+        "fields": {"dose_nSv_h": "data", "aveRainData": "aveRainData"},
+        "archive": "Busan_radiation",
+    },
+    "NPP_weather": {
+        "keys": ("genName",),
+        "time": "time",
+        "fields": {"temperature": "temperature", "humidity": "humidity",
+                   "rainfall": "rainfall", "windspeed": "windspeed"},
+        "archive": "NPP_weather_backup",
+    },
+}
+
+RESOLUTIONS = {"hour": "hourly", "day": "daily"}
+
+
+def collection_name(source, resolution):
+    """요약 컬렉션 이름 (예: nuclear_radiation_hourly)"""
+    return f"{source}_{RESOLUTIONS[resolution]}"
+
+
+def bucket_start(moment, resolution):
+    """측정 시각이 속한 구간의 시작 시각"""
+    if resolution == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _summarize(records, source, resolution):
+    """행 목록을 (측정소 키, 구간)별로 미리 합산하여 구간당 업데이트 하나로 만듦"""
+    config = SOURCES[source]
+    buckets = {}
+    for record in records:
+        moment = record.get(config["time"])
+        if not isinstance(moment, datetime):
+            continue  # 문자열 시각(마이그레이션 전 데이터)은 제외
+        key = tuple(record.get(field) for field in config["keys"]) + (bucket_start(moment, resolution),)
+        bucket = buckets.setdefault(key, {"count": 0, "stats": {}})
+        bucket["count"] += 1
+        for field in config["fields"]:
+            value = record.get(field)
+            if not isinstance(value, Number) or isinstance(value, bool):
+                continue
+            stats = bucket["stats"].get(field)
+            if stats is None:
+                bucket["stats"][field] = {"count": 1, "sum": value, "min": value, "max": value,
+                                          "last": {"time": moment, "value": value}}
+                continue
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+            if moment >= stats["last"]["time"]:
+                stats["last"] = {"time": moment, "value": value}
+    return buckets
+
+
+def _bucket_update(source, key, bucket, now):
+    config = SOURCES[source]
+    query = dict(zip(config["keys"], key[:-1]))
+    query["bucket"] = key[-1]
+    update = {"$inc": {"count": bucket["count"]}, "$min": {}, "$max": {}, "$set": {"updated_at": now}}
+    for field, stats in bucket["stats"].items():
+        prefix = f"stats.{field}"
+        update["$inc"][f"{prefix}.count"] = stats["count"]
+        update["$inc"][f"{prefix}.sum"] = stats["sum"]
+        update["$min"][f"{prefix}.min"] = stats["min"]
+        update["$max"][f"{prefix}.max"] = stats["max"]
+        # 내장 문서는 필드 순서대로 비교되므로 time이 가장 늦은 값이 남음
+        update["$max"][f"{prefix}.last"] = stats["last"]
+    return UpdateOne(query, {op: fields for op, fields in update.items() if fields}, upsert=True)
+
+
+def apply(db, source, records):
+    """
+    새로 저장된 행을 시간/일 요약에 반영하고 갱신한 요약 문서 수를 반환합니다.
+    이미 반영된 행을 다시 넘기면 count/sum이 중복되므로 신규 행만 넘겨야 합니다.
+    """
+    records = list(records)
+    if not records:
+        return 0
+    now = datetime.now()
+    updated = 0
+    for resolution in RESOLUTIONS:
+        buckets = _summarize(records, source, resolution)
+        operations = [_bucket_update(source, key, bucket, now) for key, bucket in buckets.items()]
+        if operations:
+            db[collection_name(source, resolution)].bulk_write(operations, ordered=False)
+            updated += len(operations)
+    return updated
+
+
+def query(db, source, resolution, match, start=None, end=None):
+    """
+    요약 문서를 시간순으로 조회하여 원본 행과 같은 필드 이름으로 반환합니다.
+    필드 값은 구간 평균이며 <필드>_min / <필드>_max / <필드>_last와 행 수(count)를 함께 반환합니다.
+    start 이상, end 미만 구간만 조회합니다.
+    """
+    config = SOURCES[source]
+    conditions = dict(match)
+    if start is not None or end is not None:
+        conditions["bucket"] = {}
+        if start is not None:
+            conditions["bucket"]["$gte"] = bucket_start(start, resolution)
+        if end is not None:
+            conditions["bucket"]["$lt"] = end
+    rows = []
+    for doc in db[collection_name(source, resolution)].find(conditions, {"_id": 0}).sort("bucket", ASCENDING):
+        row = {field: doc.get(field) for field in config["keys"]}
+        row[config["time"]] = doc["bucket"]
+        row["count"] = doc.get("count", 0)
+        for field, name in config["fields"].items():
+            stats = doc.get("stats", {}).get(field)
+            if not stats or not stats.get("count"):
+                row[name] = None
+                continue
+            row[name] = round(stats["sum"] / stats["count"], 6)
+            row[f"{name}_min"] = stats.get("min")
+            row[f"{name}_max"] = stats.get("max")
+            row[f"{name}_last"] = stats.get("last", {}).get("value")
+        rows.append(row)
+    return rows
+
+
+def rebuild(db, source, start=None, end=None, batch_size=5000):
+    """
+    기간 내 요약 문서를 지우고 전체 이력 컬렉션에서 다시 계산합니다.
+    재계산 중에도 수집은 계속 요약을 갱신하므로, 수집이 멈춘 시간대나 과거 기간에 실행합니다.
+    보관 기한(retention.py)이 지나 원본이 삭제된 기간은 요약만 남아 있으므로 재계산하지 않습니다.
+    """
+    config = SOURCES[source]
+    time_field = config["time"]
+    oldest = db[config["archive"]].find_one({time_field: {"$type": "date"}}, {time_field: 1},
+                                            sort=[(time_field, ASCENDING)])
+    if oldest is None:
+        logging.info(f"[{source}] 원본 데이터가 없어 재계산하지 않음")
+        return 0
+    oldest_day = bucket_start(oldest[time_field], "day")
+    start = oldest_day if start is None else max(bucket_start(start, "day"), oldest_day)
+    if end is not None and start >= end:
+        return 0
+    bucket_range = {"$gte": start}
+    if end is not None:
+        bucket_range["$lt"] = end
+    for resolution in RESOLUTIONS:
+        deleted = db[collection_name(source, resolution)].delete_many({"bucket": bucket_range}).deleted_count
+        logging.info(f"[{source}] {resolution} 요약 {deleted}건 삭제")
+
+    projection = {field: 1 for field in (*config["keys"], time_field, *config["fields"])}
+    cursor = (db[config["archive"]].find({time_field: {"$type": "date", **bucket_range}}, projection)
+              .sort(time_field, ASCENDING))
+    batch, rows, buckets = [], 0, 0
+    for doc in cursor.batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            buckets += apply(db, source, batch)
+            rows += len(batch)
+            batch = []
+            logging.info(f"[{source}] {rows}행 반영")
+    buckets += apply(db, source, batch)
+    rows += len(batch)
+    logging.info(f"[{source}] 재계산 완료: {rows}행 → 요약 갱신 {buckets}건")
+    return rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="시간/일 요약 컬렉션 관리")
+    arg_parser.add_argument("command", choices=["rebuild"])
+    arg_parser.add_argument("--source", choices=list(SOURCES), action="append",
+                            help="대상 원본 컬렉션 (여러 번 지정 가능, 기본: 전체)")
+    arg_parser.add_argument("--start", help="시작일 (YYYY-MM-DD, 기본: 전체)")
+    arg_parser.add_argument("--end", help="종료일 (YYYY-MM-DD, 해당일 포함)")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    start_day = date_parser.parse(args.start) if args.start else None
+    end_day = date_parser.parse(args.end) + timedelta(days=1) if args.end else None
+    data_db = mongo.get_db()
+    for name in args.source or SOURCES:
+        rebuild(data_db, name, start=start_day, end=end_day)
@@ -1,11 +1,25 @@
 # telegram_notifier.py
 # 이 스크립트는 텔레그램 봇을 사용하여 특정 채팅 ID로 메시지를 전송하는 기능을 제공합니다.
-# 오류 발생 시 로그를 기록하며, 메시지를 성공적으로 전송했는지도 확인할 수 있습니다.
+# 수집 작업은 send_telegram_message()로 메시지를 큐에 넣기만 하고 바로 돌아가며,
+# 실제 전송은 백그라운드 전송 스레드가 커넥션 풀 세션으로 처리합니다.
+# - 채팅별 전송 간격 제한 및 429(Too Many Requests) 응답의 retry_after 준수
+# - MongoDB telegram_outbox 컬렉션에 메시지를 보관하여 실패한 메시지는 재시도 (재시작 후에도 이어서 전송)
+# - 큐 길이, 전송 지연 시간 등 지표 제공 (get_metrics)
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
-# from dotenv import load_dotenv # 이 라인을 제거합니다.
+import hashlib
 import logging
+import queue
+import threading
+import time
+import atexit
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+import metrics
+import mongo
+# from dotenv import load_dotenv # 이 라인을 제거합니다.
 
 # 환경 변수 로드 - Railway에서는 필요 없으므로 제거합니다.
 # load_dotenv()
@@ -17,19 +31,329 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s:%(message)s'
 )
 
-def send_telegram_message(token, chat_id, message):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    data = {
+# 전송 설정
+REQUEST_TIMEOUT = (5, 15)  # (연결, 읽기) 타임아웃(초)
+CHAT_MIN_INTERVAL = 1.0  # 같은 채팅으로 보내는 메시지 사이 최소 간격(초)
+BOT_MIN_INTERVAL = 1 / 30  # 봇 전체 초당 30건 제한
+MAX_ATTEMPTS = 8  # 최대 전송 시도 횟수 (초과 시 failed 처리)
+RETRY_BASE_SECONDS = 10  # 재시도 대기 시간 기준(초), 시도마다 2배씩 증가
+RETRY_MAX_SECONDS = 3600
+OUTBOX_POLL_SECONDS = 30  # 보관함 재시도 대상 확인 주기(초)
+OUTBOX_BATCH_SIZE = 50
+
+_queue = queue.Queue()  # 아직 보관함에 기록되지 않은 메시지
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_sender_thread = None
+_session = None
+_outbox = None
+
+# 봇 토큰은 보관함에 저장하지 않고 해시(token_id)만 저장
+_tokens = {}
+
+# 지표
+_metrics_lock = threading.Lock()
+_metrics = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "outbox_pending": 0,
+    "last_latency": None,
+    "max_latency": None,
+    "total_latency": 0.0
+}
+
+
+def _token_id(token):
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+
+def register_token(token):
+    """토큰을 등록하고 보관함에 저장할 token_id를 반환"""
+    token_id = _token_id(token)
+    _tokens[token_id] = token
+    return token_id
+
+
+# 재시작 후 보관함의 메시지를 재전송할 수 있도록 환경 변수의 봇 토큰을 미리 등록
+for _name, _value in os.environ.items():
+    if _name.startswith("TELEGRAM_") and _name.endswith("TOKEN") and _value:
+        register_token(_value)
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def _get_outbox():
+    """telegram_outbox 컬렉션 (연결 실패 시 None, 메모리 큐로만 전송)"""
+    global _outbox
+    if _outbox is None:
+        try:
+            outbox = mongo.collection("telegram_outbox")  # 수집 스크립트와 같은 커넥션 풀 사용
+            outbox.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+            _outbox = outbox
+        except Exception as e:
+            logging.error(f"Telegram 보관함 연결 실패, 메모리 큐로 전송: {e}")
+    return _outbox
+
+
+def _update_metrics(**changes):
+    with _metrics_lock:
+        for key, value in changes.items():
+            if key in ("enqueued", "sent", "retried", "failed"):
+                _metrics[key] += value
+            else:
+                _metrics[key] = value
+
+
+def get_metrics():
+    """큐 길이와 전송 지연 시간 지표"""
+    with _metrics_lock:
+        snapshot = dict(_metrics)
+    snapshot["queue_depth"] = _queue.qsize()
+    snapshot["avg_latency"] = snapshot["total_latency"] / snapshot["sent"] if snapshot["sent"] else None
+    return snapshot
+
+
+@metrics.register_collector
+def _collect_metrics():
+    """/metrics 출력용 텔레그램 전송 지표"""
+    snapshot = get_metrics()
+    return [
+        ("telegram_queue_depth", "gauge", "보관함에 기록되기 전 대기 중인 메시지 수",
+         [({}, snapshot["queue_depth"])]),
+        ("telegram_outbox_pending", "gauge", "보관함에서 전송 대기 중인 메시지 수",
+         [({}, snapshot["outbox_pending"])]),
+        ("telegram_messages_total", "counter", "결과별 텔레그램 메시지 수",
+         [({"result": result}, snapshot[result]) for result in ("enqueued", "sent", "retried", "failed")]),
+        ("telegram_send_latency_seconds_max", "gauge", "텔레그램 전송 최대 지연 시간(초)",
+         [({}, snapshot["max_latency"])]),
+    ]
+
+
+def send_telegram_message(token, chat_id, message, parse_mode="HTML"):
+    """
+    메시지를 전송 큐에 넣고 바로 반환합니다. (전송은 백그라운드 스레드에서 처리)
+    """
+    _queue.put({
+        "token_id": register_token(token),
         "chat_id": chat_id,
         "text": message,
-        "parse_mode": "HTML",  # HTML 포맷 사용
+        "parse_mode": parse_mode,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": datetime.now(),
+        "next_attempt_at": datetime.now()
+    })
+    _update_metrics(enqueued=1)
+    _ensure_sender()
+    _wakeup.set()
+
+
+def _ensure_sender():
+    global _sender_thread
+    with _start_lock:
+        if _sender_thread is None or not _sender_thread.is_alive():
+            _sender_thread = threading.Thread(target=_sender_loop, name="telegram_sender", daemon=True)
+            _sender_thread.start()
+
+
+class _RateLimiter:
+    """채팅별/봇별 최소 전송 간격과 429 응답에 따른 채팅별 전송 보류 시각을 관리"""
+
+    def __init__(self):
+        self._last_sent = {}
+        self._blocked_until = {}
+
+    def wait(self, key, min_interval):
+        """짧은 간격(봇 전체 초당 제한)은 잠시 대기한 뒤 전송 시각을 기록"""
+        elapsed = time.monotonic() - self._last_sent.get(key, 0)
+        if elapsed < min_interval:
+            time.sleep(min_interval - elapsed)
+        self._last_sent[key] = time.monotonic()
+
+    def ready_in(self, key, min_interval):
+        """key로 다시 보낼 수 있을 때까지 남은 시간(초), 0이면 바로 전송 가능 (대기하지 않음)"""
+        now = time.monotonic()
+        return max(self._last_sent.get(key, float("-inf")) + min_interval - now,
+                   self._blocked_until.get(key, 0) - now, 0)
+
+    def mark_sent(self, key):
+        self._last_sent[key] = time.monotonic()
+
+    def block(self, key, seconds):
+        """429 응답의 retry_after 동안 해당 채팅 전송 보류 (그 채팅 메시지만 다시 예약되고 다른 채팅은 계속 전송)"""
+        self._blocked_until[key] = time.monotonic() + seconds
+
+
+_rate_limiter = _RateLimiter()
+
+
+def _deliver(message):
+    """메시지 1건 전송. (성공 여부, 재시도까지 대기 시간) 반환"""
+    token = _tokens.get(message["token_id"])
+    if token is None:
+        logging.error("Telegram 메시지 전송 실패: 등록되지 않은 봇 토큰")
+        return False, None
+
+    _rate_limiter.wait(message["token_id"], BOT_MIN_INTERVAL)
+    _rate_limiter.mark_sent((message["token_id"], message["chat_id"]))
+
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    data = {
+        "chat_id": message["chat_id"],
+        "text": message["text"],
+        "parse_mode": message["parse_mode"],
         "disable_web_page_preview": True
     }
+    started = time.perf_counter()
     try:
-        response = requests.post(url, data=data)
+        response = _get_session().post(url, data=data, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429:
+            try:
+                retry_after = response.json().get("parameters", {}).get("retry_after", RETRY_BASE_SECONDS)
+            except ValueError:
+                retry_after = RETRY_BASE_SECONDS
+            _rate_limiter.block((message["token_id"], message["chat_id"]), retry_after)
+            logging.warning(f"Telegram 전송 제한(429), {retry_after}초 후 재시도")
+            return False, retry_after
         response.raise_for_status()
-        logging.info("Telegram 메시지가 성공적으로 전송되었습니다.")
-        print("Telegram 메시지가 성공적으로 전송되었습니다.")
     except requests.exceptions.RequestException as e:
         logging.error(f"Telegram 메시지 전송 실패: {e}")
-        print(f"Telegram 메시지 전송 실패: {e}")
\ No newline at end of file
+        return False, None
+
+    latency = time.perf_counter() - started
+    with _metrics_lock:
+        _metrics["sent"] += 1
+        _metrics["last_latency"] = latency
+        _metrics["max_latency"] = max(_metrics["max_latency"] or 0, latency)
+        _metrics["total_latency"] += latency
+    logging.info(f"Telegram 메시지가 성공적으로 전송되었습니다. ({latency:.2f}s)")
+    return True, None
+
+
+def _retry_delay(attempts, retry_after=None):
+    if retry_after is not None:
+        return retry_after
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+
+def _defer(message, outbox, seconds):
+    """
+    전송 간격/429 보류 중인 채팅의 메시지를 시도 횟수를 늘리지 않고 seconds 뒤로 다시 예약합니다.
+    (메모리 재시도 메시지, 다시 예약한 시각) 반환
+    """
+    next_attempt_at = datetime.now() + timedelta(seconds=seconds)
+    if outbox is not None and "_id" in message:
+        outbox.update_one({"_id": message["_id"]}, {"$set": {"next_attempt_at": next_attempt_at}})
+        return None, next_attempt_at
+    return {**message, "next_attempt_at": next_attempt_at}, next_attempt_at
+
+
+def _process(message, outbox):
+    """
+    메시지 1건을 전송하고 보관함 상태를 갱신 (보관함이 없으면 메모리에서 재시도).
+    (메모리 재시도 메시지, 다시 예약한 시각) 반환 - 전송을 미룬 경우에만 예약 시각이 있음
+    """
+    delay = _rate_limiter.ready_in((message["token_id"], message["chat_id"]), CHAT_MIN_INTERVAL)
+    if delay > 0:
+        return _defer(message, outbox, delay)
+
+    ok, retry_after = _deliver(message)
+    attempts = message["attempts"] + 1
+    if ok:
+        if outbox is not None and "_id" in message:
+            outbox.update_one({"_id": message["_id"]},
+                              {"$set": {"status": "sent", "sent_at": datetime.now(), "attempts": attempts}})
+        return None, None
+
+    status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+    next_attempt_at = datetime.now() + timedelta(seconds=_retry_delay(attempts, retry_after))
+    if status == "failed":
+        _update_metrics(failed=1)
+        logging.error(f"Telegram 메시지 {attempts}회 전송 실패, 포기: {message['text'][:50]}")
+    else:
+        _update_metrics(retried=1)
+    if outbox is not None and "_id" in message:
+        outbox.update_one({"_id": message["_id"]},
+                          {"$set": {"status": status, "attempts": attempts, "next_attempt_at": next_attempt_at}})
+        return None, None
+    if status == "pending":
+        return {**message, "attempts": attempts, "next_attempt_at": next_attempt_at}, None
+    return None, None
+
+
+def _sender_loop():
+    memory_retries = []  # 보관함을 사용할 수 없을 때의 재시도 목록
+    wait_seconds = OUTBOX_POLL_SECONDS
+    while True:
+        _wakeup.wait(wait_seconds)
+        _wakeup.clear()
+        outbox = _get_outbox()
+
+        # 1) 새 메시지를 보관함에 기록
+        new_messages = []
+        while True:
+            try:
+                new_messages.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        for message in new_messages:
+            if outbox is not None:
+                try:
+                    message["_id"] = outbox.insert_one(dict(message)).inserted_id
+                except Exception as e:
+                    logging.error(f"Telegram 보관함 기록 실패, 메모리에서 전송: {e}")
+            if "_id" not in message:
+                memory_retries.append(message)
+
+        # 2) 전송 대상: 보관함의 재시도 시각이 된 메시지 + 메모리 메시지
+        now = datetime.now()
+        due = []
+        if outbox is not None:
+            try:
+                due = list(outbox.find({"status": "pending", "next_attempt_at": {"$lte": now}})
+                           .sort("created_at", ASCENDING).limit(OUTBOX_BATCH_SIZE))
+                _update_metrics(outbox_pending=outbox.count_documents({"status": "pending"}))
+            except Exception as e:
+                logging.error(f"Telegram 보관함 조회 실패: {e}")
+                due = [message for message in new_messages if "_id" in message]
+        due += [message for message in memory_retries if message["next_attempt_at"] <= now]
+        memory_retries = [message for message in memory_retries if message["next_attempt_at"] > now]
+
+        # 전송 간격/429로 미룬 채팅은 건너뛰고 다른 채팅은 계속 전송 (전송 스레드에서 채팅 보류 시간만큼 대기하지 않음)
+        wake_at = None
+        for message in due:
+            try:
+                retry, deferred_at = _process(message, outbox)
+            except Exception as e:
+                logging.error(f"Telegram 메시지 처리 중 오류 발생: {e}")
+                retry, deferred_at = None, None
+            if retry is not None:
+                memory_retries.append(retry)
+            if deferred_at is not None and (wake_at is None or deferred_at < wake_at):
+                wake_at = deferred_at
+        if len(due) >= OUTBOX_BATCH_SIZE:
+            _wakeup.set()  # 남은 재시도 대상을 이어서 처리
+        # 미룬 메시지가 있으면 예약 시각에 맞춰 다시 확인
+        wait_seconds = OUTBOX_POLL_SECONDS
+        if wake_at is not None:
+            wait_seconds = min(max((wake_at - datetime.now()).total_seconds(), 0.05), OUTBOX_POLL_SECONDS)
+
+
+def flush(timeout=5.0):
+    """종료 전 큐에 남은 메시지를 전송할 시간을 줌"""
+    deadline = time.monotonic() + timeout
+    _wakeup.set()
+    while not _queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+atexit.register(flush)
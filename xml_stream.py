@@ -0,0 +1,163 @@
+# xml_stream.py
+# KHNP(data.khnp.co.kr) 및 공공데이터포털(apis.data.go.kr) 응답 XML을 스트리밍 방식으로 파싱하는 공통 모듈입니다.
+# 전체 DOM을 만들지 않고 응답 본문을 조각(chunk) 단위로 읽으면서 <item> 단위로 타입이 지정된 레코드를 반환합니다.
+# NPP_weather, NPP_radiation, Busan_radiation이 함께 사용합니다.
+
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+CHUNK_SIZE = 16 * 1024  # 응답 본문을 읽는 단위(바이트)
+
+KHNP_TIME_FORMAT = '%Y-%m-%d %H:%M'  # 예: 2025-07-08 10:35
+BUSAN_TIME_FORMAT = '%Y%m%d%H%M'  # 예: 202507080900
+
+
+# 원전 주변 방사선량 (radiorate)
+class RadiationItem(NamedTuple):
+    expl: Optional[str]
+    name: Optional[str]
+    time: Optional[datetime]
+    value: Optional[float]
+
+
+# 원전 기상 측정 항목 (weather)
+class WeatherItem(NamedTuple):
+    expl: Optional[str]
+    time: Optional[datetime]
+    value: Optional[float]
+
+
+# 원전 대기안정도 (air)
+class AirStabilityItem(NamedTuple):
+    time: Optional[datetime]
+    code: Optional[str]
+
+
+# 부산 환경방사선 (getEnvironmentalRadiationInfo)
+class BusanItem(NamedTuple):
+    locNm: Optional[str]
+    checkTime: Optional[datetime]
+    dose_nSv_h: Optional[float]
+    aveRainData: Optional[float]
+    lat: Optional[float]
+    lng: Optional[float]
+
+
+def to_float(text):
+    """숫자 문자열을 float으로 변환 (비어 있거나 잘못된 값이면 None)"""
+    try:
+        return float(text) if text else None
+    except ValueError:
+        return None
+
+
+def to_datetime(text, fmt):
+    """시간 문자열을 datetime으로 변환 (비어 있거나 잘못된 값이면 None)"""
+    try:
+        return datetime.strptime(text, fmt) if text else None
+    except ValueError:
+        return None
+
+
+def iter_chunks(source):
+    """bytes 또는 requests 응답 객체(stream=True 권장)를 조각 단위로 반환"""
+    if isinstance(source, (bytes, bytearray)):
+        for start in range(0, len(source), CHUNK_SIZE):
+            yield source[start:start + CHUNK_SIZE]
+    else:
+        yield from source.iter_content(chunk_size=CHUNK_SIZE)
+
+
+def iter_items(source, tag='item', header=None):
+    """
+    응답 본문을 점진적으로 파싱하여 <item>마다 {자식 태그: 텍스트} 딕셔너리를 반환합니다.
+    header 딕셔너리를 넘기면 item 밖의 단일 값 요소(totalCount, resultCode 등)를 채워줍니다.
+    잘못된 XML이면 ET.ParseError가 발생합니다.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    depth = 0  # 현재 item 내부 깊이
+
+    def drain():
+        nonlocal depth
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if elem.tag == tag or depth:
+                    depth += 1
+                continue
+            if depth:
+                depth -= 1
+                if depth == 0:
+                    yield {child.tag: (child.text or '').strip() for child in elem}
+                    elem.clear()  # 처리한 item은 즉시 메모리에서 해제
+            elif header is not None and len(elem) == 0:
+                header[elem.tag] = (elem.text or '').strip()
+
+    for chunk in iter_chunks(source):
+        parser.feed(chunk)
+        yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def parse_radiation(source):
+    """radiorate 응답을 RadiationItem으로 변환"""
+    for item in iter_items(source):
+        yield RadiationItem(
+            expl=item.get('expl'),
+            name=item.get('name'),
+            time=to_datetime(item.get('time'), KHNP_TIME_FORMAT),
+            value=to_float(item.get('value'))
+        )
+
+
+def parse_weather(source):
+    """weather 응답을 WeatherItem으로 변환"""
+    for item in iter_items(source):
+        yield WeatherItem(
+            expl=item.get('expl'),
+            time=to_datetime(item.get('time'), KHNP_TIME_FORMAT),
+            value=to_float(item.get('value'))
+        )
+
+
+def parse_air_stability(source):
+    """air 응답을 AirStabilityItem으로 변환"""
+    for item in iter_items(source):
+        yield AirStabilityItem(
+            time=to_datetime(item.get('time'), KHNP_TIME_FORMAT),
+            code=item.get('value') or None
+        )
+
+
+def parse_busan(source, header=None):
+    """getEnvironmentalRadiationInfo 응답을 BusanItem으로 변환 (header에 totalCount 등 기록)"""
+    for item in iter_items(source, header=header):
+        yield BusanItem(
+            locNm=item.get('locNm') or None,
+            checkTime=to_datetime(item.get('checkTime'), BUSAN_TIME_FORMAT),
+            dose_nSv_h=to_float(item.get('data')),
+            aveRainData=to_float(item.get('aveRainData')),
+            lat=to_float(item.get('lat')),
+            lng=to_float(item.get('lng'))
+        )
+
+
+# 파서 벤치마크: python xml_stream.py <radiation|weather|air|busan> <xml 파일> [반복 횟수]
+if __name__ == '__main__':
+    import sys
+    import time
+
+    parsers = {'radiation': parse_radiation, 'weather': parse_weather,
+               'air': parse_air_stability, 'busan': parse_busan}
+    kind, path = sys.argv[1], sys.argv[2]
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    with open(path, 'rb') as f:
+        body = f.read()
+
+    started = time.perf_counter()
+    count = 0
+    for _ in range(repeat):
+        count += sum(1 for _ in parsers[kind](body))
+    elapsed = time.perf_counter() - started
+    print(f"{kind}: {repeat}회, item {count}건, {elapsed:.3f}s ({count / elapsed:,.0f} items/s)")